@@ -4,7 +4,7 @@ import base64
 import logging
 
 import streamlit as st
-from rag.qa import ask_async
+from rag.qa import ask_stream, warm_up
 
 # --------------------------------------------------
 # Logging setup
@@ -22,6 +22,15 @@ st.set_page_config(
     initial_sidebar_state="auto"
 )
 
+# --------------------------------------------------
+# Warm the LLM once per server process (loads the model, caches the system prompt prefix)
+# --------------------------------------------------
+@st.cache_resource(show_spinner="Warming up the language model...")
+def warm_llm():
+    return warm_up()
+
+warm_llm()
+
 # --------------------------------------------------
 # Load and encode background image
 # --------------------------------------------------
@@ -190,7 +199,7 @@ with st.sidebar:
         st.session_state.messages = []
         st.rerun()
     st.markdown("---")
-    st.caption("**Der Kurator** – Porsche 911 RAG Assistant\nVersion 1.3 • Async + Cached")
+    st.caption("**Der Kurator** – Porsche 911 RAG Assistant\nVersion 1.4 • Streaming + Cached")
 
 # --------------------------------------------------
 # Header
@@ -260,8 +269,21 @@ if question := st.chat_input("Ask about Porsche 911 specs, variants, history, et
                 response_placeholder = st.empty()
                 status_placeholder = st.status("Retrieving and thinking...")
 
+                async def _stream_answer() -> dict:
+                    # Render tokens as they arrive; the final event carries the authoritative answer
+                    streamed = ""
+                    async for event in ask_stream(question):
+                        if event["type"] == "retrieval":
+                            status_placeholder.update(label=f"Found {len(event['chunks'])} passages, generating...")
+                        elif event["type"] == "token":
+                            streamed += event["text"]
+                            response_placeholder.markdown(streamed.lstrip() + "▌")
+                        elif event["type"] == "done":
+                            return event
+                    return {}
+
                 try:
-                    result = asyncio.run(ask_async(question))
+                    result = asyncio.run(_stream_answer())
                     answer = result.get("answer", "").strip()
                     citations = result.get("citations", [])
 
@@ -269,7 +291,10 @@ if question := st.chat_input("Ask about Porsche 911 specs, variants, history, et
                         answer = "I don't have sufficient information to answer this question."
 
                     # Update status and display answer
-                    status_placeholder.update(label="Complete!", state="complete")
+                    if result.get("degraded"):
+                        status_placeholder.update(label="Busy – showing retrieved passages only", state="error")
+                    else:
+                        status_placeholder.update(label="Complete!", state="complete")
                     response_placeholder.markdown(answer)
 
                     # Display sources
@@ -298,7 +323,7 @@ if question := st.chat_input("Ask about Porsche 911 specs, variants, history, et
                     })
 
                 except Exception as e:
-                    logger.error(f"Error in ask_async: {e}")
+                    logger.error(f"Error in ask_stream: {e}")
                     status_placeholder.update(label="Error occurred", state="error")
                     response_placeholder.error("Sorry, something went wrong. Please try again.")
                     st.session_state.messages.append({
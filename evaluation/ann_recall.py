@@ -0,0 +1,134 @@
+# evaluation/ann_recall.py
+# Recall@k, latency and memory footprint of approximate / compressed FAISS indexes against
+# exact (flat) search. Compressed modes are also measured after exact rescoring on vectors.npy.
+# Usage: python evaluation/ann_recall.py [--modes hnsw ivf_flat ivf_pq sq8 sqfp16 pq] [--k 10]
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import faiss
+import numpy as np
+
+# ---------------------------------------------------------
+# Project path setup
+# ---------------------------------------------------------
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR))
+
+from rag.index_factory import (
+    COMPRESSED_MODES, RESCORE_FACTOR, MultiIndex, build_index, index_mode, index_nbytes, recall_at_k, rescore_exact
+)
+from rag.retriever import VECTOR_STORE_PATH
+from rag.segments import open_vector_store
+from evaluation.dataset import EVAL_QUESTIONS
+
+NPROBE_SWEEP = [1, 4, 8, 16, 32, 64]
+EF_SEARCH_SWEEP = [16, 32, 64, 128, 256]
+
+# ---------------------------------------------------------
+# Query set: evaluation questions + a sample of stored chunks
+# ---------------------------------------------------------
+def build_queries(vectors: np.ndarray, num_sampled: int = 200) -> np.ndarray:
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer("all-mpnet-base-v2")
+    questions = model.encode(
+        [item["question"] for item in EVAL_QUESTIONS],
+        normalize_embeddings=True
+    ).astype("float32")
+
+    rng = np.random.default_rng(0)
+    sampled = vectors[rng.choice(len(vectors), min(num_sampled, len(vectors)), replace=False)]
+    return np.ascontiguousarray(np.vstack([questions, sampled]), dtype="float32")
+
+def timed_search(index, queries: np.ndarray, k: int, rescore_vectors=None, to_rows=None):
+    # to_rows maps the stable chunk ids of an id-mapped index back to vectors.npy rows
+    to_rows = to_rows or (lambda ids: ids)
+    start = time.perf_counter()
+    if rescore_vectors is None:
+        _, ids = index.search(queries, k)
+        ids = to_rows(ids)
+    else:
+        _, wide = index.search(queries, min(k * RESCORE_FACTOR, index.ntotal))
+        _, ids = rescore_exact(queries, to_rows(wide), rescore_vectors, k)
+    latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return ids, latency_ms
+
+# ---------------------------------------------------------
+# Report
+# ---------------------------------------------------------
+def recall_report(modes, k: int = 10) -> dict:
+    persisted = open_vector_store(VECTOR_STORE_PATH)
+    if persisted.vectors is None:
+        raise SystemExit("No vectors.npy in the vector store, re-run ingest.py")
+    rescore_vectors = persisted.vectors  # what the Retriever rescores against (rows of all segments)
+    vectors = np.ascontiguousarray(rescore_vectors[np.arange(len(rescore_vectors))], dtype="float32")
+    queries = build_queries(vectors)
+
+    exact = faiss.IndexFlatIP(vectors.shape[1])
+    exact.add(vectors)
+    exact_ids, exact_ms = timed_search(exact, queries, k)
+
+    report = {
+        "num_vectors": len(vectors),
+        "num_queries": len(queries),
+        "k": k,
+        "exact": {"latency_ms": round(exact_ms, 3), "index_mb": round(index_nbytes(exact) / 2**20, 2)},
+    }
+
+    # Built indexes are searched like the persisted segments: through a MultiIndex, here of one index
+    candidates = {f"built:{mode}": None for mode in modes}
+    candidates["persisted"] = persisted.index
+
+    for name, index in candidates.items():
+        to_rows, segment_modes = None, persisted.modes
+        if index is None:
+            built, _ = build_index(vectors, mode=name.split(":", 1)[1])
+            index, segment_modes = MultiIndex([built], built.d), [index_mode(built)]
+        elif persisted.id_mapped:
+            to_rows = persisted.store.rows_for_ids
+
+        if "hnsw" in segment_modes:
+            sweep = [(f"efSearch={ef}", {"ef_search": ef}) for ef in EF_SEARCH_SWEEP]
+        elif {"ivf_flat", "ivf_pq"} & set(segment_modes):
+            sweep = [(f"nprobe={n}", {"nprobe": n}) for n in NPROBE_SWEEP]
+        else:
+            sweep = [("default", {})]
+
+        rows = {
+            "mode": "+".join(sorted(set(segment_modes))),
+            "segments": len(index.indexes),
+            "index_mb": round(sum(index_nbytes(part) for part in index.indexes) / 2**20, 2),
+        }
+        for label, params in sweep:
+            index.configure(**params)
+            approx_ids, approx_ms = timed_search(index, queries, k, to_rows=to_rows)
+            rows[label] = {
+                f"recall@{k}": round(recall_at_k(exact_ids, approx_ids, k), 4),
+                "latency_ms": round(approx_ms, 3),
+            }
+            if set(segment_modes) & set(COMPRESSED_MODES):
+                rescored_ids, rescored_ms = timed_search(index, queries, k, rescore_vectors, to_rows)
+                rows[label].update({
+                    f"rescored_recall@{k}": round(recall_at_k(exact_ids, rescored_ids, k), 4),
+                    "rescored_latency_ms": round(rescored_ms, 3),
+                })
+        report[name] = rows
+
+    return report
+
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ANN recall@k vs exact search")
+    parser.add_argument("--modes", nargs="*", default=["hnsw", "ivf_flat", "ivf_pq", "sq8", "sqfp16", "pq"])
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    report = recall_report(args.modes, k=args.k)
+    with open(ROOT_DIR / "evaluation" / "ann_recall_results.json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
@@ -6,7 +6,6 @@ import json
 import time
 import re
 from pathlib import Path
-import ollama
 import numpy as np
 from typing import List, Dict
 
@@ -16,7 +15,9 @@ from typing import List, Dict
 ROOT_DIR = Path(__file__).resolve().parents[1]
 sys.path.insert(0, str(ROOT_DIR))
 
-from rag.qa import ask
+from rag.qa import KEEP_ALIVE, LLM_MODEL, ask
+from rag.scheduler import BATCH
+from rag.llm_client import get_llm_client
 from rag.retriever import Retriever
 from rag.prompt import PROMPT_TEMPLATE
 from evaluation.dataset import EVAL_QUESTIONS
@@ -155,10 +156,11 @@ relevance, specificity, faithfulness, completeness, conciseness
     prompt = PROMPT_TEMPLATE.format(context=judge_context, question=task)
 
     try:
-        resp = ollama.chat(
-            model="mistral:7b-instruct-q4_0",
+        resp = get_llm_client().chat_sync(
+            model=LLM_MODEL,
             messages=[{"role": "user", "content": prompt}],
-            options={"temperature": 0.2}
+            options={"temperature": 0.2},
+            keep_alive=KEEP_ALIVE
         )
         return json.loads(resp["message"]["content"])
     except:
@@ -178,11 +180,13 @@ def evaluate_end_to_end():
 
     scores = {k: [] for k in ["relevance", "specificity", "faithfulness", "completeness", "conciseness"]}
 
-    for item in EVAL_QUESTIONS:
+    # Retrieve evaluation context for all questions in one batched pass
+    retrieved_all = retriever.retrieve_batch([item["question"] for item in EVAL_QUESTIONS])
+
+    for item, retrieved in zip(EVAL_QUESTIONS, retrieved_all):
         q = item["question"]
-        res = ask(q)
+        res = ask(q, priority=BATCH)
         answer = res.get("answer", "").strip()
-        retrieved = retriever.retrieve(q)
         context = "\n".join(r["content"] for r in retrieved)
 
         abstained = is_abstention(answer)
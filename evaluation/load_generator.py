@@ -0,0 +1,126 @@
+# evaluation/load_generator.py
+# Throughput and latency of a running server.py at increasing client concurrency.
+# Each level runs N clients that send the evaluation questions back to back for --requests requests
+# in total; the encode batcher counters from /stats show how much batching the level produced.
+# /ask answers the server shed (degraded) or cut off (truncated) are counted apart from full answers,
+# and throughput / latency cover full answers only, so a level does not report load shedding as speed.
+# Usage:
+#   python server.py --port 8080 &
+#   python evaluation/load_generator.py [--url http://127.0.0.1:8080] [--endpoint retrieve|ask]
+#       [--priority interactive|batch] [--concurrency 1 8 32]
+
+import sys
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import Counter
+from pathlib import Path
+import numpy as np
+import aiohttp
+
+# ---------------------------------------------------------
+# Project path setup
+# ---------------------------------------------------------
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR))
+
+from evaluation.dataset import EVAL_QUESTIONS
+
+# ---------------------------------------------------------
+# Load generation
+# ---------------------------------------------------------
+def payload(endpoint: str, question: str, priority: str) -> dict:
+    if endpoint == "retrieve":
+        return {"query": question}
+    return {"question": question, "priority": priority}
+
+def outcome(body: dict) -> str:
+    for flag in ("degraded", "truncated"):
+        if body.get(flag):
+            return flag
+    return "ok"
+
+async def client(session, url: str, endpoint: str, priority: str, questions, counter, latencies, outcomes, errors):
+    while True:
+        i = next(counter)
+        if i >= len(questions):
+            return
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{url}/{endpoint}", json=payload(endpoint, questions[i], priority)) as response:
+                body = await response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                    continue
+        except aiohttp.ClientError as e:
+            errors.append(str(e))
+            continue
+        result = outcome(json.loads(body))
+        outcomes[result] += 1
+        if result == "ok":
+            latencies.append(time.perf_counter() - start)
+
+async def encode_stats(session, url: str) -> dict:
+    async with session.get(f"{url}/stats") as response:
+        return (await response.json()).get("encode_batcher") or {}
+
+async def run_level(url: str, endpoint: str, priority: str, concurrency: int, num_requests: int) -> dict:
+    pool = [item["question"] for item in EVAL_QUESTIONS]
+    # Vary the wording per request so the retrieval / embedding caches do not answer everything
+    questions = [f"{pool[i % len(pool)]} ({i})" for i in range(num_requests)]
+    counter = itertools.count()  # shared request index; all clients run on one loop
+
+    latencies, outcomes, errors = [], Counter(), []
+    timeout = aiohttp.ClientTimeout(total=None)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        before = await encode_stats(session, url)
+        start = time.perf_counter()
+        await asyncio.gather(*(
+            client(session, url, endpoint, priority, questions, counter, latencies, outcomes, errors)
+            for _ in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - start
+        after = await encode_stats(session, url)
+
+    batches = after.get("batches", 0) - before.get("batches", 0)
+    encoded = after.get("requests", 0) - before.get("requests", 0)
+    ms = np.asarray(latencies) * 1000 if latencies else np.zeros(1)
+    return {
+        "concurrency": concurrency,
+        "requests": num_requests,
+        "errors": len(errors),
+        "degraded": outcomes["degraded"],
+        "truncated": outcomes["truncated"],
+        "throughput_rps": round(len(latencies) / elapsed, 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(ms, 50)), 1),
+            "p95": round(float(np.percentile(ms, 95)), 1),
+            "p99": round(float(np.percentile(ms, 99)), 1),
+            "mean": round(float(ms.mean()), 1),
+        },
+        "encode_requests_per_batch": round(encoded / batches, 2) if batches else None,
+    }
+
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load generator for server.py")
+    parser.add_argument("--url", default="http://127.0.0.1:8080")
+    parser.add_argument("--endpoint", choices=["retrieve", "ask"], default="retrieve")
+    parser.add_argument("--priority", choices=["interactive", "batch"], default="interactive",
+                        help="/ask priority; batch requests beyond the server's queue are shed")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    args = parser.parse_args()
+
+    report = {"url": args.url, "endpoint": args.endpoint, "priority": args.priority, "levels": []}
+    for concurrency in args.concurrency:
+        level = asyncio.run(run_level(args.url, args.endpoint, args.priority, concurrency, args.requests))
+        print(json.dumps(level))
+        report["levels"].append(level)
+
+    with open(ROOT_DIR / "evaluation" / "load_results.json", "w") as f:
+        json.dump(report, f, indent=2)
@@ -0,0 +1,98 @@
+# evaluation/prefill_benchmark.py
+# Prefill (prompt evaluation) time of the two prompt layouts, as reported by Ollama:
+# - single_message: rules + context + question in one user message, server-default keep_alive (old layout)
+# - system_prefix:  rules as a fixed system message, explicit keep_alive, warmed prefix (current layout)
+# Each request generates a single token, so the timings are prefill only.
+# Usage: python evaluation/prefill_benchmark.py [--host http://localhost:11434] [--limit 20]
+# (--host may point at a local stand-in that speaks the Ollama chat API)
+
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+
+# ---------------------------------------------------------
+# Project path setup
+# ---------------------------------------------------------
+ROOT_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT_DIR))
+
+from rag.context import pack_context
+from rag.llm_client import LLMClient
+from rag.prompt import PROMPT_TEMPLATE, SYSTEM_PROMPT, build_messages
+from rag.qa import KEEP_ALIVE, LLM_MODEL, retriever
+from evaluation.dataset import EVAL_QUESTIONS
+
+# ---------------------------------------------------------
+# Prompt layouts
+# ---------------------------------------------------------
+def single_message(context: str, question: str):
+    return [{"role": "user", "content": PROMPT_TEMPLATE.format(context=context, question=question)}]
+
+LAYOUTS = {
+    "single_message": {"messages": single_message, "keep_alive": None, "warm": False},
+    "system_prefix": {"messages": build_messages, "keep_alive": KEEP_ALIVE, "warm": True},
+}
+
+# ---------------------------------------------------------
+# Benchmark
+# ---------------------------------------------------------
+def summarize(values):
+    values = np.asarray(values, dtype=float)
+    return {
+        "mean": round(float(values.mean()), 2),
+        "p50": round(float(np.percentile(values, 50)), 2),
+        "p95": round(float(np.percentile(values, 95)), 2),
+    }
+
+def prefill_report(client: LLMClient, model: str, limit: int) -> dict:
+    questions = [item["question"] for item in EVAL_QUESTIONS[:limit]]
+    contexts = [pack_context(retrieved).text for retrieved in retriever.retrieve_batch(questions)]
+
+    report = {"model": model, "num_questions": len(questions)}
+    for name, layout in LAYOUTS.items():
+        if layout["warm"]:
+            client.ensure_warm(
+                model, keep_alive=layout["keep_alive"],
+                prefix_messages=[{"role": "system", "content": SYSTEM_PROMPT}]
+            )
+
+        prefill_ms, load_ms, prompt_tokens, wall_ms = [], [], [], []
+        for question, context in zip(questions, contexts):
+            start = time.perf_counter()
+            response = client.chat_sync(
+                model=model,
+                messages=layout["messages"](context, question),
+                options={"temperature": 0.0, "num_ctx": 8192, "num_predict": 1},
+                keep_alive=layout["keep_alive"],
+            )
+            wall_ms.append((time.perf_counter() - start) * 1000)
+            prefill_ms.append(response.get("prompt_eval_duration", 0) / 1e6)
+            load_ms.append(response.get("load_duration", 0) / 1e6)
+            prompt_tokens.append(response.get("prompt_eval_count", 0))
+
+        report[name] = {
+            "prefill_ms": summarize(prefill_ms),
+            "evaluated_prompt_tokens": summarize(prompt_tokens),  # drops when a cached prefix is reused
+            "load_ms": summarize(load_ms),
+            "wall_ms": summarize(wall_ms),
+        }
+
+    return report
+
+# ---------------------------------------------------------
+# Main
+# ---------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prefill time: single-message vs stable system prefix")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--model", default=LLM_MODEL)
+    parser.add_argument("--limit", type=int, default=len(EVAL_QUESTIONS))
+    args = parser.parse_args()
+
+    report = prefill_report(LLMClient(host=args.host, max_concurrency=1), args.model, args.limit)
+    with open(ROOT_DIR / "evaluation" / "prefill_results.json", "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
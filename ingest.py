@@ -1,27 +1,55 @@
 # ingest.py (Updated: Structure-Aware + Variant-Aware Hybrid Chunking using Unstructured)
 # Production enhancements:
 # - Parallel file processing using multiprocessing for speed (CPU-bound tasks like partitioning and cleaning).
+# - Streaming pipeline: parsed files flow (unordered) through a bounded queue into an embedding thread that
+#   encodes in batches spanning files, so parsing and embedding overlap; per-stage files/s and chunks/s are logged.
+# - Page-range sharding: PDFs / PPTX decks longer than SHARD_PAGES are split into page ranges parsed as
+#   separate tasks (preprocessing/sharding.py) and merged back in page order with document-wide element_index.
 # - Robust error handling: Failures on individual files are logged and skipped without halting the pipeline.
-# - Incremental index building: Embeddings are generated and added to FAISS in batches per file to manage memory and allow partial progress.
-# - Resumability: Tracks processed files in a separate pickle file to skip already ingested files on restarts.
+# - Incremental embedding: Chunks are encoded in fixed-size batches (EMBED_BATCH_CHUNKS) as files arrive, to manage memory.
+# - Incremental re-ingestion: a manifest (rag/manifest.py) records each file's content hash and chunk ids.
+#   Only new / changed files are parsed and embedded; the old chunks of changed and deleted files are tombstoned.
+#   It is published in segments.json together with the segment and tombstones it describes, so a crashed
+#   run leaves both at the previous generation and its files are simply ingested again.
+# - Segmented store: each run writes its new chunks as one immutable segment (rag/segments.py: index keyed by
+#   stable chunk ids, vectors, chunk store, BM25) and publishes it in segments.json; nothing existing is rewritten.
+# - Merging: past MAX_SEGMENTS segments, or once a segment's tombstones reach COMPACT_TOMBSTONE_RATIO, adjacent
+#   segments are merged without their tombstones (index rebuilt and retrained); --compact merges all of them.
 # - Logging: Uses Python's logging module for better monitoring and debugging.
 # - Configurability: Uses environment variables or defaults for paths.
 # - Batch encoding: Limits batch size during encoding to prevent OOM for large files.
+# - Index modes: Builds a flat, HNSW, IVF-Flat or IVF-PQ index per segment (auto-selected from its size, or INDEX_MODE).
+#   Raw embeddings are kept in vectors.npy so approximate indexes can be retrained when segments merge.
+# - Chunk store: Texts and metadata are written as a memory-mappable columnar store (rag/chunk_store.py).
+# - Lexical index: A BM25 inverted index (rag/lexical.py) is built for every segment for hybrid retrieval.
+# - Spec store: (variant, metric, value, unit) tuples from Table / NarrativeText chunks go to a SQLite spec store
+#   (rag/spec_store.py) so plain spec lookups can be answered without the LLM. Each run writes an updated copy,
+#   published in segments.json with the segment, so servers never see specs of chunks they cannot search yet.
 
 import os
+import argparse
 import copy
 import logging
 import pickle
+import queue
+import threading
+import time
 from multiprocessing import Pool, cpu_count
+from typing import Dict, List, NamedTuple, Tuple
 
 from sentence_transformers import SentenceTransformer
-import faiss
+import numpy as np
 
 # Unstructured.io for advanced structure-aware, document-type-aware partitioning
 from unstructured.partition.auto import partition
 
 # Optional: Keep your existing cleaner if needed (recommended)
 from preprocessing.cleaner import clean_text
+from preprocessing.sharding import SHARD_PAGES, extract_pages, plan_shards
+from rag.chunk_store import MISSING
+from rag.manifest import Manifest, file_hash
+from rag.segments import SegmentSet, merge_segments, open_vector_store, plan_merge, write_segment
+from rag.spec_store import update_spec_store, write_spec_store
 
 # Setup logging
 logging.basicConfig(
@@ -40,37 +68,46 @@ VECTOR_STORE_DIR = os.environ.get("VECTOR_STORE_DIR", "embeddings/vector_store")
 os.makedirs(RAW_DATA_PATH, exist_ok=True)
 os.makedirs(VECTOR_STORE_DIR, exist_ok=True)
 
-INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "index.faiss")
-DATA_PATH = os.path.join(VECTOR_STORE_DIR, "data.pkl")
-PROCESSED_FILES_PATH = os.path.join(VECTOR_STORE_DIR, "processed_files.pkl")
-
-# Load existing vector store and processed files if they exist
-if os.path.exists(INDEX_PATH) and os.path.exists(DATA_PATH):
-    logging.info("Loading existing FAISS index and data...")
-    index = faiss.read_index(INDEX_PATH)
-    with open(DATA_PATH, "rb") as f:
-        all_chunks, all_metadata = pickle.load(f)
-else:
-    logging.info("Initializing new FAISS index...")
-    index = faiss.IndexFlatIP(dimension)  # Inner product for cosine similarity (normalized)
-    all_chunks = []
-    all_metadata = []
-
-if os.path.exists(PROCESSED_FILES_PATH):
-    with open(PROCESSED_FILES_PATH, "rb") as f:
-        processed_files = pickle.load(f)
-else:
-    processed_files = set()
-
-def process_file(file_info):
-    file_path, filename = file_info
+INDEX_PATH = os.path.join(VECTOR_STORE_DIR, "index.faiss")  # pre-segment layout, migrated to a first segment once
+SPEC_STORE_PATH = os.path.join(VECTOR_STORE_DIR, "specs.sqlite")  # legacy, now published with the segments
+SPEC_STAGING_PATH = os.path.join(VECTOR_STORE_DIR, "specs-staging.sqlite")  # written, then published by segset.save
+PROCESSED_FILES_PATH = os.path.join(VECTOR_STORE_DIR, "processed_files.pkl")  # legacy, migrated to the manifest
+MANIFEST_PATH = os.path.join(VECTOR_STORE_DIR, "manifest.json")  # legacy, now published with the segments
+
+# Embedding stage: chunks per encode call (across files) and parsed files allowed to wait for it
+EMBED_BATCH_CHUNKS = int(os.environ.get("EMBED_BATCH_CHUNKS", "256"))
+EMBED_QUEUE_FILES = int(os.environ.get("EMBED_QUEUE_FILES", "4"))
+
+# flat | hnsw | ivf_flat | ivf_pq | auto (picked from corpus size)
+INDEX_MODE = os.environ.get("INDEX_MODE", "auto")
+
+class ParseResult(NamedTuple):
+    filename: str
+    shard: int              # position of the page range in the document (0 when not sharded)
+    chunks: List[str]
+    metadata: List[Dict]    # element_index relative to the shard until merge_shards()
+    num_elements: int       # partitioned elements, including the empty ones skipped as chunks
+    seconds: float
+    ok: bool
+
+def process_file(task):
+    """Partition one file, or one page range of it: task = (file_path, filename, (shard, (first, last)) or None)."""
+    file_path, filename, shard = task
+    shard_index, pages = shard if shard is not None else (0, None)
+    label = filename if pages is None else f"{filename} [pages {pages[0]}-{pages[1]}]"
     chunks = []
     metadata_list = []
+    start = time.perf_counter()
 
     try:
-        logging.info(f"Processing {filename}...")
+        logging.info(f"Processing {label}...")
         # Auto-partition: detects file type and applies best strategy
-        elements = partition(filename=file_path)
+        if pages is None:
+            elements = partition(filename=file_path)
+        else:
+            with extract_pages(file_path, pages) as shard_path:
+                elements = partition(filename=shard_path)
+        page_offset = pages[0] - 1 if pages is not None else 0
 
         for elem_idx, element in enumerate(elements):
             # Extract clean text from element
@@ -105,67 +142,311 @@ def process_file(file_info):
 
             # Add page number if available (PDFs)
             if hasattr(element, "metadata") and getattr(element.metadata, "page_number", None) is not None:
-                metadata["page"] = element.metadata.page_number
+                metadata["page"] = element.metadata.page_number + page_offset  # page in the whole document
 
             metadata_list.append(copy.deepcopy(metadata))
 
-        logging.info(f"Generated {len(chunks)} chunks from {filename}.")
-        return chunks, metadata_list
+        logging.info(f"Generated {len(chunks)} chunks from {label}.")
+        return ParseResult(filename, shard_index, chunks, metadata_list, len(elements), time.perf_counter() - start, True)
 
     except Exception as e:
-        logging.error(f"Error processing {filename}: {str(e)}")
-        return [], []
+        logging.error(f"Error processing {label}: {str(e)}")
+        return ParseResult(filename, shard_index, [], [], 0, time.perf_counter() - start, False)
 
-def main():
-    global all_chunks, all_metadata, index, processed_files
+def merge_shards(results: List[ParseResult]) -> Tuple[List[str], List[Dict]]:
+    """Chunks and metadata of a whole document from its shards, in page order, with document-wide element_index."""
+    chunks, metadata_list, offset = [], [], 0
+    for result in sorted(results, key=lambda r: r.shard):
+        chunks.extend(result.chunks)
+        for metadata in result.metadata:
+            metadata_list.append({**metadata, "element_index": metadata["element_index"] + offset})
+        offset += result.num_elements
+    return chunks, metadata_list
+
+class StageStats:
+    """Items / chunks through one pipeline stage and the time it spent working on them."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.items = 0
+        self.chunks = 0
+        self.busy = 0.0
+        self.started = time.perf_counter()
+
+    def add(self, items: int, chunks: int, busy: float = 0.0) -> None:
+        self.items += items
+        self.chunks += chunks
+        self.busy += busy
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"{self.name}: {self.items} files, {self.chunks} chunks "
+                f"({self.items / elapsed:.2f} files/s, {self.chunks / elapsed:.1f} chunks/s, "
+                f"busy {self.busy:.1f}s of {elapsed:.1f}s)")
 
-    files_to_process = []
-    for file in os.listdir(RAW_DATA_PATH):
-        file_path = os.path.join(RAW_DATA_PATH, file)
-        if file in processed_files:
-            logging.info(f"Skipping already processed file: {file}")
-            continue
-        files_to_process.append((file_path, file))
+class EmbedStage(threading.Thread):
+    """
+    Consumes parsed files from a bounded queue and encodes their chunks in batches that span files,
+    so small files do not each pay for a half-empty batch. Appends chunks, metadata and vectors in lockstep.
+    """
 
-    if not files_to_process:
-        logging.info("No new files to process.")
-        return
+    def __init__(self, files: queue.Queue, in_flight: threading.Semaphore, total_files: int):
+        super().__init__(name="embed", daemon=True)
+        self.files = files
+        self.in_flight = in_flight
+        self.total_files = total_files
+        self.stats = StageStats("embed")
+        self.chunks, self.metadata, self.vectors = [], [], []
+        self.done_files = []
+        self.error = None
+        self._pending_chunks, self._pending_metadata = [], []
 
-    # Parallel processing with multiprocessing Pool
+    def run(self) -> None:
+        while True:
+            item = self.files.get()
+            if item is None:
+                break
+            self.in_flight.release()  # the parse stage may start another file
+            if self.error is not None:
+                continue  # keep draining so the parse stage never blocks on a dead consumer
+            filename, chunks, metadata_list = item
+            try:
+                self._pending_chunks.extend(chunks)
+                self._pending_metadata.extend(metadata_list)
+                self.done_files.append(filename)
+                self.stats.add(1, 0)
+                while len(self._pending_chunks) >= EMBED_BATCH_CHUNKS:
+                    self._encode(EMBED_BATCH_CHUNKS)
+            except Exception as e:
+                self.error = e
+        if self.error is None:
+            try:
+                self._encode(len(self._pending_chunks))
+            except Exception as e:
+                self.error = e
+
+    def _encode(self, n: int) -> None:
+        if n == 0:
+            return
+        chunks, self._pending_chunks = self._pending_chunks[:n], self._pending_chunks[n:]
+        metadata, self._pending_metadata = self._pending_metadata[:n], self._pending_metadata[n:]
+        start = time.perf_counter()
+        embeddings = model.encode(
+            chunks,
+            batch_size=32,  # Smaller batch size for memory safety
+            normalize_embeddings=True
+        )
+        self.vectors.append(embeddings.astype('float32'))
+        self.chunks.extend(chunks)
+        self.metadata.extend(metadata)
+        self.stats.add(0, n, time.perf_counter() - start)
+        logging.info(f"Embedded {self.stats.chunks} chunks ({self.stats.items}/{self.total_files} files received, "
+                     f"{self.files.qsize()} waiting) – {self.stats.summary()}")
+
+def parse_and_embed(files_to_process: List[Tuple[str, str]]) -> "EmbedStage":
+    """Parse (file_path, filename) pairs and embed their chunks; the returned stage holds the results."""
+    # Large PDFs / decks become several page-range tasks so they are spread over all workers
+    tasks = []
+    shards_per_file = {}
+    for file_path, filename in files_to_process:
+        shards = plan_shards(file_path)
+        shards_per_file[filename] = len(shards)
+        if len(shards) > 1:
+            logging.info(f"Sharding {filename} into {len(shards)} page ranges of up to {SHARD_PAGES} pages")
+        tasks.extend((file_path, filename, (i, pages) if pages else None) for i, pages in enumerate(shards))
+
+    # Streaming pipeline: parse workers -> bounded queue -> embedding thread.
+    # At most num_workers + EMBED_QUEUE_FILES tasks are parsed but not yet picked up by the embedder,
+    # so a slow embedder throttles parsing instead of piling results up in memory.
     num_workers = max(1, cpu_count() - 1)  # Leave one core free
+    parsed_files: queue.Queue = queue.Queue(maxsize=EMBED_QUEUE_FILES)
+    in_flight = threading.Semaphore(num_workers + EMBED_QUEUE_FILES)
+    embedder = EmbedStage(parsed_files, in_flight, len(files_to_process))
+    embedder.start()
+
+    def admitted_tasks():
+        # Runs in the pool's task-feeder thread; blocks while too many tasks are in flight
+        for task in tasks:
+            in_flight.acquire()
+            yield task
+
+    parse_stats = StageStats("parse")
+    shard_results = {}
     with Pool(num_workers) as pool:
-        results = pool.map(process_file, files_to_process)
-
-    # Collect results and add incrementally to avoid memory spikes
-    for chunks, metadata_list in results:
-        if chunks:
-            logging.info(f"Encoding {len(chunks)} chunks...")
-            embeddings = model.encode(
-                chunks,
-                batch_size=32,  # Smaller batch size for memory safety
-                show_progress_bar=True,
-                normalize_embeddings=True
-            )
-            index.add(embeddings.astype('float32'))
-
-            all_chunks.extend(chunks)
-            all_metadata.extend(metadata_list)
-
-            # Update processed files (using the filename from files_to_process)
-            # Note: Since map preserves order, we can zip
-    for (file_path, filename), (chunks, _) in zip(files_to_process, results):
-        if chunks:  # Only mark as processed if successfully generated chunks
-            processed_files.add(filename)
-
-    # Save everything
-    logging.info("Saving updated vector store...")
-    faiss.write_index(index, INDEX_PATH)
-    with open(DATA_PATH, "wb") as f:
-        pickle.dump((all_chunks, all_metadata), f)
-    with open(PROCESSED_FILES_PATH, "wb") as f:
-        pickle.dump(processed_files, f)
-
-    logging.info(f"Ingestion complete! Processed {len(files_to_process)} files, total chunks: {len(all_chunks)}.")
+        # Unordered: one slow PDF no longer holds back the files that finished after it started
+        for result in pool.imap_unordered(process_file, admitted_tasks()):
+            done = shard_results.setdefault(result.filename, [])
+            done.append(result)
+            if len(done) < shards_per_file[result.filename]:
+                in_flight.release()  # partial document, held here until its other shards arrive
+                continue
+
+            del shard_results[result.filename]
+            chunks, metadata_list = merge_shards(done)
+            parse_stats.add(1, len(chunks), sum(r.seconds for r in done))
+            logging.info(f"Parsed {parse_stats.items}/{len(files_to_process)} files – {parse_stats.summary()}")
+            if not all(r.ok for r in done):
+                logging.error(f"Skipping {result.filename}: {sum(not r.ok for r in done)} page range(s) failed")
+                chunks = []
+            if chunks:
+                parsed_files.put((result.filename, chunks, metadata_list))  # blocks when the embedder is behind
+            else:
+                in_flight.release()
+    parsed_files.put(None)
+    embedder.join()
+    if embedder.error is not None:
+        raise embedder.error
+
+    logging.info(parse_stats.summary())
+    logging.info(embedder.stats.summary())
+
+    return embedder
+
+def migrate_store() -> SegmentSet:
+    """
+    Segments of the vector store. A store written before segments (top-level index.faiss + chunk store or
+    data.pkl) is rewritten once as a first segment holding its live rows, keeping their chunk ids.
+    """
+    segset = SegmentSet.load(VECTOR_STORE_DIR)
+    if segset is not None:
+        return segset
+
+    segset = SegmentSet(dimension)
+    if os.path.exists(INDEX_PATH):
+        logging.info("Migrating the existing vector store to a first segment...")
+        legacy = open_vector_store(VECTOR_STORE_DIR, mmap=False)
+        rows = np.flatnonzero(~legacy.store.columns["deleted"])
+        chunk_ids = np.asarray(legacy.store.columns["chunk_id"])[rows]
+        if legacy.vectors is not None:
+            vectors = np.asarray(legacy.vectors[rows])
+        else:
+            # Stores written before vectors.npy existed only hold a flat index, which can be reconstructed
+            vectors = legacy.index.reconstruct_batch(chunk_ids if legacy.id_mapped else rows)
+        if len(rows):
+            chunks = legacy.store.texts(rows)
+            metadata = [legacy.store.metadata(row) for row in rows]
+            segset.segments.append(write_segment(
+                VECTOR_STORE_DIR, segset.next_name(), chunks, metadata, vectors, chunk_ids, INDEX_MODE
+            ))
+            write_spec_store(SPEC_STAGING_PATH, chunks, metadata, chunk_ids)  # keyed by chunk id from now on
+    else:
+        logging.info("Initializing new vector store...")
+    segset.save(VECTOR_STORE_DIR, spec_store=SPEC_STAGING_PATH if os.path.exists(SPEC_STAGING_PATH) else None)
+    return segset
+
+def migrate_manifest() -> Manifest:
+    """Manifest for a store ingested before manifest.json: each source's chunks keep their current chunk ids."""
+    processed = set()
+    if os.path.exists(PROCESSED_FILES_PATH):
+        with open(PROCESSED_FILES_PATH, "rb") as f:
+            processed = pickle.load(f)
+
+    store = open_vector_store(VECTOR_STORE_DIR).store
+    sources = store.vocabs["sources"]
+    by_source = {}
+    for row in np.flatnonzero(~store.columns["deleted"]):
+        source_id = int(store.columns["source_id"][row])
+        if source_id != MISSING:
+            by_source.setdefault(sources[source_id], []).append(int(store.columns["chunk_id"][row]))
+
+    manifest = Manifest()
+    for filename in sorted(processed | set(by_source)):
+        path = os.path.join(RAW_DATA_PATH, filename)
+        if os.path.exists(path):
+            manifest.record(filename, path, file_hash(path), by_source.get(filename, []))
+        else:
+            manifest.files[filename] = {"hash": None, "size": None, "mtime": None,
+                                        "chunk_ids": by_source.get(filename, [])}
+    if manifest.files:
+        logging.info(f"Migrated {len(manifest.files)} files from {os.path.basename(PROCESSED_FILES_PATH)} to a manifest.")
+    return manifest
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest new, changed and deleted files from RAW_DATA_PATH")
+    parser.add_argument("--compact", action="store_true", help="merge all segments into one without tombstones")
+    args = parser.parse_args()
+
+    segset = migrate_store()
+    manifest = segset.load_manifest(VECTOR_STORE_DIR) or Manifest.load(MANIFEST_PATH) or migrate_manifest()
+    # Never hand out an id a segment already uses (e.g. after a run that crashed before saving the manifest)
+    if segset.segments:
+        manifest.next_chunk_id = max(manifest.next_chunk_id, segset.segments[-1]["last_id"] + 1)
+
+    on_disk = {file: os.path.join(RAW_DATA_PATH, file) for file in os.listdir(RAW_DATA_PATH)}
+    changes, hashes = manifest.diff(on_disk)
+    for file in changes.unchanged:
+        logging.info(f"Skipping unchanged file: {file}")
+    # A specs.sqlite updated in place by earlier versions is published with the next generation
+    legacy_specs = SPEC_STORE_PATH if segset.spec_store_file is None and os.path.exists(SPEC_STORE_PATH) else None
+    if changes:
+        logging.info(f"{len(changes.new)} new, {len(changes.changed)} changed, {len(changes.deleted)} deleted files.")
+        ingest_changes(segset, manifest, changes, hashes, on_disk)
+    else:
+        logging.info("No new, changed or deleted files.")
+        if segset.manifest_file is None or legacy_specs:
+            # a manifest.json / migrated manifest and a legacy spec store, published once
+            segset.save(VECTOR_STORE_DIR, manifest, spec_store=legacy_specs)
+        elif manifest.touched:
+            # Only mtimes changed, which merely let unchanged files skip hashing: refresh the published copy
+            manifest.save(os.path.join(VECTOR_STORE_DIR, segset.manifest_file))
+    for legacy in (MANIFEST_PATH, SPEC_STORE_PATH):
+        if os.path.exists(legacy):
+            os.remove(legacy)
+
+    # Merges keep chunk ids, so the manifest and the spec store stay valid
+    if args.compact and segset.segments:
+        merge_segments(VECTOR_STORE_DIR, segset, [entry["name"] for entry in segset.segments], INDEX_MODE)
+    while True:
+        names = plan_merge(segset)
+        if names is None:
+            break
+        merge_segments(VECTOR_STORE_DIR, segset, names, INDEX_MODE)
+
+    logging.info(f"Vector store: {len(segset.segments)} segments, {segset.count} chunks, "
+                 f"{len(segset.tombstones)} tombstoned.")
+
+def ingest_changes(segset: SegmentSet, manifest: Manifest, changes, hashes: Dict[str, str], on_disk: Dict[str, str]):
+    """Parse and embed new / changed files into a new segment and tombstone the chunks they replace."""
+    # Only new and changed files are parsed and embedded
+    files_to_process = [(on_disk[file], file) for file in changes.new + changes.changed]
+    embedder = parse_and_embed(files_to_process)
+    ingested = set(embedder.done_files)
+
+    # Tombstone the previous chunks of changed files (a changed file that failed to parse keeps its
+    # old chunks until it parses again) and of deleted files
+    stale_files = changes.deleted + [file for file in changes.changed if file in ingested]
+    stale_ids = manifest.chunk_ids(stale_files)
+    segset.add_tombstones(stale_ids)
+    for file in changes.deleted:
+        del manifest.files[file]
+
+    new_ids = manifest.allocate(len(embedder.chunks))
+    sources = np.array([meta["source"] for meta in embedder.metadata], dtype=object)
+    for file in ingested:
+        manifest.record(file, on_disk[file], hashes[file], new_ids[sources == file])
+
+    # The published spec store is copied, not modified: servers keep answering from it until the publish
+    published_specs = segset.spec_store_path(VECTOR_STORE_DIR)
+    if published_specs is None and os.path.exists(SPEC_STORE_PATH):
+        published_specs = SPEC_STORE_PATH
+    num_specs = update_spec_store(SPEC_STAGING_PATH, published_specs, embedder.chunks, embedder.metadata,
+                                  new_ids, stale_ids)
+    logging.info(f"Extracted {num_specs} spec tuples.")
+
+    # This run's chunks become one new immutable segment; existing segments are not touched
+    if len(new_ids):
+        name = segset.next_name()
+        segset.segments.append(write_segment(
+            VECTOR_STORE_DIR, name, embedder.chunks, embedder.metadata,
+            np.concatenate(embedder.vectors), new_ids, INDEX_MODE,
+        ))
+        logging.info(f"Wrote segment {name} with {len(new_ids)} chunks.")
+    # One atomic publish of the segment, the tombstones, the manifest recording them and the spec store:
+    # a crash before it leaves the previous generation in place, so the same files are ingested again
+    segset.save(VECTOR_STORE_DIR, manifest, spec_store=SPEC_STAGING_PATH)
+
+    logging.info(f"Ingestion complete! Processed {len(files_to_process)} files, "
+                 f"{len(new_ids)} new chunks, {len(stale_ids)} tombstoned.")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+# preprocessing/sharding.py
+# Page-range sharding for ingest.py: large PDFs and PPTX decks are split into ranges of pages / slides
+# that are partitioned as separate pool tasks, so one huge document is spread over all workers.
+# A shard is written to a temporary file holding only its pages; ingest.py maps its page numbers and
+# element indices back to document positions when merging the shards in order.
+
+import contextlib
+import os
+import tempfile
+from typing import Iterator, List, Optional, Tuple
+
+import fitz  # pymupdf
+from pptx import Presentation
+
+# Documents with more pages / slides than this are sharded into ranges of this size
+SHARD_PAGES = int(os.environ.get("SHARD_PAGES", "20"))
+
+SHARDABLE_EXTENSIONS = (".pdf", ".pptx")
+
+PageRange = Tuple[int, int]  # 1-based, inclusive
+
+
+def page_count(file_path: str) -> Optional[int]:
+    """Pages of a PDF / slides of a PPTX deck, None for other (or unreadable) files."""
+    ext = os.path.splitext(file_path)[1].lower()
+    try:
+        if ext == ".pdf":
+            with fitz.open(file_path) as doc:
+                return doc.page_count
+        if ext == ".pptx":
+            return len(Presentation(file_path).slides)
+    except Exception:
+        return None  # let the partitioner report the problem on the whole file
+    return None
+
+
+def plan_shards(file_path: str, pages_per_shard: int = SHARD_PAGES) -> List[Optional[PageRange]]:
+    """Page ranges covering the document in order, or [None] when it is processed whole."""
+    pages = page_count(file_path)
+    if pages is None or pages_per_shard <= 0 or pages <= pages_per_shard:
+        return [None]
+    return [(first, min(first + pages_per_shard - 1, pages)) for first in range(1, pages + 1, pages_per_shard)]
+
+
+def _write_pdf_pages(file_path: str, pages: PageRange, out_path: str) -> None:
+    with fitz.open(file_path) as src, fitz.open() as out:
+        out.insert_pdf(src, from_page=pages[0] - 1, to_page=pages[1] - 1)
+        out.save(out_path)
+
+
+def _write_pptx_slides(file_path: str, pages: PageRange, out_path: str) -> None:
+    prs = Presentation(file_path)
+    slide_ids = prs.slides._sldIdLst  # python-pptx has no public API for removing slides
+    for number, slide_id in reversed(list(enumerate(slide_ids, start=1))):
+        if not pages[0] <= number <= pages[1]:
+            prs.part.drop_rel(slide_id.rId)
+            slide_ids.remove(slide_id)
+    prs.save(out_path)
+
+
+@contextlib.contextmanager
+def extract_pages(file_path: str, pages: PageRange) -> Iterator[str]:
+    """Temporary copy of the document holding only the given page / slide range."""
+    ext = os.path.splitext(file_path)[1].lower()
+    fd, out_path = tempfile.mkstemp(suffix=ext)
+    os.close(fd)
+    try:
+        if ext == ".pdf":
+            _write_pdf_pages(file_path, pages, out_path)
+        elif ext == ".pptx":
+            _write_pptx_slides(file_path, pages, out_path)
+        else:
+            raise ValueError(f"Cannot shard {file_path}: only {SHARDABLE_EXTENSIONS} are supported")
+        yield out_path
+    finally:
+        os.remove(out_path)
@@ -0,0 +1,148 @@
+# rag/answer_cache.py
+# Two-tier cache of final answers (answer + citations) for rag.qa.
+# - Key: normalized question, ids of the retrieved chunks, prompt-template hash, LLM name and
+#   index version. A re-ingest bumps the index version, so stale answers can never be served;
+#   rows of older versions are purged the first time a new version is seen.
+# - Tiers: a small in-process LRU in front of a bounded SQLite (WAL) table shared by all workers.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+from rag.embedding_cache import normalize_query
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_CACHE_PATH = os.environ.get(
+    "ANSWER_CACHE_PATH",
+    os.path.join(PROJECT_ROOT, "embeddings", "cache", "answers.sqlite"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    index_version TEXT NOT NULL,
+    response TEXT NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_answers_accessed ON answers (accessed);
+"""
+
+
+def answer_key(question: str, chunk_ids: Sequence[int], prompt_hash: str, model: str, index_version: str) -> str:
+    payload = json.dumps([normalize_query(question), [int(c) for c in chunk_ids], prompt_hash, model, index_version])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        memory_size: int = 256,
+        max_entries: int = 10_000,
+        ttl_seconds: Optional[float] = 7 * 24 * 3600,
+    ):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+        self._memory: "OrderedDict[str, Dict]" = OrderedDict()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._seen_version: Optional[str] = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _check_version(self, index_version: str) -> None:
+        """Drop everything cached for other index versions once per version change."""
+        with self._lock:
+            if self._seen_version == index_version:
+                return
+            self._seen_version = index_version
+            self._memory.clear()
+        try:
+            self._conn().execute("DELETE FROM answers WHERE index_version != ?", (index_version,))
+        except sqlite3.Error:
+            pass
+
+    def get(self, key: str, index_version: str) -> Optional[Dict]:
+        self._check_version(index_version)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return dict(self._memory[key])
+
+        response = None
+        try:
+            row = self._conn().execute(
+                "SELECT response, created FROM answers WHERE key = ?", (key,)
+            ).fetchone()
+            if row and (self.ttl_seconds is None or time.time() - row[1] <= self.ttl_seconds):
+                response = json.loads(row[0])
+                self._conn().execute("UPDATE answers SET accessed = ? WHERE key = ?", (time.time(), key))
+        except sqlite3.Error:
+            response = None
+
+        with self._lock:
+            if response is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._remember(key, response)
+        return dict(response)
+
+    def put(self, key: str, index_version: str, response: Dict) -> None:
+        self._check_version(index_version)
+        with self._lock:
+            self._remember(key, response)
+        now = time.time()
+        try:
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, index_version, response, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, index_version, json.dumps(response), now, now),
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error:
+            pass
+
+    def _remember(self, key: str, response: Dict) -> None:
+        self._memory[key] = dict(response)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def stats(self) -> Dict:
+        total = self.memory_hits + self.disk_hits + self.misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.memory_hits + self.disk_hits) / total, 3) if total else 0.0,
+        }
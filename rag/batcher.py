@@ -0,0 +1,110 @@
+# rag/batcher.py
+# Dynamic micro-batching of query encodings.
+# Concurrent callers (server request threads, Streamlit sessions) each hand in a few texts; a worker
+# thread gathers whatever arrives within max_wait_ms of the first request (up to max_batch texts)
+# and runs them through a single encode call, then hands every caller its own rows.
+# A lone request waits at most max_wait_ms; under load the transformer sees full batches.
+
+import concurrent.futures
+import queue
+import threading
+import time
+from typing import Callable, Dict, List
+
+import numpy as np
+
+DEFAULT_MAX_BATCH = 64
+DEFAULT_MAX_WAIT_MS = 5.0
+
+
+class _Request:
+    __slots__ = ("texts", "future", "enqueued")
+
+    def __init__(self, texts: List[str]):
+        self.texts = texts
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.enqueued = time.perf_counter()
+
+
+class EncodeBatcher:
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],  # texts -> (n, d) float32, e.g. SentenceTransformer.encode
+        max_batch: int = DEFAULT_MAX_BATCH,
+        max_wait_ms: float = DEFAULT_MAX_WAIT_MS,
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+
+        self._queue: "queue.Queue[_Request]" = queue.Queue()
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.max_batch_seen = 0
+        self._wait_seconds = 0.0
+        self._encode_seconds = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Blocking: embeddings for texts, computed in a shared batch with concurrent callers."""
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        request = _Request(list(texts))
+        self._queue.put(request)
+        return request.future.result()
+
+    def _collect(self) -> List[_Request]:
+        first = self._queue.get()
+        batch, size = [first], len(first.texts)
+        deadline = first.enqueued + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.texts)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            texts = [text for request in batch for text in request.texts]
+            started = time.perf_counter()
+            try:
+                embeddings = self.encode_fn(texts)
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+            finished = time.perf_counter()
+
+            offset = 0
+            for request in batch:
+                request.future.set_result(embeddings[offset:offset + len(request.texts)])
+                offset += len(request.texts)
+
+            with self._lock:
+                self.batches += 1
+                self.requests += len(batch)
+                self.texts += len(texts)
+                self.max_batch_seen = max(self.max_batch_seen, len(texts))
+                self._wait_seconds += sum(started - request.enqueued for request in batch)
+                self._encode_seconds += finished - started
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "requests": self.requests,
+                "avg_batch_size": round(self.texts / self.batches, 2) if self.batches else 0.0,
+                "max_batch_size": self.max_batch_seen,
+                "avg_wait_ms": round(1000 * self._wait_seconds / self.requests, 3) if self.requests else 0.0,
+                "avg_encode_ms": round(1000 * self._encode_seconds / self.batches, 3) if self.batches else 0.0,
+                "queue_depth": self._queue.qsize(),
+            }
@@ -0,0 +1,347 @@
+# rag/chunk_store.py
+# Columnar on-disk chunk store (replaces data.pkl).
+# Layout of a store directory:
+# - texts.bin          all chunk texts, UTF-8, back to back
+# - offsets.npy        int64[n + 1] byte offsets of each text in texts.bin
+# - <column>.npy       one typed array per metadata field (see COLUMNS)
+# - <derived>.npy      per-chunk arrays used by the Retriever's vectorized filters (see DERIVED_COLUMNS)
+# - chunk_id.npy       int64 stable chunk id per row (the FAISS id), ascending with the row number
+# - deleted.npy        bool tombstone per row (all False for segments, whose tombstones live in segments.json)
+# - store.json         row count + vocabularies for the dictionary-encoded columns
+# Everything is memory-mapped on load, so opening a store is O(1) and pages are shared
+# between processes. Only the rows a caller actually asks for are decoded into Python objects.
+# MultiChunkStore reads the stores of several segments (rag/segments.py) as one, still memory-mapped.
+
+import hashlib
+import json
+import os
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+MISSING = -1  # value stored for absent variant / page
+
+# column name -> (dtype, metadata key), in the key order ingest.py builds metadata dicts
+COLUMNS = {
+    "source_id": (np.int32, "source"),
+    "element_type_id": (np.int16, "element_type"),
+    "element_index": (np.int32, "element_index"),
+    "char_count": (np.int32, "chunk_char_count"),
+    "variant_id": (np.int16, "variant"),
+    "page": (np.int32, "page"),
+}
+
+# dictionary-encoded columns -> vocabulary name in store.json
+VOCAB_COLUMNS = {
+    "source_id": "sources",
+    "element_type_id": "element_types",
+    "variant_id": "variants",
+}
+
+# columns computed from the chunk text itself
+DERIVED_COLUMNS = {
+    "text_len": np.int32,        # len(text.strip()), for the min-length filter
+    "content_hash": np.uint64,   # hash of text.strip(), for exact-duplicate removal
+}
+
+TEXTS_FILE = "texts.bin"
+STORE_META_FILE = "store.json"
+
+
+def content_hash(text: str) -> int:
+    """Stable 64-bit hash of a chunk's stripped text."""
+    return int.from_bytes(hashlib.blake2b(text.strip().encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def derive_columns(chunks: List[str]) -> Dict[str, np.ndarray]:
+    return {
+        "text_len": np.fromiter((len(c.strip()) for c in chunks), dtype=np.int32, count=len(chunks)),
+        "content_hash": np.fromiter((content_hash(c) for c in chunks), dtype=np.uint64, count=len(chunks)),
+    }
+
+
+def build_columns(
+    chunks: List[str],
+    metadata: List[Dict],
+    vocabs: Optional[Dict[str, List[str]]] = None,
+) -> Tuple[bytes, Dict[str, np.ndarray], Dict[str, List[str]]]:
+    """
+    Encode chunk texts and metadata dicts into a text blob, typed columns and vocabularies.
+    Passing the vocabularies of an existing store extends them, so appended rows share its codes.
+    """
+    if len(chunks) != len(metadata):
+        raise ValueError(f"{len(chunks)} chunks but {len(metadata)} metadata entries")
+
+    vocabs = {name: list((vocabs or {}).get(name, [])) for name in VOCAB_COLUMNS.values()}
+    lookups = {name: {value: code for code, value in enumerate(vocab)} for name, vocab in vocabs.items()}
+    columns = {col: np.full(len(chunks), MISSING, dtype=dtype) for col, (dtype, _) in COLUMNS.items()}
+
+    encoded = [chunk.encode("utf-8") for chunk in chunks]
+    offsets = np.zeros(len(chunks) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    columns["offsets"] = offsets
+    columns.update(derive_columns(chunks))
+
+    for row, meta in enumerate(metadata):
+        for col, (_, key) in COLUMNS.items():
+            value = meta.get(key)
+            if value is None:
+                continue
+            if col in VOCAB_COLUMNS:
+                vocab_name = VOCAB_COLUMNS[col]
+                lookup = lookups[vocab_name]
+                if value not in lookup:
+                    lookup[value] = len(vocabs[vocab_name])
+                    vocabs[vocab_name].append(value)
+                value = lookup[value]
+            columns[col][row] = value
+
+    return b"".join(encoded), columns, vocabs
+
+
+def _replace(path: str, name: str, writer) -> None:
+    tmp = os.path.join(path, name + ".tmp")
+    with open(tmp, "wb") as f:
+        writer(f)
+    os.replace(tmp, os.path.join(path, name))
+
+
+def write_chunk_store(path: str, chunks: List[str], metadata: List[Dict],
+                      chunk_ids: Optional[np.ndarray] = None) -> None:
+    """
+    Write chunks + metadata as a columnar store. Files are replaced one by one via os.replace.
+    chunk_ids (ascending) default to the row numbers; every row starts live.
+    """
+    os.makedirs(path, exist_ok=True)
+    blob, columns, vocabs = build_columns(chunks, metadata)
+    columns["chunk_id"] = np.arange(len(chunks), dtype=np.int64) if chunk_ids is None else np.asarray(chunk_ids, dtype=np.int64)
+    columns["deleted"] = np.zeros(len(chunks), dtype=np.bool_)
+
+    _replace(path, TEXTS_FILE, lambda f: f.write(blob))
+    for col, values in columns.items():
+        _replace(path, f"{col}.npy", lambda f, values=values: np.save(f, values))
+    # store.json last: its row count is what readers trust
+    _replace(path, STORE_META_FILE, lambda f: f.write(json.dumps({"count": len(chunks), **vocabs}).encode("utf-8")))
+
+
+def identity_columns(count: int) -> Dict[str, np.ndarray]:
+    """Row identity columns for stores written before they existed: ids are the row numbers, nothing is deleted."""
+    return {"chunk_id": np.arange(count, dtype=np.int64), "deleted": np.zeros(count, dtype=np.bool_)}
+
+
+def chunk_store_exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, STORE_META_FILE))
+
+
+class ChunkStore:
+    """Read side of the columnar store. Columns are memory-mapped numpy arrays."""
+
+    def __init__(self, blob, columns: Dict[str, np.ndarray], vocabs: Dict[str, List[str]]):
+        self._blob = blob
+        self.columns = columns
+        self.vocabs = vocabs
+        self._offsets = columns["offsets"]
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True) -> "ChunkStore":
+        with open(os.path.join(path, STORE_META_FILE)) as f:
+            meta = json.load(f)
+        count = meta.pop("count")
+        mmap_mode = "r" if mmap else None
+
+        columns = {
+            col: np.load(os.path.join(path, f"{col}.npy"), mmap_mode=mmap_mode)
+            for col in list(COLUMNS) + ["offsets"]
+        }
+        if len(columns["offsets"]) != count + 1:
+            raise ValueError(f"Chunk store at {path} is inconsistent: expected {count} rows")
+
+        texts_path = os.path.join(path, TEXTS_FILE)
+        if os.path.getsize(texts_path) == 0:
+            blob = np.empty(0, dtype=np.uint8)  # np.memmap refuses empty files
+        elif mmap:
+            blob = np.memmap(texts_path, dtype=np.uint8, mode="r")
+        else:
+            blob = np.fromfile(texts_path, dtype=np.uint8)
+        store = cls(blob, columns, meta)
+
+        # Stores written before the derived columns existed get them computed once here
+        derived_paths = {col: os.path.join(path, f"{col}.npy") for col in DERIVED_COLUMNS}
+        if all(os.path.exists(p) for p in derived_paths.values()):
+            for col, p in derived_paths.items():
+                columns[col] = np.load(p, mmap_mode=mmap_mode)
+        else:
+            columns.update(derive_columns(store.texts()))
+
+        for col, values in identity_columns(count).items():
+            col_path = os.path.join(path, f"{col}.npy")
+            columns[col] = np.load(col_path, mmap_mode=mmap_mode) if os.path.exists(col_path) else values
+        return store
+
+    @classmethod
+    def from_lists(cls, chunks: List[str], metadata: List[Dict]) -> "ChunkStore":
+        """In-memory store, used for legacy data.pkl vector stores."""
+        blob, columns, vocabs = build_columns(chunks, metadata)
+        columns.update(identity_columns(len(chunks)))
+        return cls(np.frombuffer(blob, dtype=np.uint8), columns, vocabs)
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    @property
+    def num_deleted(self) -> int:
+        return int(np.count_nonzero(self.columns["deleted"]))
+
+    def rows_for_ids(self, chunk_ids: np.ndarray) -> np.ndarray:
+        """Row of each stable chunk id (-1 for -1 / unknown ids). Relies on chunk_id ascending with the row."""
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        stored = self.columns["chunk_id"]
+        if len(stored) == 0:
+            return np.full(chunk_ids.shape, -1, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(stored, chunk_ids), len(stored) - 1)
+        return np.where(stored[rows] == chunk_ids, rows, -1).astype(np.int64)
+
+    def code(self, vocab_name: str, value: Optional[str]) -> int:
+        """Dictionary code of a value (MISSING if None or never seen)."""
+        if value is None or value not in self.vocabs[vocab_name]:
+            return MISSING
+        return self.vocabs[vocab_name].index(value)
+
+    def text(self, row: int) -> str:
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return self._blob[start:end].tobytes().decode("utf-8")
+
+    def texts(self, rows: Optional[Iterable[int]] = None) -> List[str]:
+        rows = range(len(self)) if rows is None else rows
+        return [self.text(row) for row in rows]
+
+    def metadata(self, row: int) -> Dict:
+        """Rebuild the metadata dict ingest.py produced for this row (absent keys stay absent)."""
+        meta = {}
+        for col, (_, key) in COLUMNS.items():
+            value = int(self.columns[col][row])
+            if value == MISSING:
+                continue
+            if col in VOCAB_COLUMNS:
+                meta[key] = self.vocabs[VOCAB_COLUMNS[col]][value]
+            else:
+                meta[key] = value
+        return meta
+
+    def to_lists(self) -> Tuple[List[str], List[Dict]]:
+        """Decode everything (only for writers that need to append)."""
+        return self.texts(), [self.metadata(row) for row in range(len(self))]
+
+
+class ConcatColumn:
+    """
+    One column of several stores read as one without copying them: rows are translated to (part, local row),
+    like segments.ConcatRows. `remaps` (one array per part, indexed by the part's codes) put dictionary codes
+    onto merged vocabularies. Reading every row (np.asarray, ~column) builds a temporary array.
+    """
+
+    def __init__(self, arrays: List[np.ndarray], dtype, remaps: Optional[List[np.ndarray]] = None):
+        self.arrays = arrays
+        self.dtype = np.dtype(dtype)
+        self.remaps = remaps
+        self.starts = np.cumsum([0] + [len(a) for a in arrays])
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def _read(self, part: int, local):
+        values = self.arrays[part][local]
+        return self.remaps[part][values] if self.remaps is not None else values
+
+    def __getitem__(self, rows):
+        if isinstance(rows, (int, np.integer)):
+            row = int(rows) + (len(self) if rows < 0 else 0)
+            part = int(np.searchsorted(self.starts, row, side="right")) - 1
+            return self._read(part, row - int(self.starts[part]))
+        rows = np.arange(len(self))[rows] if isinstance(rows, slice) else np.asarray(rows, dtype=np.int64)
+        parts = np.searchsorted(self.starts, rows, side="right") - 1
+        out = np.empty(rows.shape, dtype=self.dtype)
+        for part in np.unique(parts):
+            mask = parts == part
+            out[mask] = self._read(part, rows[mask] - self.starts[part])
+        return out
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        values = [np.empty(0, dtype=self.dtype)] + [self._read(part, slice(None)) for part in range(len(self.arrays))]
+        return np.concatenate(values).astype(dtype or self.dtype, copy=False)
+
+    def __iter__(self):
+        return iter(np.asarray(self))
+
+    def __invert__(self) -> np.ndarray:
+        return ~np.asarray(self)
+
+
+class TombstoneColumn(ConcatColumn):
+    """The `deleted` column of a MultiChunkStore: each part's own flags, or'ed with the tombstoned chunk ids."""
+
+    def __init__(self, deleted: List[np.ndarray], chunk_ids: List[np.ndarray], deleted_ids: np.ndarray):
+        super().__init__(deleted, np.bool_)
+        self.chunk_ids = chunk_ids
+        self.deleted_ids = deleted_ids
+
+    def _read(self, part: int, local):
+        deleted = np.asarray(self.arrays[part][local])
+        if len(self.deleted_ids):
+            deleted = deleted | np.isin(self.chunk_ids[part][local], self.deleted_ids)
+        return deleted
+
+
+class MultiChunkStore(ChunkStore):
+    """
+    Several stores read as one, rows numbered across them in order (the segments of rag/segments.py).
+    The parts stay memory-mapped: columns are ConcatColumn views, with dictionary codes remapped onto
+    merged vocabularies, and texts / metadata are decoded by the part holding the row.
+    Rows whose chunk id is in `deleted_ids` are tombstoned.
+    """
+
+    def __init__(self, parts: List[ChunkStore], deleted_ids: Optional[np.ndarray] = None):
+        self.parts = parts
+        self.starts = np.cumsum([0] + [len(part) for part in parts])  # first row of each part
+        lookups = {name: {} for name in VOCAB_COLUMNS.values()}
+        remaps = {name: [] for name in lookups}
+        for part in parts:
+            for name, lookup in lookups.items():
+                codes = [lookup.setdefault(value, len(lookup)) for value in part.vocabs[name]]
+                remaps[name].append(np.array(codes + [MISSING], dtype=np.int64))  # MISSING (-1) maps to itself
+        self.vocabs = {name: list(lookup) for name, lookup in lookups.items()}
+
+        dtypes = {col: dtype for col, (dtype, _) in COLUMNS.items()}
+        dtypes.update(DERIVED_COLUMNS, chunk_id=np.int64)
+        self.columns = {
+            col: ConcatColumn([part.columns[col] for part in parts], dtype,
+                              remaps[VOCAB_COLUMNS[col]] if col in VOCAB_COLUMNS else None)
+            for col, dtype in dtypes.items()
+        }
+        deleted_ids = np.asarray(deleted_ids if deleted_ids is not None else [], dtype=np.int64)
+        self.columns["deleted"] = TombstoneColumn([part.columns["deleted"] for part in parts],
+                                                  [part.columns["chunk_id"] for part in parts], deleted_ids)
+
+    def __len__(self) -> int:
+        return int(self.starts[-1])
+
+    def _locate(self, row: int) -> Tuple[ChunkStore, int]:
+        part = int(np.searchsorted(self.starts, row, side="right")) - 1
+        return self.parts[part], row - int(self.starts[part])
+
+    def rows_for_ids(self, chunk_ids: np.ndarray) -> np.ndarray:
+        chunk_ids = np.asarray(chunk_ids, dtype=np.int64)
+        rows = np.full(chunk_ids.shape, -1, dtype=np.int64)
+        for part, start in zip(self.parts, self.starts):
+            local = part.rows_for_ids(chunk_ids)
+            found = local != -1
+            rows[found] = local[found] + start
+        return rows
+
+    def text(self, row: int) -> str:
+        part, local = self._locate(row)
+        return part.text(local)
+
+    def metadata(self, row: int) -> Dict:
+        part, local = self._locate(row)
+        return part.metadata(local)
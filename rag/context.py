@@ -0,0 +1,120 @@
+# rag/context.py
+# Token-budgeted context packing for the generation prompt.
+# - Chunks are taken in retrieval order (best first) until the token budget is spent.
+# - Sentences that near-duplicate one already packed (other chunk or same chunk) are dropped,
+#   so overlapping element fragments are not paid for twice in CPU prefill.
+# - Tokens are estimated from the character count, or counted with the LLM's tokenizer when one is
+#   configured (CONTEXT_TOKENIZER, a Hugging Face tokenizer name or local directory). rag.qa loads it
+#   at startup; a gated or remote tokenizer would otherwise stall the first request on the network.
+
+import logging
+import os
+import re
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple
+
+from rag.lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "3000"))
+TOKENIZER_NAME = os.environ.get("CONTEXT_TOKENIZER", "")  # empty: character-based estimate
+CHARS_PER_TOKEN = 3.5  # conservative estimate for English technical text on Llama/Mistral vocabularies
+
+DEDUP_THRESHOLD = 0.85  # Jaccard similarity of word sets above which a sentence counts as a duplicate
+MIN_DEDUP_WORDS = 4     # shorter fragments (table cells, headings) are only dropped on exact repeats
+
+# Sentence ends and line breaks; the separators are kept so packed text keeps its layout
+SEGMENT_SPLIT = re.compile(r"((?<=[.!?])\s+|\n+)")
+
+
+class PackedContext(NamedTuple):
+    text: str
+    chunks: List[Dict]        # chunks that contributed at least one sentence, in prompt order
+    tokens: int               # token count of text
+    dropped_chunks: int       # chunks left out (budget exhausted or fully redundant)
+    dropped_sentences: int    # near-duplicate sentences removed
+
+
+def estimate_tokens(text: str) -> int:
+    return int(len(text) / CHARS_PER_TOKEN) + 1
+
+
+@lru_cache(maxsize=1)
+def get_token_counter() -> Callable[[str], int]:
+    """Token counter of the configured tokenizer, or a character-based estimate (none configured or unloadable)."""
+    if not TOKENIZER_NAME:
+        return estimate_tokens
+    try:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(TOKENIZER_NAME)
+        return lambda text: len(tokenizer.encode(text, add_special_tokens=False))
+    except Exception as e:
+        logger.warning(f"Tokenizer '{TOKENIZER_NAME}' unavailable ({e}), estimating tokens from characters")
+        return estimate_tokens
+
+
+def _is_duplicate(words: frozenset, seen: List[frozenset]) -> bool:
+    if len(words) < MIN_DEDUP_WORDS:
+        return words in seen
+    for other in seen:
+        if len(other) < MIN_DEDUP_WORDS:
+            continue
+        if len(words & other) / len(words | other) >= DEDUP_THRESHOLD:
+            return True
+    return False
+
+
+def pack_context(
+    retrieved: List[Dict],
+    token_budget: int = DEFAULT_TOKEN_BUDGET,
+    count_tokens: Callable[[str], int] = None,
+) -> PackedContext:
+    """Fill token_budget with the best chunks' non-redundant sentences."""
+    count_tokens = count_tokens or get_token_counter()
+    separator = "\n\n"
+    separator_tokens = count_tokens(separator)
+
+    blocks: List[str] = []
+    packed: List[Dict] = []
+    seen: List[frozenset] = []
+    used = 0
+    dropped_sentences = 0
+
+    for chunk in retrieved:
+        parts = SEGMENT_SPLIT.split(chunk["content"].strip())
+        kept: List[str] = []
+        kept_words: List[frozenset] = []
+        cost = separator_tokens if blocks else 0
+        for i in range(0, len(parts), 2):
+            sentence = parts[i]
+            if not sentence.strip():
+                continue
+            words = frozenset(tokenize(sentence))
+            if words and _is_duplicate(words, seen + kept_words):
+                dropped_sentences += 1
+                continue
+            piece = sentence + (parts[i + 1] if i + 1 < len(parts) else "")
+            piece_tokens = count_tokens(piece)
+            if used + cost + piece_tokens > token_budget:
+                break  # keep the chunk's sentences contiguous; later ones would read out of context
+            kept.append(piece)
+            kept_words.append(words)
+            cost += piece_tokens
+
+        if kept:
+            blocks.append("".join(kept).strip())
+            packed.append(chunk)
+            seen.extend(kept_words)
+            used += cost
+        if used >= token_budget:
+            break
+
+    text = separator.join(blocks)
+    return PackedContext(
+        text=text,
+        chunks=packed,
+        tokens=count_tokens(text) if text else 0,
+        dropped_chunks=len(retrieved) - len(packed),
+        dropped_sentences=dropped_sentences,
+    )
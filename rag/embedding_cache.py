@@ -0,0 +1,151 @@
+# rag/embedding_cache.py
+# Persistent query-embedding cache shared by every process on the host (Streamlit workers,
+# evaluation runs, the HTTP service). Backed by SQLite in WAL mode, so concurrent readers
+# never block and writers only serialize briefly.
+# - Key: normalized query (case + whitespace folded) and the embedding model name.
+# - Bounded: least-recently-used rows beyond max_entries are evicted, rows older than ttl expire.
+# - Observable: per-process hit/miss counters via stats().
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+DEFAULT_CACHE_PATH = os.environ.get(
+    "EMBEDDING_CACHE_PATH",
+    os.path.join(PROJECT_ROOT, "embeddings", "cache", "query_embeddings.sqlite"),
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS query_embeddings (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    vector BLOB NOT NULL,
+    created REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_query_embeddings_accessed ON query_embeddings (accessed);
+"""
+
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the cache identity."""
+    return " ".join(query.lower().split())
+
+
+class QueryEmbeddingCache:
+    def __init__(
+        self,
+        path: str = DEFAULT_CACHE_PATH,
+        max_entries: int = 50_000,
+        ttl_seconds: Optional[float] = 30 * 24 * 3600,
+        evict_every: int = 256,  # puts between eviction sweeps
+    ):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every = evict_every
+
+        self._local = threading.local()  # sqlite connections are per thread
+        self._lock = threading.Lock()
+        self._puts_since_evict = 0
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _key(query: str, model: str) -> str:
+        return hashlib.sha1(f"{model}\x00{normalize_query(query)}".encode("utf-8")).hexdigest()
+
+    def get_many(self, queries: List[str], model: str) -> Dict[int, np.ndarray]:
+        """Cached embeddings by position in `queries` (misses are simply absent)."""
+        keys = [self._key(q, model) for q in queries]
+        now = time.time()
+        found: Dict[str, np.ndarray] = {}
+        try:
+            placeholders = ",".join("?" * len(keys))
+            rows = self._conn().execute(
+                f"SELECT key, vector, created FROM query_embeddings WHERE key IN ({placeholders})",
+                keys,
+            ).fetchall()
+            for key, blob, created in rows:
+                if self.ttl_seconds is None or now - created <= self.ttl_seconds:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+            if found:
+                self._conn().executemany(
+                    "UPDATE query_embeddings SET accessed = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+        except sqlite3.Error:
+            found = {}  # a cache failure must never fail retrieval
+
+        result = {i: found[key] for i, key in enumerate(keys) if key in found}
+        with self._lock:
+            self.hits += len(result)
+            self.misses += len(keys) - len(result)
+        return result
+
+    def put_many(self, queries: List[str], model: str, vectors: np.ndarray) -> None:
+        now = time.time()
+        rows = [
+            (self._key(q, model), model, np.asarray(v, dtype=np.float32).tobytes(), now, now)
+            for q, v in zip(queries, vectors)
+        ]
+        try:
+            self._conn().executemany(
+                "INSERT OR REPLACE INTO query_embeddings (key, model, vector, created, accessed) "
+                "VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+        except sqlite3.Error:
+            return
+
+        with self._lock:
+            self._puts_since_evict += len(rows)
+            sweep = self._puts_since_evict >= self.evict_every
+            if sweep:
+                self._puts_since_evict = 0
+        if sweep:
+            self.evict()
+
+    def evict(self) -> None:
+        """Drop expired rows, then the least recently used rows beyond max_entries."""
+        try:
+            conn = self._conn()
+            if self.ttl_seconds is not None:
+                conn.execute("DELETE FROM query_embeddings WHERE created < ?", (time.time() - self.ttl_seconds,))
+            conn.execute(
+                "DELETE FROM query_embeddings WHERE key IN ("
+                "SELECT key FROM query_embeddings ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+        except sqlite3.Error:
+            pass
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM query_embeddings").fetchone()[0]
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
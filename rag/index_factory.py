@@ -0,0 +1,327 @@
+# rag/index_factory.py
+# FAISS index construction shared by ingest.py, the Retriever and the evaluation scripts.
+# Supported modes:
+# - flat:     exact inner-product scan (IndexFlatIP). Best for small corpora.
+# - hnsw:     graph index (IndexHNSWFlat). Fast and accurate, no training, higher memory.
+# - ivf_flat: inverted lists over full vectors. Needs training, tuned with nprobe.
+# - ivf_pq:   inverted lists over product-quantized codes. Smallest memory, lowest recall.
+# - sq8:      flat scan over 8-bit scalar-quantized codes (4x smaller than float32).
+# - sqfp16:   flat scan over float16 codes (2x smaller, near-exact).
+# - pq:       flat scan over product-quantized codes (~32x smaller).
+# - auto:     picks flat / hnsw / ivf_flat / ivf_pq from the corpus size.
+# Compressed modes (COMPRESSED_MODES) are meant to be searched with a wider k and then rescored
+# exactly against the float32 vectors.npy side file (see rescore_exact).
+# Built with ids, the index is wrapped in an IndexIDMap2 keyed by stable chunk ids; every segment
+# (rag/segments.py) has one, and MultiIndex searches them together.
+
+import logging
+import math
+from typing import Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INDEX_MODES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "sqfp16", "pq")
+COMPRESSED_MODES = ("ivf_pq", "sq8", "sqfp16", "pq")
+
+# Corpus-size thresholds used by mode="auto"
+FLAT_MAX_VECTORS = 20_000
+HNSW_MAX_VECTORS = 300_000
+IVF_FLAT_MAX_VECTORS = 2_000_000
+
+# Build / search defaults
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+DEFAULT_EF_SEARCH = 64
+DEFAULT_NPROBE = 16
+PQ_NBITS = 8
+MIN_POINTS_PER_CENTROID = 39   # below this FAISS k-means warns and clusters poorly
+MAX_TRAIN_POINTS_PER_CENTROID = 256
+RESCORE_FACTOR = 4  # compressed indexes return k * RESCORE_FACTOR candidates for exact rescoring
+
+
+def choose_index_mode(num_vectors: int) -> str:
+    """Pick an index mode from the corpus size."""
+    if num_vectors < FLAT_MAX_VECTORS:
+        return "flat"
+    if num_vectors < HNSW_MAX_VECTORS:
+        return "hnsw"
+    if num_vectors < IVF_FLAT_MAX_VECTORS:
+        return "ivf_flat"
+    return "ivf_pq"
+
+
+def choose_nlist(num_vectors: int) -> int:
+    """Number of IVF cells: ~4*sqrt(n), capped so every cell gets enough training points."""
+    nlist = int(4 * math.sqrt(max(num_vectors, 1)))
+    return max(1, min(nlist, num_vectors // MIN_POINTS_PER_CENTROID))
+
+
+def choose_pq_m(dimension: int) -> int:
+    """Number of PQ sub-quantizers: largest divisor of d giving sub-vectors of >= 8 dims."""
+    for m in (96, 64, 48, 32, 24, 16, 8):
+        if dimension % m == 0 and dimension // m >= 8:
+            return m
+    return 1
+
+
+def choose_pq_nbits(num_vectors: int) -> int:
+    """Bits per PQ code: each sub-quantizer trains 2^nbits centroids, so shrink codes on small corpora."""
+    nbits = PQ_NBITS
+    while nbits > 4 and num_vectors < (1 << nbits) * MIN_POINTS_PER_CENTROID:
+        nbits -= 1
+    return nbits
+
+
+def _training_sample(embeddings: np.ndarray, max_train: int) -> np.ndarray:
+    if len(embeddings) <= max_train:
+        return embeddings
+    sample = np.random.default_rng(0).choice(len(embeddings), max_train, replace=False)
+    return embeddings[np.sort(sample)]
+
+
+def build_index(
+    embeddings: np.ndarray,
+    mode: str = "auto",
+    nlist: Optional[int] = None,
+    pq_m: Optional[int] = None,
+    hnsw_m: int = HNSW_M,
+    ids: Optional[np.ndarray] = None,
+) -> Tuple[faiss.Index, Dict]:
+    """
+    Build, train and fill an inner-product index over L2-normalized embeddings.
+    With ids (int64, one per row) search results are those ids instead of row numbers.
+    Returns the index and a dict describing how it was built (persisted next to it).
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    num_vectors, dimension = embeddings.shape
+
+    if mode == "auto":
+        mode = choose_index_mode(num_vectors)
+    if mode not in INDEX_MODES:
+        raise ValueError(f"Unknown index mode '{mode}', expected one of {INDEX_MODES} or 'auto'")
+
+    # IVF needs enough points to train at least a couple of cells
+    if mode in ("ivf_flat", "ivf_pq", "pq") and num_vectors < 2 * MIN_POINTS_PER_CENTROID:
+        logger.warning(f"Only {num_vectors} vectors, too few to train '{mode}'. Falling back to flat.")
+        mode = "flat"
+
+    info = {"mode": mode, "dimension": dimension, "ntotal": num_vectors}
+
+    if mode == "flat":
+        index = faiss.IndexFlatIP(dimension)
+    elif mode in ("sq8", "sqfp16"):
+        qtype = faiss.ScalarQuantizer.QT_8bit if mode == "sq8" else faiss.ScalarQuantizer.QT_fp16
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+        index.train(_training_sample(embeddings, 100_000))  # learns per-dimension value ranges
+    elif mode == "pq":
+        pq_m = pq_m or choose_pq_m(dimension)
+        pq_nbits = choose_pq_nbits(num_vectors)
+        index = faiss.IndexPQ(dimension, pq_m, pq_nbits, faiss.METRIC_INNER_PRODUCT)
+        info.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+        logger.info(f"Training PQ{pq_m}x{pq_nbits}...")
+        index.train(_training_sample(embeddings, (1 << pq_nbits) * MAX_TRAIN_POINTS_PER_CENTROID))
+    elif mode == "hnsw":
+        index = faiss.IndexHNSWFlat(dimension, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = DEFAULT_EF_SEARCH
+        info.update({"hnsw_m": hnsw_m, "ef_search": DEFAULT_EF_SEARCH})
+    else:
+        nlist = nlist or choose_nlist(num_vectors)
+        if mode == "ivf_flat":
+            description = f"IVF{nlist},Flat"
+        else:
+            pq_m = pq_m or choose_pq_m(dimension)
+            pq_nbits = choose_pq_nbits(num_vectors)
+            description = f"IVF{nlist},PQ{pq_m}x{pq_nbits}"
+            info.update({"pq_m": pq_m, "pq_nbits": pq_nbits})
+        index = faiss.index_factory(dimension, description, faiss.METRIC_INNER_PRODUCT)
+        info.update({"nlist": nlist, "nprobe": min(DEFAULT_NPROBE, nlist)})
+
+        # Train on a random sample, k-means gains nothing past ~256 points per centroid
+        train_vectors = _training_sample(embeddings, nlist * MAX_TRAIN_POINTS_PER_CENTROID)
+        logger.info(f"Training {description} on {len(train_vectors)} vectors...")
+        index.train(train_vectors)
+
+    if ids is not None:
+        index = faiss.IndexIDMap2(index)
+        info["id_mapped"] = True
+        if num_vectors:
+            index.add_with_ids(embeddings, np.ascontiguousarray(ids, dtype="int64"))
+    elif num_vectors:
+        index.add(embeddings)
+
+    configure_search(index, nprobe=info.get("nprobe"), ef_search=info.get("ef_search"))
+    logger.info(f"Built '{mode}' index with {index.ntotal} vectors.")
+    return index, info
+
+
+def _base_index(index: faiss.Index) -> faiss.Index:
+    """Strip ID-map / pre-transform / refine wrappers and return the concrete searchable index."""
+    index = faiss.downcast_index(index)
+    while isinstance(index, (faiss.IndexIDMap, faiss.IndexPreTransform, faiss.IndexRefine)):
+        inner = index.base_index if isinstance(index, faiss.IndexRefine) else index.index
+        index = faiss.downcast_index(inner)
+    return index
+
+
+def is_id_mapped(index: faiss.Index) -> bool:
+    """True if search results are stable chunk ids rather than row numbers."""
+    return isinstance(faiss.downcast_index(index), faiss.IndexIDMap)
+
+
+def configure_search(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+) -> None:
+    """Set query-time knobs on the index. Parameters that don't apply to its type are ignored."""
+    base = _base_index(index)
+    if nprobe is not None and isinstance(base, faiss.IndexIVF):
+        base.nprobe = int(min(nprobe, base.nlist))
+    if ef_search is not None and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = int(ef_search)
+
+
+def search_parameters(index: faiss.Index, selector: Optional[faiss.IDSelector] = None):
+    """
+    Per-query SearchParameters restricting the search to `selector`.
+    Carries over the index's current nprobe / efSearch, which a bare params object would reset.
+    The caller must keep `selector` referenced until the search returns.
+    """
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        params = faiss.SearchParametersIVF()
+        params.nprobe = base.nprobe
+    elif isinstance(base, faiss.IndexHNSW):
+        params = faiss.SearchParametersHNSW()
+        params.efSearch = base.hnsw.efSearch
+    else:
+        params = faiss.SearchParameters()
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def supports_selector(index: faiss.Index) -> bool:
+    """Whether index.search honours an IDSelector; flat PQ (IndexPQ) rejects any search parameters."""
+    return not isinstance(_base_index(index), faiss.IndexPQ)
+
+
+def _post_filtered_search(index: faiss.Index, queries: np.ndarray, k: int, allowed_ids: np.ndarray):
+    """
+    Unrestricted search over-fetched by the filter's selectivity, widened until every query has k
+    allowed hits (or the whole index was fetched); hits outside allowed_ids are masked to -1 / -inf.
+    """
+    k = min(k, index.ntotal)
+    fetch = min(index.ntotal, 2 * math.ceil(k * index.ntotal / max(len(allowed_ids), 1)))
+    while True:
+        distances, ids = index.search(queries, fetch)
+        allowed = np.isin(ids, allowed_ids) & (ids != -1)
+        if fetch == index.ntotal or (allowed.sum(axis=1) >= k).all():
+            break
+        fetch = min(index.ntotal, fetch * 4)
+    distances = np.where(allowed, distances, -np.inf)
+    order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+    ids = np.where(allowed, ids, -1)
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+
+def index_mode(index: faiss.Index) -> str:
+    """Infer the mode of a loaded index (used when no index_meta.json exists)."""
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVFPQ):
+        return "ivf_pq"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivf_flat"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "sqfp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    if isinstance(base, faiss.IndexPQ):
+        return "pq"
+    return "flat"
+
+
+def index_nbytes(index: faiss.Index) -> int:
+    """Serialized size of an index, a close proxy for its resident memory."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def rescore_exact(query_embs: np.ndarray, indices: np.ndarray, vectors: np.ndarray, k: int):
+    """
+    Re-rank approximate candidates by exact inner product against the float vectors
+    (a memory-mapped vectors.npy is fine: only the candidate rows are read).
+    Returns FAISS-shaped (distances, indices) truncated to k.
+    """
+    valid = indices >= 0
+    rows = np.where(valid, indices, 0)
+    candidates = np.asarray(vectors[rows.ravel()], dtype=np.float32).reshape(*rows.shape, -1)
+    scores = np.einsum("qkd,qd->qk", candidates, query_embs)
+    scores[~valid] = -np.inf
+
+    order = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    distances = np.take_along_axis(scores, order, axis=1).astype(np.float32)
+    indices = np.where(np.isfinite(distances), np.take_along_axis(indices, order, axis=1), -1)
+    return distances, indices
+
+
+def recall_at_k(exact_ids: np.ndarray, approx_ids: np.ndarray, k: int) -> float:
+    """Mean fraction of the exact top-k neighbours that the approximate search also returned."""
+    hits = 0
+    for exact_row, approx_row in zip(exact_ids[:, :k], approx_ids[:, :k]):
+        hits += len(set(exact_row[exact_row >= 0]) & set(approx_row[approx_row >= 0]))
+    return hits / (k * len(exact_ids)) if len(exact_ids) else 1.0
+
+
+class MultiIndex:
+    """
+    The id-mapped indexes of several segments searched as one. Each is searched for k hits with
+    its own parameters (segments may be of different modes) and the hits are merged by score.
+    """
+
+    def __init__(self, indexes: List[faiss.Index], dimension: int):
+        self.indexes = indexes
+        self.d = dimension
+
+    @property
+    def ntotal(self) -> int:
+        return sum(index.ntotal for index in self.indexes)
+
+    def configure(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+        for index in self.indexes:
+            configure_search(index, nprobe=nprobe, ef_search=ef_search)
+
+    def search(self, queries: np.ndarray, k: int, allowed_ids: Optional[np.ndarray] = None):
+        """FAISS-shaped (distances, ids) over all segments, optionally restricted to the ids in `allowed_ids`."""
+        # Referenced until every segment was searched, as SearchParameters only borrow it
+        selector = faiss.IDSelectorBatch(allowed_ids) if allowed_ids is not None else None
+        distances, ids = [], []
+        for index in self.indexes:
+            if index.ntotal == 0:
+                continue
+            if selector is None:
+                part_distances, part_ids = index.search(queries, min(k, index.ntotal))
+            elif supports_selector(index):
+                params = search_parameters(index, selector)
+                part_distances, part_ids = index.search(queries, min(k, index.ntotal), params=params)
+            else:
+                part_distances, part_ids = _post_filtered_search(index, queries, k, allowed_ids)
+            distances.append(np.where(part_ids == -1, -np.inf, part_distances).astype(np.float32))
+            ids.append(part_ids)
+        # Padding, so there are k columns (-1 / -inf like FAISS) even when fewer vectors exist
+        distances.append(np.full((len(queries), k), -np.inf, dtype=np.float32))
+        ids.append(np.full((len(queries), k), -1, dtype=np.int64))
+
+        distances, ids = np.hstack(distances), np.hstack(ids)
+        order = np.argsort(-distances, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(ids, order, axis=1)
+
+    def reconstruct_batch(self, ids: np.ndarray) -> np.ndarray:
+        """Only needed by stores without vectors.npy, which predate segments and have a single index."""
+        if len(self.indexes) != 1:
+            raise ValueError("Segments keep their vectors in vectors.npy")
+        return self.indexes[0].reconstruct_batch(ids)
+
@@ -0,0 +1,189 @@
+# rag/lexical.py
+# Compact BM25 inverted index, built by ingest.py for every segment (rag/segments.py).
+# Catches what dense embeddings blur: model codes ("992.2", "gt3 rs"), units ("nm", "lb-ft")
+# and sprint figures ("0-100"). Layout of the index directory:
+# - vocab.json         term -> term id
+# - offsets.npy        int64[n_terms + 1], postings of term t are [offsets[t], offsets[t+1])
+# - doc_ids.npy        int32 chunk row of each posting, ascending within a term
+# - tfs.npy            uint16 term frequency of each posting
+# - doc_len.npy        int32 token count of each chunk
+# - bm25.json          corpus stats and BM25 parameters
+# The arrays are memory-mapped on load; a query only touches the postings of its own terms.
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Words, numbers and compounds joined by . - / (992.2, 0-100, lb-ft, km/h)
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[./-][a-z0-9]+)*")
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+META_FILE = "bm25.json"
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased tokens; compounds are kept whole and also split into their parts."""
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[./-]", token) if part)
+    return tokens
+
+
+def write_bm25_index(path: str, chunks: List[str]) -> None:
+    """Build the inverted index for all chunks (row order = chunk store order) and save it."""
+    os.makedirs(path, exist_ok=True)
+
+    vocab: Dict[str, int] = {}
+    postings: List[List[Tuple[int, int]]] = []
+    doc_len = np.zeros(len(chunks), dtype=np.int32)
+
+    for row, chunk in enumerate(chunks):
+        counts = Counter(tokenize(chunk))
+        doc_len[row] = sum(counts.values())
+        for term, tf in counts.items():
+            term_id = vocab.setdefault(term, len(vocab))
+            if term_id == len(postings):
+                postings.append([])
+            postings[term_id].append((row, tf))
+
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    np.cumsum([len(p) for p in postings], out=offsets[1:])
+    doc_ids = np.fromiter((row for p in postings for row, _ in p), dtype=np.int32, count=int(offsets[-1]))
+    tfs = np.fromiter((min(tf, 65535) for p in postings for _, tf in p), dtype=np.uint16, count=int(offsets[-1]))
+
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    np.save(os.path.join(path, "doc_ids.npy"), doc_ids)
+    np.save(os.path.join(path, "tfs.npy"), tfs)
+    np.save(os.path.join(path, "doc_len.npy"), doc_len)
+    with open(os.path.join(path, "vocab.json"), "w") as f:
+        json.dump(vocab, f)
+    with open(os.path.join(path, META_FILE), "w") as f:
+        json.dump({
+            "num_docs": len(chunks),
+            "avg_doc_len": float(doc_len.mean()) if len(chunks) else 0.0,
+            "k1": BM25_K1,
+            "b": BM25_B,
+        }, f)
+
+
+def bm25_index_exists(path: str) -> bool:
+    return os.path.exists(os.path.join(path, META_FILE))
+
+
+class BM25Index:
+    """Read side of the inverted index."""
+
+    def __init__(self, path: str, mmap: bool = True):
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(path, META_FILE)) as f:
+            meta = json.load(f)
+        with open(os.path.join(path, "vocab.json")) as f:
+            self.vocab: Dict[str, int] = json.load(f)
+
+        self.num_docs = meta["num_docs"]
+        self.total_len = meta["avg_doc_len"] * self.num_docs  # tokens over all chunks
+        self.avg_doc_len = meta["avg_doc_len"] or 1.0
+        self.k1 = meta["k1"]
+        self.b = meta["b"]
+
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode=mmap_mode)
+        self.doc_ids = np.load(os.path.join(path, "doc_ids.npy"), mmap_mode=mmap_mode)
+        self.tfs = np.load(os.path.join(path, "tfs.npy"), mmap_mode=mmap_mode)
+        self.doc_len = np.load(os.path.join(path, "doc_len.npy"), mmap_mode=mmap_mode)
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def doc_freq(self, term: str) -> int:
+        term_id = self.vocab.get(term)
+        return 0 if term_id is None else int(self.offsets[term_id + 1] - self.offsets[term_id])
+
+    def search(self, query: str, top_n: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 top_n for a query as (chunk rows, scores), best first.
+        allowed_ids (sorted) restricts scoring to those rows, e.g. a metadata filter.
+        """
+        idf = {term: bm25_idf(self.num_docs, self.doc_freq(term)) for term in set(tokenize(query)) if term in self.vocab}
+        return _top_n(*self.term_scores(idf, self.avg_doc_len, allowed_ids), top_n)
+
+    def term_scores(self, idf: Dict[str, float], avg_doc_len: float,
+                    allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Summed BM25 weights of the given terms per matching row, with caller-supplied corpus statistics."""
+        docs_parts, weight_parts = [], []
+        for term, term_idf in idf.items():
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            docs = np.asarray(self.doc_ids[start:end], dtype=np.int64)
+            tf = np.asarray(self.tfs[start:end], dtype=np.float64)
+            if allowed_ids is not None:
+                keep = np.isin(docs, allowed_ids, assume_unique=True)
+                docs, tf = docs[keep], tf[keep]
+            if len(docs) == 0:
+                continue
+
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[docs] / avg_doc_len)
+            docs_parts.append(docs)
+            weight_parts.append(term_idf * tf * (self.k1 + 1) / (tf + norm))
+
+        if not docs_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        docs, inverse = np.unique(np.concatenate(docs_parts), return_inverse=True)
+        return docs, np.bincount(inverse, weights=np.concatenate(weight_parts))
+
+
+class MultiBM25Index:
+    """
+    The BM25 indexes of several segments searched as one, rows numbered across them in order.
+    Document count, average length and document frequencies are summed over all segments,
+    so scores are the ones a single index over every chunk would give.
+    """
+
+    def __init__(self, parts: List[BM25Index]):
+        self.parts = parts
+        self.starts = np.cumsum([0] + [len(part) for part in parts])
+        self.num_docs = int(self.starts[-1])
+        total_len = sum(part.total_len for part in parts)
+        self.avg_doc_len = (total_len / self.num_docs if self.num_docs else 0.0) or 1.0
+
+    def __len__(self) -> int:
+        return self.num_docs
+
+    def search(self, query: str, top_n: int, allowed_ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Same contract as BM25Index.search."""
+        doc_freqs = {term: sum(part.doc_freq(term) for part in self.parts) for term in set(tokenize(query))}
+        idf = {term: bm25_idf(self.num_docs, df) for term, df in doc_freqs.items() if df}
+
+        docs_parts, score_parts = [], []
+        for part, start, end in zip(self.parts, self.starts[:-1], self.starts[1:]):
+            allowed = None
+            if allowed_ids is not None:
+                allowed = allowed_ids[(allowed_ids >= start) & (allowed_ids < end)] - start
+            docs, scores = part.term_scores(idf, self.avg_doc_len, allowed)
+            docs_parts.append(docs + start)
+            score_parts.append(scores)
+        if not docs_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+        return _top_n(np.concatenate(docs_parts), np.concatenate(score_parts), top_n)
+
+
+def bm25_idf(num_docs: int, doc_freq: int) -> float:
+    return math.log(1 + (num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+
+def _top_n(docs: np.ndarray, scores: np.ndarray, top_n: int) -> Tuple[np.ndarray, np.ndarray]:
+    top_n = min(top_n, len(docs))
+    if top_n <= 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+    top = np.argpartition(-scores, top_n - 1)[:top_n]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return docs[top], scores[top]
@@ -0,0 +1,211 @@
+# rag/llm_client.py
+# Long-lived Ollama client shared by rag.qa and the evaluation scripts.
+# - One ollama.AsyncClient (one pooled HTTP connection set) living on a dedicated event-loop thread.
+#   Callers may come from any loop or thread (Streamlit runs asyncio.run per request), so
+#   connections are reused no matter who calls.
+# - A semaphore bounds in-flight generations against the single Ollama server; requests beyond
+#   it wait in a queue whose depth is reported by stats().
+# - Every request has a timeout covering queueing + generation.
+
+import asyncio
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional
+
+import ollama
+
+DEFAULT_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "2"))
+DEFAULT_TIMEOUT = float(os.environ.get("OLLAMA_TIMEOUT", "120"))
+
+_STREAM_END = object()
+
+
+class LLMClient:
+    def __init__(
+        self,
+        host: Optional[str] = None,  # defaults to OLLAMA_HOST / localhost, as ollama.Client does
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self.waiting = 0
+        self.max_waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.timeouts = 0
+        self.errors = 0
+        self._wait_seconds = 0.0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._setup(host), self._loop).result()
+
+    async def _setup(self, host: Optional[str]) -> None:
+        # Both are bound to the client loop, so they are created on it
+        self._client = ollama.AsyncClient(host=host)
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+
+    # --------------------------------------------------
+    # Runs on the client loop
+    # --------------------------------------------------
+    async def _acquire(self) -> None:
+        start = time.perf_counter()
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+        try:
+            await self._slots.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.in_flight += 1
+            self._wait_seconds += time.perf_counter() - start
+
+    def _release(self, ok: bool) -> None:
+        self._slots.release()
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += ok
+
+    async def _with_timeout(self, coro, timeout: Optional[float]):
+        try:
+            return await asyncio.wait_for(coro, timeout if timeout is not None else self.timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.errors += 1
+            raise
+
+    async def _chat(self, model: str, messages: List[Dict], options: Optional[Dict], **kwargs) -> Dict:
+        await self._acquire()
+        ok = False
+        try:
+            response = await self._client.chat(model=model, messages=messages, options=options, **kwargs)
+            ok = True
+            return response
+        finally:
+            self._release(ok)
+
+    async def _stream(self, model: str, messages: List[Dict], options: Optional[Dict], emit, **kwargs) -> None:
+        await self._acquire()
+        ok = False
+        try:
+            stream = await self._client.chat(model=model, messages=messages, options=options, stream=True, **kwargs)
+            async for part in stream:
+                emit(part)
+            ok = True
+        finally:
+            self._release(ok)
+
+    # --------------------------------------------------
+    # Public API (any thread / any event loop)
+    # --------------------------------------------------
+    async def chat(self, model: str, messages: List[Dict], options: Optional[Dict] = None,
+                   timeout: Optional[float] = None, **kwargs) -> Dict:
+        """Non-streaming chat; the full Ollama response dict."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._with_timeout(self._chat(model, messages, options, **kwargs), timeout), self._loop
+        )
+        return await asyncio.wrap_future(future)  # cancelling the caller cancels the request
+
+    def chat_sync(self, model: str, messages: List[Dict], options: Optional[Dict] = None,
+                  timeout: Optional[float] = None, **kwargs) -> Dict:
+        """Blocking chat() for synchronous callers (evaluation scripts)."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._with_timeout(self._chat(model, messages, options, **kwargs), timeout), self._loop
+        )
+        return future.result()
+
+    async def chat_stream(self, model: str, messages: List[Dict], options: Optional[Dict] = None,
+                          timeout: Optional[float] = None, **kwargs) -> AsyncIterator[Dict]:
+        """
+        Streaming chat; yields the Ollama response parts as they arrive.
+        Closing the iterator early (e.g. on a detected refusal) stops the generation and frees its slot.
+        """
+        caller_loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(item) -> None:
+            try:
+                caller_loop.call_soon_threadsafe(queue.put_nowait, item)
+            except RuntimeError:
+                pass  # caller loop already closed
+
+        async def produce() -> None:
+            try:
+                await self._with_timeout(self._stream(model, messages, options, emit, **kwargs), timeout)
+                emit(_STREAM_END)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                emit(e)
+
+        future = asyncio.run_coroutine_threadsafe(produce(), self._loop)
+        try:
+            while True:
+                item = await queue.get()
+                if item is _STREAM_END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            future.cancel()
+
+    async def _loaded_models(self) -> List[str]:
+        try:
+            running = await self._client.ps()
+        except Exception:
+            return []
+        return [m.get("model") or m.get("name") for m in running.get("models", [])]
+
+    async def _warm(self, model: str, keep_alive, prefix_messages: Optional[List[Dict]]) -> Dict:
+        was_loaded = model in await self._loaded_models()
+        start = time.perf_counter()
+        # One-token generation: loads the model if needed and leaves the prefix in the KV cache
+        await self._chat(model, prefix_messages or [], {"num_predict": 1}, keep_alive=keep_alive)
+        return {"model": model, "was_loaded": was_loaded, "warm_seconds": round(time.perf_counter() - start, 3)}
+
+    def ensure_warm(self, model: str, keep_alive=None, prefix_messages: Optional[List[Dict]] = None,
+                    timeout: Optional[float] = None) -> Dict:
+        """Blocking: make sure the model is resident (and optionally prime a prompt prefix)."""
+        future = asyncio.run_coroutine_threadsafe(
+            self._with_timeout(self._warm(model, keep_alive, prefix_messages), timeout), self._loop
+        )
+        return future.result()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            started = self.completed + self.timeouts + self.errors + self.in_flight
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "queue_depth": self.waiting,
+                "max_queue_depth": self.max_waiting,
+                "completed": self.completed,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "avg_queue_wait_s": round(self._wait_seconds / started, 4) if started else 0.0,
+            }
+
+
+_default_client: Optional[LLMClient] = None
+_default_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """Process-wide client (created on first use)."""
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
@@ -0,0 +1,101 @@
+# rag/manifest.py
+# Ingest manifest (replaces processed_files.pkl): per source file, the content hash it was ingested
+# with and the stable chunk ids it produced, plus the next free chunk id.
+# ingest.py compares it with data/raw to find new, changed and deleted files, so only those are
+# parsed and embedded again; the chunk ids of changed / deleted files are tombstoned.
+# Chunk ids are never reused, so a FAISS id or a cached (query, chunk id) pair always means one text.
+
+import hashlib
+import json
+import os
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+MANIFEST_VERSION = 1
+
+
+def file_hash(path: str, block_size: int = 1 << 20) -> str:
+    """sha256 of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class FileChanges(NamedTuple):
+    new: List[str]
+    changed: List[str]
+    deleted: List[str]
+    unchanged: List[str]
+
+    def __bool__(self) -> bool:
+        return bool(self.new or self.changed or self.deleted)
+
+
+class Manifest:
+    def __init__(self, files: Optional[Dict[str, Dict]] = None, next_chunk_id: int = 0):
+        self.files = files or {}  # filename -> {"hash", "size", "mtime", "chunk_ids"}
+        self.next_chunk_id = next_chunk_id
+        self.touched = False  # diff() refreshed the mtime of a file whose content did not change
+
+    @classmethod
+    def load(cls, path: str) -> Optional["Manifest"]:
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        return cls(data["files"], data["next_chunk_id"])
+
+    def save(self, path: str) -> None:
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "next_chunk_id": self.next_chunk_id, "files": self.files}, f)
+        os.replace(tmp, path)
+
+    def allocate(self, count: int) -> np.ndarray:
+        """`count` fresh chunk ids, ascending."""
+        ids = np.arange(self.next_chunk_id, self.next_chunk_id + count, dtype=np.int64)
+        self.next_chunk_id += count
+        return ids
+
+    def record(self, filename: str, path: str, content_hash: str, chunk_ids: np.ndarray) -> None:
+        stat = os.stat(path)
+        self.files[filename] = {
+            "hash": content_hash,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+            "chunk_ids": [int(i) for i in chunk_ids],
+        }
+
+    def chunk_ids(self, filenames: List[str]) -> np.ndarray:
+        ids = [i for name in filenames for i in self.files.get(name, {}).get("chunk_ids", [])]
+        return np.asarray(sorted(ids), dtype=np.int64)
+
+    def diff(self, paths: Dict[str, str]) -> Tuple[FileChanges, Dict[str, str]]:
+        """
+        Compare the files on disk (filename -> path) with the manifest.
+        Files whose size and mtime match are trusted without hashing. Also returns the content
+        hash of every new / changed file, for record() once it is ingested.
+        """
+        new, changed, unchanged, hashes = [], [], [], {}
+        for filename, path in sorted(paths.items()):
+            entry = self.files.get(filename)
+            stat = os.stat(path)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                unchanged.append(filename)
+                continue
+            content = file_hash(path)
+            if entry is None:
+                new.append(filename)
+            elif entry["hash"] != content:
+                changed.append(filename)
+            else:
+                entry["mtime"] = stat.st_mtime  # touched, not edited
+                self.touched = True
+                unchanged.append(filename)
+                continue
+            hashes[filename] = content
+        deleted = sorted(set(self.files) - set(paths))
+        return FileChanges(new, changed, deleted, unchanged), hashes
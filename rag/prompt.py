@@ -1,4 +1,10 @@
-PROMPT_TEMPLATE = """
+# rag/prompt.py
+# The static rules are the system message and never change between requests, so they form a
+# prefix Ollama can keep in its KV cache; only the user message (context + question) is new.
+
+from typing import Dict, List
+
+SYSTEM_PROMPT = """
 You are a precise, technical assistant answering questions about the Porsche 911.
 
 STRICT RULES – FOLLOW EXACTLY:
@@ -15,7 +21,9 @@ ANSWER REQUIREMENTS:
 - Be COMPLETE: extract and include every matching technical detail (engine type, power, speed, displacement, etc.).
 - Use exact units and terminology from the context (hp, Nm, km/h, PDK, etc.).
 - If the answer is numeric, include the exact value(s) from context.
+""".strip()
 
+USER_TEMPLATE = """
 Context:
 {context}
 
@@ -23,4 +31,14 @@ Question:
 {question}
 
 Answer:
-"""
\ No newline at end of file
+""".strip()
+
+# Single-message form (rules + context + question), used by the evaluation judge
+PROMPT_TEMPLATE = f"\n{SYSTEM_PROMPT}\n\n{USER_TEMPLATE}\n"
+
+
+def build_messages(context: str, question: str) -> List[Dict]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": USER_TEMPLATE.format(context=context, question=question)},
+    ]
@@ -1,121 +1,466 @@
 # rag/qa.py
 import asyncio
+import hashlib
 import logging
-from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
 from functools import lru_cache
-from typing import Dict, List
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 
-import ollama
-from rag.retriever import Retriever
-from rag.prompt import PROMPT_TEMPLATE
+from rag.answer_cache import AnswerCache, answer_key
+from rag.context import PackedContext, get_token_counter, pack_context
+from rag.embedding_cache import QueryEmbeddingCache, normalize_query
+from rag.llm_client import DEFAULT_MAX_CONCURRENCY, get_llm_client
+from rag.refusal import REFUSAL_PHRASES, RefusalFilter
+from rag.reranker import Reranker
+from rag.retriever import Filters, Retriever, freeze_filters
+from rag.router import DEFAULT_MODEL, Route, RouteStats, classify, is_spec_question, load_routes
+from rag.scheduler import BATCH, INTERACTIVE, Deadline, GenerationScheduler, Overloaded
+from rag.single_flight import SingleFlight
+from rag.spec_store import SpecStore
+from rag.prompt import SYSTEM_PROMPT, USER_TEMPLATE, build_messages
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Cross-encoder reranking (RERANK=0 to disable): score 20 candidates, send only the best 5 to the LLM
+USE_RERANKER = os.environ.get("RERANK", "1") != "0"
+
 # Initialize retriever with optimized params
 retriever = Retriever(
-    top_k=10,
+    top_k=5 if USE_RERANKER else 10,
     min_similarity=0.42,
     min_chunk_length=50,
-    variant_boost=0.18
+    variant_boost=0.18,
+    mode="hybrid",  # BM25 + dense fusion for model codes and spec units; falls back to dense without a BM25 index
+    reranker=Reranker() if USE_RERANKER else None,
+    rerank_candidates=20,
+    embedding_cache=QueryEmbeddingCache(),  # on-disk, shared by all workers and survives restarts
+    # Concurrent queries share one encoder pass (ENCODE_BATCH_WAIT_MS=0 to disable)
+    encode_batch_wait_ms=float(os.environ.get("ENCODE_BATCH_WAIT_MS", "5")) or None,
+    # Pick up stores republished by ingest.py without a restart (STORE_RELOAD_S=0 to disable)
+    reload_interval_s=float(os.environ.get("STORE_RELOAD_S", "5")),
 )
 
-SPEC_KEYWORDS = [
-    "torque", "hp", "horsepower", "power", "nm", "lb-ft", "bhp", "kw",
-    "acceleration", "top speed", "0-60", "0-100", "0 to ", "weight", "displacement"
-]
+get_token_counter()  # load the context tokenizer (if CONTEXT_TOKENIZER is set) now, not on the first request
+
+LLM_MODEL = DEFAULT_MODEL  # default route model, also used by the evaluation judge
+PROMPT_HASH = hashlib.sha1(f"{SYSTEM_PROMPT}\x00{USER_TEMPLATE}".encode("utf-8")).hexdigest()[:12]
+
+# How long Ollama keeps the model (and its cached system-prompt prefix) loaded after a request
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Final answers keyed on question + retrieved chunk ids + prompt + model + index version (ANSWER_CACHE=0 to disable)
+answer_cache = AnswerCache() if os.environ.get("ANSWER_CACHE", "1") != "0" else None
+
+# Model, context window and output cap per question class (ROUTER_CONFIG=path.json overrides entries)
+ROUTES = load_routes(os.environ.get("ROUTER_CONFIG"))
+route_stats = RouteStats()
 
-REFUSAL_PHRASES = [
-    "i don't know", "not mentioned", "not in the documents", "no information",
-    "unable to find", "cannot answer", "not provided", "no data", "insufficient",
-    "not explicitly stated", "no clear match"
-]
+# Admission control in front of generation: bounded queue (QA_MAX_QUEUE), priorities, deadlines.
+# Interactive requests get QA_DEADLINE_S seconds to start answering (retrieval, queueing and time to first
+# token); once tokens flow, generation runs to OLLAMA_TIMEOUT. Batch / evaluation requests have no deadline.
+scheduler = GenerationScheduler(slots=DEFAULT_MAX_CONCURRENCY)
+INTERACTIVE_DEADLINE_S = float(os.environ.get("QA_DEADLINE_S", "60"))
+
+# LLM-free answers for plain spec lookups, from the store ingest.py extracts (SPEC_FAST_PATH=0 to disable).
+# Each store version references its own spec store file, published together with it: reopened whenever
+# the retriever loads a version with a different file, so both answer from the same ingest run.
+SPEC_FAST_PATH = os.environ.get("SPEC_FAST_PATH", "1") != "0"
+_spec_store: Optional[SpecStore] = None
+_spec_store_path: Optional[str] = None
+_spec_store_lock = threading.Lock()
+
+def _current_spec_store() -> Optional[SpecStore]:
+    global _spec_store, _spec_store_path
+    path = retriever.spec_store_path
+    if path != _spec_store_path:
+        with _spec_store_lock:
+            if path != _spec_store_path:
+                # The previous connection is left to in-flight lookups and closed once unreferenced
+                _spec_store = SpecStore(path) if path is not None else None
+                _spec_store_path = path
+    return _spec_store
+
+if SPEC_FAST_PATH:
+    _current_spec_store()  # open at startup, not on the first request
 
 @lru_cache(maxsize=256)
-def _cached_retrieve(question: str) -> List[Dict]:
-    """Cached retrieval to avoid re-embedding identical queries."""
+def _cached_retrieve(question: str, frozen_filters: Tuple = (), index_version: str = "") -> List[Dict]:
+    """
+    In-process cache of full retrieval results, keyed on the normalized question and the store version
+    (a reloaded store misses). Misses still skip the encoder when the persistent embedding cache knows the query.
+    """
     try:
-        return retriever.retrieve(question)
+        filters = {field: list(values) for field, values in frozen_filters} or None
+        return retriever.retrieve(question, filters=filters)
     except Exception as e:
         logger.error(f"Retrieval error for query '{question}': {e}")
         return []
 
-def _build_context(retrieved: List[Dict]) -> str:
-    return "\n\n".join(r["content"] for r in retrieved)
+def _spec_answer(question: str, filters: Optional[Filters] = None) -> Optional[Dict]:
+    """Answer from the spec store when it has a confident match (None = use retrieval + LLM)."""
+    if not SPEC_FAST_PATH or filters or not is_spec_question(question):
+        return None
+    try:
+        spec_store = _current_spec_store()
+        return spec_store.answer(question) if spec_store is not None else None
+    except Exception as e:
+        logger.error(f"Spec store lookup error for query '{question}': {e}")
+        return None
 
-def _is_spec_question(question: str) -> bool:
-    return any(k in question.lower() for k in SPEC_KEYWORDS)
+# Concurrent identical questions share one in-flight retrieval + generation
+single_flight = SingleFlight()
 
-async def ask_async(question: str) -> Dict:
+def _deadline(priority: int, deadline_s: Optional[float]) -> Deadline:
+    if deadline_s is None and priority == INTERACTIVE:
+        deadline_s = INTERACTIVE_DEADLINE_S
+    return Deadline(deadline_s)
+
+async def ask_async(question: str, filters: Optional[Filters] = None,
+                    priority: int = INTERACTIVE, deadline_s: Optional[float] = None) -> Dict:
     """
     Asynchronous version of ask() – recommended for Streamlit integration.
+    filters optionally restricts retrieval by metadata, e.g. {"variant": "GT3"}.
+    priority is INTERACTIVE or BATCH (evaluation); deadline_s defaults to QA_DEADLINE_S for interactive
+    requests. When generation is shed, the answer degrades to the best retrieved passages.
+    Concurrent calls with the same normalized question (filters and priority) share one retrieval + generation.
     """
     question = question.strip()
     if not question:
         return {"answer": "Please provide a valid question.", "citations": []}
+    deadline = _deadline(priority, deadline_s)
+
+    start = time.perf_counter()
+    spec = _spec_answer(question, filters)
+    if spec is not None:
+        route_stats.record("spec_store", time.perf_counter() - start)
+        return spec
+
+    normalized = normalize_query(question)
+    frozen = freeze_filters(filters)
+
+    async def compute() -> Dict:
+        # Retrieve with cache, off the event loop so concurrent requests can batch their encodes
+        retrieved = await asyncio.get_running_loop().run_in_executor(
+            None, _cached_retrieve, normalized, frozen, retriever.index_version
+        )
+        return await _answer(question, retrieved, priority, deadline)
+
+    # Priority is part of the key, so an interactive caller never waits on a batch leader's queue position.
+    # A shed (degraded) answer is not shared with a follower whose own deadline is still live: it tries itself.
+    return await single_flight.run(
+        (normalized, frozen, priority, retriever.index_version), compute,
+        reuse=lambda result: "degraded" not in result or deadline.expired(),
+    )
+
+async def ask_batch_async(questions: List[str], priority: int = BATCH) -> List[Dict]:
+    """
+    Answer several questions, retrieving for all of them in one batched encoder/FAISS pass.
+    At most one generation per slot runs and one more per slot queues, so a batch larger than the
+    scheduler's queue waits for its turn instead of shedding its own tail.
+    """
+    questions = [q.strip() for q in questions]
+    to_retrieve = list(dict.fromkeys(q for q in questions if q))
+
+    try:
+        retrieved_all = dict(zip(to_retrieve, retriever.retrieve_batch(to_retrieve)))
+    except Exception as e:
+        logger.error(f"Batch retrieval error for {len(to_retrieve)} queries: {e}")
+        retrieved_all = {q: [] for q in to_retrieve}
 
-    # Retrieve with cache
-    retrieved = _cached_retrieve(question)
+    generating = asyncio.Semaphore(scheduler.slots + min(scheduler.slots, scheduler.max_queue))
 
+    async def _one(question: str) -> Dict:
+        if not question:
+            return {"answer": "Please provide a valid question.", "citations": []}
+        spec = _spec_answer(question)
+        if spec is not None:
+            return spec
+        async with generating:
+            return await _answer(question, retrieved_all[question], priority, _deadline(priority, None))
+
+    return list(await asyncio.gather(*(_one(q) for q in questions)))
+
+def _gate(question: str, retrieved: List[Dict]) -> Optional[Dict]:
+    """Answer without the LLM when retrieval is empty or not confident enough (None = generate)."""
     if not retrieved:
         return {
             "answer": "I don't know — no relevant information was found in the documents.",
             "citations": []
         }
 
-    best_score = retrieved[0]["score"]
-    threshold = 0.38 if _is_spec_question(question) else 0.45
+    best_score = max(r["score"] for r in retrieved)  # hybrid results are ordered by fusion score
+    threshold = 0.38 if is_spec_question(question) else 0.45
 
     if best_score < threshold:
         return {
             "answer": "I don't know — insufficient confidence based on available documents.",
             "citations": []
         }
+    return None
 
-    context = _build_context(retrieved)
-    prompt = PROMPT_TEMPLATE.format(context=context, question=question)
+def _route(question: str, retrieved: List[Dict]) -> Tuple[str, Route]:
+    question_class = classify(question, retrieved)
+    return question_class, ROUTES[question_class]
 
-    loop = asyncio.get_event_loop()
-    try:
-        with ThreadPoolExecutor() as pool:
-            response = await loop.run_in_executor(
-                pool,
-                lambda: ollama.chat(
-                    model="mistral:7b-instruct-q4_0",
-                    messages=[{"role": "user", "content": prompt}],
-                    options={
-                        "temperature": 0.0,
-                        "num_ctx": 8192,
-                        "max_tokens": 700
-                    }
-                )
-            )
-        answer = response["message"]["content"].strip()
-    except Exception as e:
-        logger.error(f"Ollama generation error: {e}")
-        return {
-            "answer": "Sorry, I encountered an error while generating the response. Please try again.",
-            "citations": []
-        }
+def _answer_key(question: str, retrieved: List[Dict], route: Route) -> str:
+    return answer_key(question, [r["chunk_id"] for r in retrieved], PROMPT_HASH, route.model, retriever.index_version)
+
+def _messages(question: str, retrieved: List[Dict], question_class: str, route: Route) -> Tuple[List[Dict], PackedContext]:
+    """Prompt messages with a token-budgeted context, and the packing that produced it."""
+    packed = pack_context(retrieved, token_budget=route.token_budget)
+    logger.info(
+        f"Route {question_class} -> {route.model} (num_ctx={route.num_ctx}, num_predict={route.num_predict}); "
+        f"context: {packed.tokens} tokens from {len(packed.chunks)}/{len(retrieved)} chunks "
+        f"({packed.dropped_sentences} duplicate sentences dropped)"
+    )
+    return build_messages(packed.text, question), packed
 
+def _log_prefill(response: Dict) -> None:
+    """Prompt size and prefill time as reported by Ollama (durations are in nanoseconds)."""
+    prompt_tokens = response.get("prompt_eval_count")
+    prefill_ns = response.get("prompt_eval_duration")
+    if prompt_tokens is not None and prefill_ns is not None:
+        logger.info(f"Prefill: {prompt_tokens} prompt tokens in {prefill_ns / 1e6:.0f} ms")
+
+def _result(question: str, answer: str, retrieved: List[Dict], packed: PackedContext, route: Route,
+            refused: bool = False) -> Dict:
+    """Final response dict for a generated answer, cached for later calls. Cites only the packed chunks."""
     # Strong refusal detection
-    if any(phrase in answer.lower() for phrase in REFUSAL_PHRASES):
-        return {
+    if refused or any(phrase in answer.lower() for phrase in REFUSAL_PHRASES):
+        result = {
             "answer": "I don't know based on the provided Porsche 911 documents.",
             "citations": []
         }
+    else:
+        citations = retriever.get_citations(packed.chunks)
+        result = {
+            "answer": answer,
+            "citations": citations,
+            "best_score": round(max(r["score"] for r in retrieved), 3),
+            "num_sources": len(citations)
+        }
+
+    # Generation is deterministic (temperature 0), so refusals are cached too; errors never are
+    if answer_cache is not None:
+        answer_cache.put(_answer_key(question, retrieved, route), retriever.index_version, result)
+    return {**result, "cached": False}
+
+def _cached_answer(question: str, retrieved: List[Dict], route: Route) -> Optional[Dict]:
+    if answer_cache is None:
+        return None
+    cached = answer_cache.get(_answer_key(question, retrieved, route), retriever.index_version)
+    return {**cached, "cached": True} if cached is not None else None
 
-    citations = retriever.get_citations(retrieved)
+GENERATION_ERROR = {
+    "answer": "Sorry, I encountered an error while generating the response. Please try again.",
+    "citations": []
+}
 
+def _excerpt(text: str, max_chars: int = 300) -> str:
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rsplit(" ", 1)[0] + " …"
+
+def _retrieval_only(retrieved: List[Dict], reason: str) -> Dict:
+    """Degraded answer when generation was shed: the best passages and their citations, no LLM."""
+    top = retrieved[:3]
+    logger.warning(f"Generation shed ({reason}), answering with {len(top)} retrieved passages")
     return {
-        "answer": answer,
+        "answer": "The assistant is under heavy load right now. The most relevant passages from the documents are:\n\n"
+                  + "\n\n".join(f"> {_excerpt(r['content'])}" for r in top),
+        "citations": retriever.get_citations(top),
+        "num_sources": len(top),
+        "degraded": reason,
+    }
+
+def _truncated(answer: str, packed: PackedContext) -> Dict:
+    """Final response when generation failed after part of the answer was streamed: kept, marked cut off, not cached."""
+    citations = retriever.get_citations(packed.chunks)
+    return {
+        "answer": answer.rstrip() + " …",
         "citations": citations,
-        "best_score": round(best_score, 3),
-        "num_sources": len(citations)
+        "num_sources": len(citations),
+        "truncated": True,
+    }
+
+async def _generate(route: Route, messages: List[Dict], deadline: Deadline) -> AsyncIterator[Dict]:
+    """
+    Ollama response parts. The deadline bounds the wait for the first part (queueing in the client and
+    prefill); after that the generation is no longer cut short by it, only by the client's timeout.
+    """
+    scheduler.check(deadline)  # the wait for the slot may have used up what was left
+    stream = get_llm_client().chat_stream(
+        model=route.model,
+        messages=messages,
+        options=route.options(),
+        keep_alive=KEEP_ALIVE
+    )
+    try:
+        try:
+            first = await asyncio.wait_for(stream.__anext__(), deadline.remaining())
+        except StopAsyncIteration:
+            return
+        yield first
+        async for part in stream:
+            yield part
+    finally:
+        await stream.aclose()  # stops the generation on the server side too
+
+async def _answer(question: str, retrieved: List[Dict], priority: int = INTERACTIVE,
+                  deadline: Optional[Deadline] = None) -> Dict:
+    """Confidence gating, generation and refusal detection for already-retrieved chunks."""
+    deadline = deadline or Deadline(None)
+    early = _gate(question, retrieved)
+    if early is not None:
+        return early
+    question_class, route = _route(question, retrieved)
+    cached = _cached_answer(question, retrieved, route)
+    if cached is not None:
+        return cached
+
+    start = time.perf_counter()
+    messages, packed = _messages(question, retrieved, question_class, route)
+    try:
+        # Retrieval and reranking may have used up the budget: shed now instead of queueing a sure timeout
+        scheduler.check(deadline)
+        async with scheduler.slot(priority, deadline):
+            parts = [part async for part in _generate(route, messages, deadline)]
+        answer = "".join(part["message"]["content"] for part in parts).strip()
+        response = parts[-1] if parts else {}  # the final part carries the timings
+    except Overloaded as e:
+        return _retrieval_only(retrieved, e.reason)
+    except asyncio.TimeoutError:
+        if deadline.expired():
+            return _retrieval_only(retrieved, "deadline")
+        logger.error("Ollama generation timed out")
+        return dict(GENERATION_ERROR)
+    except Exception as e:
+        logger.error(f"Ollama generation error: {e}")
+        return dict(GENERATION_ERROR)
+
+    _log_prefill(response)
+    route_stats.record(question_class, time.perf_counter() - start)
+    return {**_result(question, answer, retrieved, packed, route), "question_class": question_class}
+
+async def ask_stream(question: str, filters: Optional[Filters] = None,
+                     priority: int = INTERACTIVE, deadline_s: Optional[float] = None) -> AsyncIterator[Dict]:
+    """
+    Streaming version of ask_async(). Yields events:
+    - {"type": "retrieval", "chunks": [...]}  as soon as retrieval is done
+    - {"type": "token", "text": "..."}        answer text as it is generated
+    - {"type": "done", **response}            the same dict ask_async() returns
+    The "done" answer is authoritative: on a late refusal it replaces the streamed text.
+    priority / deadline_s as in ask_async(); a shed request ends with the retrieval-only answer.
+    """
+    question = question.strip()
+    if not question:
+        yield {"type": "done", "answer": "Please provide a valid question.", "citations": []}
+        return
+    deadline = _deadline(priority, deadline_s)
+
+    spec = _spec_answer(question, filters)
+    if spec is not None:
+        yield {"type": "done", **spec}
+        return
+
+    loop = asyncio.get_event_loop()
+    retrieved = await loop.run_in_executor(
+        None, _cached_retrieve, normalize_query(question), freeze_filters(filters), retriever.index_version
+    )
+    yield {"type": "retrieval", "chunks": retrieved}
+
+    early = _gate(question, retrieved)
+    if early is not None:
+        yield {"type": "done", **early}
+        return
+    question_class, route = _route(question, retrieved)
+    cached = _cached_answer(question, retrieved, route)
+    if cached is not None:
+        yield {"type": "done", **cached}
+        return
+
+    start = time.perf_counter()
+    messages, packed = _messages(question, retrieved, question_class, route)
+    refusal = RefusalFilter()
+    streamed = False
+    try:
+        scheduler.check(deadline)  # as in _answer: shed rather than queue a generation that cannot start in time
+        async with scheduler.slot(priority, deadline):
+            stream = _generate(route, messages, deadline)
+            try:
+                async for part in stream:
+                    if part.get("done"):
+                        _log_prefill(part)  # the final part carries the timings
+                    text = refusal.feed(part["message"]["content"])
+                    if refusal.refused:
+                        break  # no point generating the rest of a refusal
+                    if text:
+                        streamed = True
+                        yield {"type": "token", "text": text}
+            finally:
+                await stream.aclose()
+    except Overloaded as e:
+        yield {"type": "done", **_retrieval_only(retrieved, e.reason)}
+        return
+    except Exception as e:
+        if streamed:
+            # The client already shows part of the answer: end it as cut off rather than contradict it
+            logger.warning(f"Ollama streaming stopped after {refusal.emitted} characters: {e!r}")
+            tail = refusal.flush()
+            if tail:
+                yield {"type": "token", "text": tail}
+            yield {"type": "done", **_truncated(refusal.text, packed), "question_class": question_class}
+            return
+        if isinstance(e, asyncio.TimeoutError) and deadline.expired():
+            yield {"type": "done", **_retrieval_only(retrieved, "deadline")}
+            return
+        logger.error(f"Ollama streaming error: {e!r}")
+        yield {"type": "done", **GENERATION_ERROR}
+        return
+
+    tail = refusal.flush()
+    if tail:
+        yield {"type": "token", "text": tail}
+    route_stats.record(question_class, time.perf_counter() - start)
+    result = _result(question, refusal.text.strip(), retrieved, packed, route, refused=refusal.refused)
+    yield {"type": "done", **result, "question_class": question_class}
+
+def warm_up() -> Dict:
+    """Load every routed LLM and prime the system-prompt prefix so the first user request skips both."""
+    status = {}
+    for model in dict.fromkeys(route.model for route in ROUTES.values()):
+        try:
+            status[model] = get_llm_client().ensure_warm(
+                model, keep_alive=KEEP_ALIVE, prefix_messages=[{"role": "system", "content": SYSTEM_PROMPT}]
+            )
+        except Exception as e:
+            logger.warning(f"LLM warm-up failed for {model}: {e}")
+            status[model] = {"model": model, "error": str(e)}
+    logger.info(f"LLM warm-up: {status}")
+    return status
+
+def pipeline_stats() -> Dict:
+    """Admission, LLM client, per-class latency, coalescing and vector store counters in one place."""
+    return {
+        "scheduler": scheduler.stats(),
+        "llm_client": get_llm_client().stats(),
+        "routes": route_stats.summary(),
+        "coalescing": dict(single_flight.stats),
+        "encode_batcher": retriever.encode_batcher.stats() if retriever.encode_batcher else None,
+        "vector_store": {"version": retriever.index_version, "segments": retriever.num_segments},
     }
 
 # Synchronous wrapper for backward compatibility
-def ask(question: str) -> Dict:
+def ask(question: str, filters: Optional[Filters] = None,
+        priority: int = INTERACTIVE, deadline_s: Optional[float] = None) -> Dict:
     """Synchronous fallback – uses async under the hood."""
-    return asyncio.run(ask_async(question))
\ No newline at end of file
+    return asyncio.run(ask_async(question, filters=filters, priority=priority, deadline_s=deadline_s))
+
+def ask_batch(questions: List[str], priority: int = BATCH) -> List[Dict]:
+    """Synchronous wrapper around ask_batch_async()."""
+    return asyncio.run(ask_batch_async(questions, priority=priority))
\ No newline at end of file
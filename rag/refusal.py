@@ -0,0 +1,52 @@
+# rag/refusal.py
+# Refusal detection for generated answers: the phrases that mark a refusal, and an incremental
+# check over a token stream so refusals are suppressed without buffering the whole answer.
+
+from typing import List
+
+REFUSAL_PHRASES = [
+    "i don't know", "not mentioned", "not in the documents", "no information",
+    "unable to find", "cannot answer", "not provided", "no data", "insufficient",
+    "not explicitly stated", "no clear match"
+]
+
+
+class RefusalFilter:
+    """
+    Incremental REFUSAL_PHRASES check over a token stream.
+    The opening of an answer (where refusals usually are) is held back, and afterwards a short
+    tail, so a phrase split across tokens is still caught before any of it is shown.
+    """
+
+    def __init__(self, phrases: List[str] = REFUSAL_PHRASES, hold_chars: int = 80):
+        self.phrases = [p.lower() for p in phrases]
+        self.tail = max(len(p) for p in self.phrases) - 1
+        self.hold_chars = hold_chars
+        self.text = ""
+        self.emitted = 0
+        self.refused = False
+
+    def feed(self, token: str) -> str:
+        """Add a token; return the text that is now safe to show ("" while holding or after a refusal)."""
+        if self.refused:
+            return ""
+        # Any phrase completed by this token starts within the last `tail` characters seen so far
+        start = max(0, len(self.text) - self.tail)
+        self.text += token
+        if any(p in self.text[start:].lower() for p in self.phrases):
+            self.refused = True
+            return ""
+        if len(self.text) < self.hold_chars:
+            return ""
+        release_to = len(self.text) - self.tail
+        if release_to <= self.emitted:
+            return ""
+        released, self.emitted = self.text[self.emitted:release_to], release_to
+        return released
+
+    def flush(self) -> str:
+        """Remaining held-back text once the stream has ended."""
+        if self.refused:
+            return ""
+        released, self.emitted = self.text[self.emitted:], len(self.text)
+        return released
@@ -0,0 +1,80 @@
+# rag/reranker.py
+# Optional cross-encoder reranking stage for the Retriever.
+# The bi-encoder fetches a wide candidate pool cheaply; a small CPU cross-encoder then scores
+# every (query, chunk) pair in one batch so only the few best chunks reach the prompt.
+# Scores are cached per (query hash, chunk id), so repeated questions skip the model entirely.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+
+import numpy as np
+from sentence_transformers import CrossEncoder
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+
+class Reranker:
+    def __init__(
+        self,
+        model_name: str = DEFAULT_RERANK_MODEL,
+        cache_size: int = 4096,
+        batch_size: int = 32,
+        device: str = "cpu",
+    ):
+        self.model_name = model_name
+        self.model = CrossEncoder(model_name, device=device)
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _query_key(query: str) -> str:
+        return hashlib.sha1(" ".join(query.lower().split()).encode("utf-8")).hexdigest()
+
+    def score(self, query: str, chunk_ids: Sequence[int], texts: Sequence[str]) -> np.ndarray:
+        """Relevance of each text to the query (higher is better). Uncached pairs are scored in one batch."""
+        query_key = self._query_key(query)
+        keys = [(query_key, int(chunk_id)) for chunk_id in chunk_ids]
+        scores = np.empty(len(keys), dtype=np.float64)
+
+        missing: List[int] = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+                else:
+                    missing.append(i)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            predicted = self.model.predict(
+                [(query, texts[i]) for i in missing],
+                batch_size=self.batch_size,
+                show_progress_bar=False,
+            )
+            with self._lock:
+                for i, value in zip(missing, predicted):
+                    scores[i] = float(value)
+                    self._cache[keys[i]] = float(value)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return scores
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "model": self.model_name,
+            "cache_entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+        }
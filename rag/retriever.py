@@ -1,15 +1,46 @@
 # rag/retriever.py
+import logging
+import math
 import os
-import pickle
-import faiss
+import threading
+import time
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional, Tuple, Union
+
+from rag.batcher import EncodeBatcher
+from rag.chunk_store import MISSING, ChunkStore
+from rag.embedding_cache import QueryEmbeddingCache, normalize_query
+from rag.index_factory import COMPRESSED_MODES, RESCORE_FACTOR, MultiIndex, rescore_exact
+from rag.reranker import Reranker
+from rag.segments import open_vector_store, store_version
+
+logger = logging.getLogger(__name__)
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 VECTOR_STORE_PATH = os.path.join(PROJECT_ROOT, "embeddings", "vector_store")
-INDEX_FILE = os.path.join(VECTOR_STORE_PATH, "index.faiss")
-DATA_FILE = os.path.join(VECTOR_STORE_PATH, "data.pkl")
+
+# Retrieval modes: dense (embeddings only), hybrid (dense + BM25, reciprocal rank fusion),
+# lexical (BM25 only, never runs the transformer; scores are BM25, not cosine)
+RETRIEVAL_MODES = ("dense", "hybrid", "lexical")
+RRF_K = 60
+
+# Filterable metadata field -> (chunk store column, vocabulary)
+FILTER_FIELDS = {
+    "variant": ("variant_id", "variants"),
+    "source": ("source_id", "sources"),
+    "element_type": ("element_type_id", "element_types"),
+}
+
+# Filters matching at most this many chunks are scored exactly against vectors.npy
+# instead of running an id-restricted FAISS search (see MultiIndex.search)
+SUBSET_SCAN_MAX = 50_000
+
+Filters = Dict[str, Union[str, List[str]]]
+
+# Adaptive overfetch: searches start at top_k / expected survival ratio and double when needed
+BASELINE_OVERFETCH = 3  # fixed window the ranking guarantees to cover when a variant boost applies
+WIDEN_FACTOR = 2
 
 VARIANT_KEYWORDS = {
     "gt3": "GT3",
@@ -21,6 +52,88 @@ VARIANT_KEYWORDS = {
     "gts": "GTS",
 }
 
+def freeze_filters(filters: Optional[Filters]) -> Tuple:
+    """Hashable, order-independent form of a filter dict (for cache keys)."""
+    if not filters:
+        return ()
+    return tuple(sorted(
+        (field, (wanted,) if isinstance(wanted, str) else tuple(sorted(wanted)))
+        for field, wanted in filters.items()
+    ))
+
+class Ranked(NamedTuple):
+    """Filtered candidates of one query, best first (chunk rows, boosted scores, raw scores)."""
+    ids: np.ndarray
+    scores: np.ndarray
+    similarities: np.ndarray
+
+class OverfetchStats:
+    """
+    Running survival ratios of the post-search filters (similarity, length, dedup).
+    The length+dedup survival of above-threshold candidates sizes the first search of each query.
+    Counts decay so the estimate follows the corpus and the query mix.
+    """
+
+    def __init__(self, prior_survival: float = 0.5, prior_weight: float = 20.0,
+                 safety_margin: float = 1.25, decay: float = 0.99):
+        self.safety_margin = safety_margin
+        self.decay = decay
+        self._lock = threading.Lock()
+        # prior: `prior_weight` candidates seen, `prior_survival` of them kept
+        self._counts = {
+            "fetched": prior_weight,
+            "after_similarity": prior_weight,
+            "after_length": prior_weight * math.sqrt(prior_survival),
+            "after_dedup": prior_weight * prior_survival,
+        }
+        self.queries = 0
+        self.searches = 0
+        self.widened = 0
+
+    def record(self, counts: Dict[str, int], searches: int) -> None:
+        with self._lock:
+            for key, value in counts.items():
+                self._counts[key] = self._counts[key] * self.decay + value
+            self.queries += 1
+            self.searches += searches
+            self.widened += searches > 1
+
+    def survival(self) -> Dict[str, float]:
+        with self._lock:
+            c = dict(self._counts)
+        return {
+            "similarity": c["after_similarity"] / c["fetched"] if c["fetched"] else 1.0,
+            "length": c["after_length"] / c["after_similarity"] if c["after_similarity"] else 1.0,
+            "dedup": c["after_dedup"] / c["after_length"] if c["after_length"] else 1.0,
+        }
+
+    def fetch_size(self, top_k: int, limit: int) -> int:
+        """Candidates to request so that ~top_k survive the length and dedup filters."""
+        ratios = self.survival()
+        survival = max(ratios["length"] * ratios["dedup"], 0.05)
+        return max(1, min(math.ceil(top_k / survival * self.safety_margin), limit))
+
+    def summary(self) -> Dict:
+        return {
+            "survival": {k: round(v, 4) for k, v in self.survival().items()},
+            "queries": self.queries,
+            "avg_searches_per_query": round(self.searches / self.queries, 3) if self.queries else 0.0,
+            "widened_ratio": round(self.widened / self.queries, 3) if self.queries else 0.0,
+        }
+
+class StoreSnapshot(NamedTuple):
+    """One published version of the vector store as the Retriever searches it; replaced whole on reload."""
+    version: str
+    num_segments: int
+    index: MultiIndex
+    store: ChunkStore
+    vectors: Optional[np.ndarray]  # or a segments.ConcatRows view
+    lexical: object  # BM25Index / MultiBM25Index, or None
+    id_mapped: bool
+    rescore: bool
+    filter_cache: Dict[Tuple, np.ndarray]  # per version: row ids change when the store does
+    spec_store: Optional[str]  # spec store file published with this version (rag/spec_store.py), or None
+
 class Retriever:
     def __init__(
         self,
@@ -29,25 +142,142 @@ class Retriever:
         min_similarity: float = 0.38,
         min_chunk_length: int = 50,
         variant_boost: float = 0.30,  # how much to boost matching variant
+        nprobe: Optional[int] = None,  # IVF cells scanned per query (IVF modes only)
+        ef_search: Optional[int] = None,  # HNSW candidate list size (HNSW mode only)
+        mmap: bool = True,  # memory-map index + chunk store so processes share pages
+        max_overfetch: int = 32,  # upper bound on candidates fetched, as a multiple of top_k
+        mode: str = "dense",  # dense | hybrid | lexical (default for retrieve calls)
+        reranker: Optional[Reranker] = None,  # cross-encoder stage, see rag/reranker.py
+        rerank_candidates: int = 20,  # pool size scored by the reranker before cutting to top_k
+        rescore: Optional[bool] = None,  # exact rescoring of compressed-index hits (default: auto)
+        embedding_cache: Optional[QueryEmbeddingCache] = None,  # persistent query embeddings, see rag/embedding_cache.py
+        encode_batch_wait_ms: Optional[float] = None,  # micro-batch concurrent query encodes, see rag/batcher.py
+        reload_interval_s: float = 0,  # poll for newly published store versions every N seconds (0 = never)
     ):
+        if mode not in RETRIEVAL_MODES:
+            raise ValueError(f"Unknown retrieval mode '{mode}', expected one of {RETRIEVAL_MODES}")
         self.top_k = top_k
         self.min_similarity = min_similarity
         self.min_chunk_length = min_chunk_length
         self.variant_boost = variant_boost
+        self.max_overfetch = max_overfetch
+        self.overfetch = OverfetchStats()
+        self.mode = mode
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
 
+        self.embedding_model = embedding_model
+        self.embedding_cache = embedding_cache
         self.embedder = SentenceTransformer(embedding_model)
+        self.encode_batcher = None
+        if encode_batch_wait_ms is not None:
+            self.encode_batcher = EncodeBatcher(self._embed_now, max_wait_ms=encode_batch_wait_ms)
 
-        if not os.path.exists(INDEX_FILE):
-            raise FileNotFoundError(f"FAISS index not found at {INDEX_FILE}")
-        self.index = faiss.read_index(INDEX_FILE)
+        # Segments written by ingest.py (rag/segments.py), searched as one store with rows numbered across them
+        self.dimension = self.embedder.get_sentence_embedding_dimension()
+        self.mmap = mmap
+        self._rescore = rescore  # None: auto, i.e. when any segment stores compressed codes
+        self._search_params = {"nprobe": nprobe, "ef_search": ef_search}
+        self._snapshot = self._load()
 
-        if not os.path.exists(DATA_FILE):
-            raise FileNotFoundError(f"Vector data not found at {DATA_FILE}")
-        with open(DATA_FILE, "rb") as f:
-            self.chunks, self.metadata = pickle.load(f)
+        # Hot reload: a watcher thread loads newly published store versions in the background
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        if reload_interval_s:
+            threading.Thread(target=self._watch, args=(reload_interval_s,), name="store-reload", daemon=True).start()
 
-        if self.index.d != self.embedder.get_sentence_embedding_dimension():
+    def _load(self) -> StoreSnapshot:
+        vector_store = open_vector_store(VECTOR_STORE_PATH, mmap=self.mmap)
+        if vector_store.index.d != self.dimension:
             raise ValueError("Embedding dimension mismatch")
+        vector_store.index.configure(**self._search_params)
+
+        # Compressed indexes (SQ / PQ codes) are searched wide and rescored against the float vectors
+        rescore = self._rescore
+        if rescore is None:
+            rescore = any(mode in COMPRESSED_MODES for mode in vector_store.modes)
+        return StoreSnapshot(
+            version=vector_store.version,
+            num_segments=vector_store.num_segments,
+            index=vector_store.index,
+            store=vector_store.store,
+            vectors=vector_store.vectors,
+            lexical=vector_store.lexical,
+            id_mapped=vector_store.id_mapped,
+            rescore=bool(rescore) and vector_store.vectors is not None,
+            filter_cache={},
+            spec_store=vector_store.spec_store,
+        )
+
+    def reload(self) -> bool:
+        """
+        Load the published store version if it differs from the one being searched; returns whether it did.
+        The new version is opened completely before one reference swap publishes it, so queries never
+        wait for a reload and each finishes on the version it started with.
+        """
+        with self._reload_lock:
+            version = store_version(VECTOR_STORE_PATH)
+            if version is None or version == self._snapshot.version:
+                return False
+            started = time.perf_counter()
+            snapshot = self._load()
+            previous, self._snapshot = self._snapshot.version, snapshot
+            self.reloads += 1
+        logger.info(f"Reloaded vector store {previous} -> {snapshot.version} "
+                    f"({snapshot.num_segments} segments) in {time.perf_counter() - started:.2f}s")
+        return True
+
+    def _watch(self, interval_s: float) -> None:
+        while True:
+            time.sleep(interval_s)
+            try:
+                self.reload()
+            except Exception as e:
+                # e.g. a version replaced again while it was being opened; keep serving the loaded one
+                logger.warning(f"Vector store reload failed, still serving {self.index_version}: {e}")
+
+    # The store version being searched right now (new queries use it; caches key on index_version)
+    @property
+    def index_version(self) -> str:
+        return self._snapshot.version
+
+    @property
+    def num_segments(self) -> int:
+        return self._snapshot.num_segments
+
+    # Spec store of the version being searched; a new file per published version, never modified in place
+    @property
+    def spec_store_path(self) -> Optional[str]:
+        return self._snapshot.spec_store
+
+    @property
+    def index(self) -> MultiIndex:
+        return self._snapshot.index
+
+    @property
+    def store(self) -> ChunkStore:
+        return self._snapshot.store
+
+    @property
+    def vectors(self):
+        return self._snapshot.vectors
+
+    @property
+    def lexical(self):
+        return self._snapshot.lexical
+
+    @property
+    def id_mapped(self) -> bool:
+        return self._snapshot.id_mapped
+
+    @property
+    def rescore(self) -> bool:
+        return self._snapshot.rescore
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Tune the accuracy/latency trade-off of approximate indexes for subsequent queries (kept across reloads)."""
+        self._search_params.update({k: v for k, v in (("nprobe", nprobe), ("ef_search", ef_search)) if v is not None})
+        self._snapshot.index.configure(nprobe=nprobe, ef_search=ef_search)
 
     def _extract_query_variant(self, query: str) -> Optional[str]:
         q = query.lower()
@@ -56,51 +286,318 @@ class Retriever:
                 return v
         return None
 
-    def retrieve(self, query: str) -> List[Dict]:
-        query_emb = self.embedder.encode([query], normalize_embeddings=True)
-        distances, indices = self.index.search(query_emb.astype('float32'), self.top_k * 3)
+    def retrieve(self, query: str, filters: Optional[Filters] = None, mode: Optional[str] = None) -> List[Dict]:
+        return self.retrieve_batch([query], filters=filters, mode=mode)[0]
 
-        query_variant = self._extract_query_variant(query)
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        filters: Optional[Filters] = None,
+        mode: Optional[str] = None,
+    ) -> List[List[Dict]]:
+        """
+        Retrieve for several queries at once: one encoder forward pass and one FAISS search.
+        retrieve() is the single-query case of this method, so both apply exactly the same ranking.
 
-        results = []
-        seen = set()
+        filters restricts the search to chunks whose metadata matches, e.g.
+        {"variant": "GT3"} or {"source": ["a.pdf", "b.docx"], "element_type": "Table"}.
+        mode overrides self.mode for this call.
+        """
+        if not queries:
+            return []
 
-        for raw_score, idx in zip(distances[0], indices[0]):
-            if idx == -1:
-                continue
+        # One store version for the whole call, even if a reload swaps in a newer one meanwhile
+        snap = self._snapshot
+        mode = mode or self.mode
+        if mode != "dense" and snap.lexical is None:
+            if mode == "lexical":
+                raise FileNotFoundError(f"No BM25 index in {VECTOR_STORE_PATH}, re-run ingest.py")
+            mode = "dense"
+        if mode == "lexical":
+            return [self._finalize(snap, query, *self._rank_lexical(snap, query, filters)) for query in queries]
 
-            similarity = float(raw_score)
-            if similarity < self.min_similarity:
-                continue
+        query_embs = self._encode(queries)
 
-            content = self.chunks[idx].strip()
-            if len(content) < self.min_chunk_length:
-                continue
-            if content in seen:
-                continue
+        # Adaptive overfetch: start from the expected survival ratio, widen only the queries
+        # whose candidates ran out before the pool filled up
+        pool = self._pool_size()
+        searchable = len(self._filter_ids(snap, filters)) if filters else snap.index.ntotal
+        limit = max(1, min(pool * self.max_overfetch, searchable))
+        k = self.overfetch.fetch_size(pool, limit)
 
-            seen.add(content)
+        ranked: List[Ranked] = [None] * len(queries)
+        hits: List[Tuple[np.ndarray, np.ndarray]] = [None] * len(queries)
+        searches = [0] * len(queries)
+        pending = list(range(len(queries)))
 
-            meta = self.metadata[idx]
-            score = similarity
+        while pending:
+            distances, indices = self._search(snap, query_embs[pending], k, filters)
+            retry = []
+            for row, qi in enumerate(pending):
+                ranked[qi], counts = self._rank(snap, queries[qi], distances[row], indices[row])
+                hits[qi] = (distances[row], indices[row])
+                searches[qi] += 1
+                if k < limit and self._needs_widening(queries[qi], ranked[qi], k, distances[row], indices[row]):
+                    retry.append(qi)
+                else:
+                    self.overfetch.record(counts, searches[qi])
+            pending = retry
+            k = min(k * WIDEN_FACTOR, limit)
 
-            # Variant-aware boost (only if query contains a variant)
-            if query_variant and meta.get("variant") == query_variant:
-                score += self.variant_boost  # simple additive boost
-                score = min(score, 1.0)
+        if mode == "hybrid":
+            return [
+                self._finalize(snap, query, *self._rank_hybrid(snap, query, query_embs[qi], *hits[qi], filters))
+                for qi, query in enumerate(queries)
+            ]
+        return [self._finalize(snap, query, ranked[qi]) for qi, query in enumerate(queries)]
 
-            results.append({
-                "content": content,
-                "metadata": meta,
-                "score": score,
-                "original_score": similarity  # for debugging
-            })
+    def _encode(self, queries: List[str]) -> np.ndarray:
+        """Query embeddings; with a cache only the misses go through the encoder (in one batch)."""
+        if self.embedding_cache is None:
+            return self._embed(list(queries))
 
-        # Sort by boosted score
-        results = sorted(results, key=lambda x: x["score"], reverse=True)[:self.top_k]
+        # Encode the normalized text so a cached vector never depends on which spelling came first
+        normalized = [normalize_query(q) for q in queries]
+        cached = self.embedding_cache.get_many(normalized, self.embedding_model)
+        query_embs = np.empty((len(queries), self.dimension), dtype=np.float32)
+        for i, emb in cached.items():
+            query_embs[i] = emb
 
+        missing = [i for i in range(len(queries)) if i not in cached]
+        if missing:
+            misses = list(dict.fromkeys(normalized[i] for i in missing))
+            encoded = self._embed(misses)
+            self.embedding_cache.put_many(misses, self.embedding_model, encoded)
+            by_text = dict(zip(misses, encoded))
+            for i in missing:
+                query_embs[i] = by_text[normalized[i]]
+        return query_embs
+
+    def _embed_now(self, texts: List[str]) -> np.ndarray:
+        return self.embedder.encode(texts, normalize_embeddings=True).astype('float32')
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        """Encoder pass; with a batcher, shared with whatever other threads are encoding right now."""
+        if self.encode_batcher is not None:
+            return self.encode_batcher.encode(texts)
+        return self._embed_now(texts)
+
+    def _pool_size(self) -> int:
+        """Candidates kept after filtering: top_k, or the rerank pool when a reranker is set."""
+        if self.reranker is not None:
+            return max(self.top_k, self.rerank_candidates)
+        return self.top_k
+
+    def _needs_widening(self, query: str, ranked: Ranked, k: int,
+                        distances: np.ndarray, indices: np.ndarray) -> bool:
+        """Could candidates beyond the first k change this query's candidate pool?"""
+        if (indices == -1).any():
+            return False  # search already returned everything there is
+        tail_similarity = float(distances[-1])
+        if tail_similarity < self.min_similarity:
+            return False  # everything further down is below the threshold too
+        if len(ranked.ids) < self._pool_size():
+            return True
+        # A boosted chunk just past the window could still outrank the current last candidate.
+        # Cover at least the fixed window the ranking always used, so results never get worse.
+        if k < self.top_k * BASELINE_OVERFETCH and self._extract_query_variant(query):
+            return ranked.scores[-1] < min(tail_similarity + self.variant_boost, 1.0)
+        return False
+
+    def _filter_ids(self, snap: StoreSnapshot, filters: Filters) -> np.ndarray:
+        """Sorted row ids matching every field of `filters` (cached per distinct filter)."""
+        key = freeze_filters(filters)
+        if key not in snap.filter_cache:
+            mask = np.ones(len(snap.store), dtype=bool)
+            for field, wanted in key:
+                if field not in FILTER_FIELDS:
+                    raise ValueError(f"Cannot filter on '{field}', expected one of {list(FILTER_FIELDS)}")
+                column, vocab = FILTER_FIELDS[field]
+                codes = [snap.store.code(vocab, value) for value in wanted]
+                codes = [code for code in codes if code != MISSING]
+                mask &= np.isin(snap.store.columns[column], codes)
+            mask &= ~snap.store.columns["deleted"]
+            snap.filter_cache[key] = np.flatnonzero(mask).astype(np.int64)
+        return snap.filter_cache[key]
+
+    def _search(self, snap: StoreSnapshot, query_embs: np.ndarray, k: int, filters: Optional[Filters] = None):
+        """FAISS-shaped (distances, indices) search, optionally restricted to filtered rows."""
+        if not filters:
+            return self._index_search(snap, query_embs, k)
+
+        ids = self._filter_ids(snap, filters)
+        distances = np.full((len(query_embs), k), -np.inf, dtype=np.float32)
+        indices = np.full((len(query_embs), k), -1, dtype=np.int64)
+        if len(ids) == 0:
+            return distances, indices
+
+        if snap.vectors is not None and len(ids) <= SUBSET_SCAN_MAX:
+            # Exact scan over the matching rows only
+            scores = query_embs @ np.asarray(snap.vectors[ids]).T
+            k_eff = min(k, len(ids))
+            top = np.argpartition(-scores, k_eff - 1, axis=1)[:, :k_eff]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            order = np.argsort(-top_scores, axis=1, kind="stable")
+            distances[:, :k_eff] = np.take_along_axis(top_scores, order, axis=1)
+            indices[:, :k_eff] = ids[np.take_along_axis(top, order, axis=1)]
+            return distances, indices
+
+        allowed_ids = snap.store.columns["chunk_id"][ids] if snap.id_mapped else ids
+        return self._index_search(snap, query_embs, k, allowed_ids)
+
+    def _rows(self, snap: StoreSnapshot, indices: np.ndarray) -> np.ndarray:
+        """FAISS result ids -> store rows."""
+        return snap.store.rows_for_ids(indices) if snap.id_mapped else indices
+
+    def _index_search(self, snap: StoreSnapshot, query_embs: np.ndarray, k: int,
+                      allowed_ids: Optional[np.ndarray] = None):
+        """index.search (as store rows), widened and exactly rescored when the index stores compressed codes."""
+        if not snap.rescore:
+            distances, indices = snap.index.search(query_embs, k, allowed_ids)
+            return distances, self._rows(snap, indices)
+        fetch = min(k * RESCORE_FACTOR, snap.index.ntotal)
+        _, indices = snap.index.search(query_embs, fetch, allowed_ids)
+        indices = self._rows(snap, indices)
+        distances, indices = rescore_exact(query_embs, indices, snap.vectors, k)
+        if indices.shape[1] < k:  # pad like FAISS does when fewer than k rows exist
+            pad = k - indices.shape[1]
+            distances = np.pad(distances, ((0, 0), (0, pad)), constant_values=-np.inf)
+            indices = np.pad(indices, ((0, 0), (0, pad)), constant_values=-1)
+        return distances, indices
+
+    def _survivors(self, snap: StoreSnapshot, ids: np.ndarray, keep: np.ndarray,
+                   counts: Dict[str, int]) -> np.ndarray:
+        """Positions in `ids` passing `keep`, the tombstone and min-length filters and exact-duplicate removal."""
+        columns = snap.store.columns
+        keep = keep & ~columns["deleted"][ids] & (columns["text_len"][ids] >= self.min_chunk_length)
+        counts["after_length"] = int(keep.sum())
+        positions = np.flatnonzero(keep)
+
+        # Exact-duplicate removal: keep the first (best ranked) occurrence of each content hash
+        _, first = np.unique(columns["content_hash"][ids[positions]], return_index=True)
+        positions = positions[np.sort(first)]
+        counts["after_dedup"] = len(positions)
+        return positions
+
+    def _boosted(self, snap: StoreSnapshot, query: str, ids: np.ndarray, similarities: np.ndarray) -> np.ndarray:
+        """Variant-aware boost (only if query contains a variant)."""
+        scores = similarities.copy()
+        query_variant_id = snap.store.code("variants", self._extract_query_variant(query))
+        if query_variant_id != MISSING:
+            match = snap.store.columns["variant_id"][ids] == query_variant_id
+            scores[match] = np.minimum(scores[match] + self.variant_boost, 1.0)
+        return scores
+
+    def _rank(self, snap: StoreSnapshot, query: str, distances: np.ndarray,
+              indices: np.ndarray) -> Tuple[Ranked, Dict[str, int]]:
+        """
+        Apply similarity, length, dedup and variant-boost filters to one query's hits.
+        Runs as array ops over the store's per-chunk columns and keeps the best pool-size rows.
+        Also returns how many candidates survived each filter (for OverfetchStats).
+        """
+        valid = indices != -1
+        ids = indices[valid]
+        similarities = distances[valid].astype(np.float64)
+        counts = {"fetched": len(ids)}
+
+        keep = similarities >= self.min_similarity
+        counts["after_similarity"] = int(keep.sum())
+        positions = self._survivors(snap, ids, keep, counts)
+        ids, similarities = ids[positions], similarities[positions]
+
+        # Sort by boosted score (stable, so ties keep search order)
+        scores = self._boosted(snap, query, ids, similarities)
+        order = np.argsort(-scores, kind="stable")[:self._pool_size()]
+
+        return Ranked(ids[order], scores[order], similarities[order]), counts
+
+    def _rank_hybrid(self, snap: StoreSnapshot, query: str, query_emb: np.ndarray, distances: np.ndarray,
+                     indices: np.ndarray, filters: Optional[Filters] = None) -> Tuple[Ranked, Dict]:
+        """
+        Fuse the dense hits with BM25 hits by reciprocal rank fusion.
+        Lexical-only hits get their exact cosine from vectors.npy, so "score" stays a boosted
+        similarity the QA confidence gate understands; they skip min_similarity since catching
+        what the embedding under-scores is the point of the lexical side.
+        """
+        valid = indices != -1
+        dense_ids = indices[valid]
+        dense_sims = distances[valid].astype(np.float64)
+        dense_keep = dense_sims >= self.min_similarity
+        dense_ids, dense_sims = dense_ids[dense_keep], dense_sims[dense_keep]
+
+        allowed = self._filter_ids(snap, filters) if filters else None
+        lex_ids, lex_scores = snap.lexical.search(query, self._pool_size() * BASELINE_OVERFETCH, allowed)
+
+        lex_only = lex_ids[~np.isin(lex_ids, dense_ids)]
+        lex_only_sims = (self._vectors_for(snap, lex_only) @ query_emb).astype(np.float64)
+
+        ids = np.concatenate([dense_ids, lex_only])
+        similarities = np.concatenate([dense_sims, lex_only_sims])
+        positions = self._survivors(snap, ids, np.ones(len(ids), dtype=bool), {})
+        ids, similarities = ids[positions], similarities[positions]
+        scores = self._boosted(snap, query, ids, similarities)
+
+        # Ranks in each list (dense by boosted score, lexical by BM25 order); absent = no contribution
+        fused = np.zeros(len(ids))
+        dense_mask = np.isin(ids, dense_ids)
+        dense_order = np.flatnonzero(dense_mask)[np.argsort(-scores[dense_mask], kind="stable")]
+        fused[dense_order] += 1.0 / (RRF_K + 1 + np.arange(len(dense_order)))
+
+        lex_rank = {int(doc): rank for rank, doc in enumerate(lex_ids)}
+        lexical = np.zeros(len(ids))
+        for pos, doc in enumerate(ids):
+            rank = lex_rank.get(int(doc))
+            if rank is not None:
+                fused[pos] += 1.0 / (RRF_K + 1 + rank)
+                lexical[pos] = lex_scores[rank]
+
+        order = np.argsort(-fused, kind="stable")[:self._pool_size()]
+        ranked = Ranked(ids[order], scores[order], similarities[order])
+        return ranked, {"fusion_score": fused[order], "lexical_score": lexical[order]}
+
+    def _rank_lexical(self, snap: StoreSnapshot, query: str,
+                      filters: Optional[Filters] = None) -> Tuple[Ranked, Dict]:
+        """BM25-only retrieval: no embedding; score and original_score are BM25 scores."""
+        allowed = self._filter_ids(snap, filters) if filters else None
+        ids, bm25 = snap.lexical.search(query, self._pool_size() * BASELINE_OVERFETCH, allowed)
+        positions = self._survivors(snap, ids, np.ones(len(ids), dtype=bool), {})[:self._pool_size()]
+        return Ranked(ids[positions], bm25[positions], bm25[positions]), {}
+
+    def _finalize(self, snap: StoreSnapshot, query: str, ranked: Ranked,
+                  extra: Optional[Dict[str, np.ndarray]] = None) -> List[Dict]:
+        """Optionally rerank the candidate pool with the cross-encoder, cut to top_k and decode rows."""
+        extra = dict(extra or {})
+        texts = [snap.store.text(row).strip() for row in ranked.ids]
+        chunk_ids = snap.store.columns["chunk_id"][ranked.ids]  # stable across re-ingests, unlike rows
+
+        order = np.arange(len(ranked.ids))
+        if self.reranker is not None and len(order):
+            rerank_scores = self.reranker.score(query, chunk_ids, texts)
+            order = np.argsort(-rerank_scores, kind="stable")
+            extra["rerank_score"] = rerank_scores
+        order = order[:self.top_k]
+
+        results = []
+        for i in order:
+            result = {
+                "content": texts[i],
+                "metadata": snap.store.metadata(ranked.ids[i]),
+                "score": float(ranked.scores[i]),
+                "original_score": float(ranked.similarities[i]),  # for debugging
+                "chunk_id": int(chunk_ids[i]),
+            }
+            for key, values in extra.items():
+                result[key] = float(values[i])
+            results.append(result)
         return results
 
+    def _vectors_for(self, snap: StoreSnapshot, ids: np.ndarray) -> np.ndarray:
+        if len(ids) == 0:
+            return np.empty((0, snap.index.d), dtype=np.float32)
+        if snap.vectors is not None:
+            return np.asarray(snap.vectors[ids], dtype=np.float32)
+        return snap.index.reconstruct_batch(snap.store.columns["chunk_id"][ids] if snap.id_mapped else ids)
+
     def get_citations(self, retrieved_chunks: List[Dict]) -> List[Dict]:
         """Improved citations using real metadata fields"""
         citations = []
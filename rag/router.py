@@ -0,0 +1,113 @@
+# rag/router.py
+# Question router for rag.qa: classifies a question (spec, date, descriptive, comparison) from
+# keyword heuristics plus retrieval signals, and picks the model, context window, context token
+# budget and output cap for that class from ROUTES. Per-class latency is tracked so the table can
+# be tuned from real traffic.
+# ROUTER_CONFIG may point to a JSON file overriding entries, e.g.
+#   {"comparison": {"num_predict": 900}, "spec": {"model": "qwen2.5:3b-instruct-q4_K_M"}}
+
+import json
+import os
+import re
+import threading
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional
+
+import numpy as np
+
+DEFAULT_MODEL = "mistral:7b-instruct-q4_0"
+
+
+class Route(NamedTuple):
+    model: str
+    num_ctx: int        # Ollama context window
+    num_predict: int    # output token cap
+    token_budget: int   # context tokens packed into the prompt (see rag/context.py)
+
+    def options(self) -> Dict:
+        return {"temperature": 0.0, "num_ctx": self.num_ctx, "num_predict": self.num_predict}
+
+
+ROUTES = {
+    "spec": Route(DEFAULT_MODEL, num_ctx=4096, num_predict=200, token_budget=1800),
+    "date": Route(DEFAULT_MODEL, num_ctx=4096, num_predict=150, token_budget=1800),
+    "descriptive": Route(DEFAULT_MODEL, num_ctx=8192, num_predict=500, token_budget=3000),
+    "comparison": Route(DEFAULT_MODEL, num_ctx=8192, num_predict=700, token_budget=4500),
+}
+
+SPEC_KEYWORDS = [
+    "torque", "hp", "horsepower", "power", "nm", "lb-ft", "bhp", "kw",
+    "acceleration", "top speed", "0-60", "0-100", "0 to ", "weight", "displacement"
+]
+DATE_KEYWORDS = ["when", "what year", "which year", "introduced", "launched", "released", "debut", "first produced"]
+COMPARISON_PATTERN = re.compile(r"\b(?:vs|versus|compare|compared|comparison|difference|differences|between)\b")
+GENERATION_PATTERN = re.compile(r"\b(?:901|930|964|993|996|997|991|992)\b")
+YEAR_PATTERN = re.compile(r"\b(?:19|20)\d{2}\b")
+
+
+def load_routes(path: Optional[str] = None) -> Dict[str, Route]:
+    """ROUTES with the overrides from a JSON file applied."""
+    routes = dict(ROUTES)
+    if path and os.path.exists(path):
+        with open(path) as f:
+            for name, overrides in json.load(f).items():
+                if name in routes:
+                    routes[name] = routes[name]._replace(**overrides)
+    return routes
+
+
+def is_spec_question(question: str) -> bool:
+    return any(k in question.lower() for k in SPEC_KEYWORDS)
+
+
+def classify(question: str, retrieved: List[Dict]) -> str:
+    """
+    Question class from the wording, refined by what retrieval found:
+    - comparison: comparison words, or two+ generations named in the question, or a spec question
+      without a variant whose top chunks cover several variants (the answer has to list them all)
+    - spec / date: keyword heuristics; a date question also needs a year in the retrieved chunks
+    - descriptive: everything else
+    """
+    q = question.lower()
+    if COMPARISON_PATTERN.search(q) or len(set(GENERATION_PATTERN.findall(q))) >= 2:
+        return "comparison"
+
+    top = retrieved[:5]
+    retrieved_variants = {r["metadata"].get("variant") for r in top} - {None}
+    if is_spec_question(q):
+        names_variant = any(v.lower() in q for v in retrieved_variants)
+        if not names_variant and len(retrieved_variants) >= 2:
+            return "comparison"
+        return "spec"
+
+    if any(k in q for k in DATE_KEYWORDS) and any(YEAR_PATTERN.search(r["content"]) for r in top):
+        return "date"
+    return "descriptive"
+
+
+class RouteStats:
+    """Per-class request counts and latency percentiles over a sliding window."""
+
+    def __init__(self, window: int = 500):
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self.window = window
+
+    def record(self, question_class: str, seconds: float) -> None:
+        with self._lock:
+            self._latencies.setdefault(question_class, deque(maxlen=self.window)).append(seconds)
+            self._counts[question_class] = self._counts.get(question_class, 0) + 1
+
+    def summary(self) -> Dict:
+        with self._lock:
+            snapshot = {name: (self._counts[name], list(values)) for name, values in self._latencies.items()}
+        return {
+            name: {
+                "requests": count,
+                "p50_s": round(float(np.percentile(values, 50)), 3),
+                "p95_s": round(float(np.percentile(values, 95)), 3),
+                "mean_s": round(float(np.mean(values)), 3),
+            }
+            for name, (count, values) in snapshot.items()
+        }
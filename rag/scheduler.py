@@ -0,0 +1,201 @@
+# rag/scheduler.py
+# Admission control in front of LLM generation.
+# - A fixed number of generation slots (matching the LLM client's concurrency) and a bounded queue.
+# - Priority classes: interactive requests are always served before evaluation / batch ones, and
+#   may push a queued batch request out when the queue is full.
+# - Every request carries a deadline for starting its generation; it is shed up front when it has
+#   passed or the expected queue wait already exceeds it, and dropped from the queue once it passes.
+# Waiters hold concurrent.futures.Future objects, so callers on any event loop / thread can share
+# one scheduler (Streamlit runs asyncio.run per request).
+
+import asyncio
+import concurrent.futures
+import contextlib
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+DEFAULT_MAX_QUEUE = int(os.environ.get("QA_MAX_QUEUE", "16"))
+MIN_SERVICE_SAMPLES = 5  # no early shedding until the service time estimate is based on this many requests
+
+
+class Overloaded(Exception):
+    """The request was shed (queue full or deadline cannot be met)."""
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class Deadline:
+    """Absolute deadline on the monotonic clock (None = no deadline)."""
+
+    def __init__(self, seconds: Optional[float]):
+        self.at = time.monotonic() + seconds if seconds is not None else None
+
+    def remaining(self) -> Optional[float]:
+        return None if self.at is None else self.at - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "future", "enqueued")
+
+    def __init__(self, priority: int, deadline: Deadline):
+        self.priority = priority
+        self.deadline = deadline
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.enqueued = time.monotonic()
+
+
+class GenerationScheduler:
+    def __init__(self, slots: int, max_queue: int = DEFAULT_MAX_QUEUE, service_decay: float = 0.9):
+        self.slots = slots
+        self.max_queue = max_queue
+        self.service_decay = service_decay
+
+        self._lock = threading.Lock()
+        self._free = slots
+        self._queue: List = []  # heap of (priority, seq, waiter)
+        self._seq = itertools.count()
+
+        self._service_s = 0.0  # decayed mean slot hold time
+        self._service_samples = 0
+        self._queue_wait_s = 0.0
+        self.admitted = 0
+        self.max_queue_depth = 0
+        self.shed: Dict[str, int] = {"queue_full": 0, "deadline": 0}
+
+    # --------------------------------------------------
+    # Admission
+    # --------------------------------------------------
+    def _expected_wait(self, ahead: int) -> float:
+        return self._service_s * math.ceil((ahead + 1) / self.slots)
+
+    def _shed(self, reason: str) -> Overloaded:
+        self.shed[reason] += 1
+        return Overloaded(reason)
+
+    def _enqueue(self, priority: int, deadline: Deadline) -> Optional[_Waiter]:
+        """Under the lock: take a slot (None) or queue a waiter; raises Overloaded when shed."""
+        if self._free > 0 and not self._queue:
+            self._free -= 1
+            self.admitted += 1
+            return None
+
+        ahead = sum(1 for p, _, _ in self._queue if p <= priority)
+        remaining = deadline.remaining()
+        if (remaining is not None and self._service_samples >= MIN_SERVICE_SAMPLES
+                and remaining < self._expected_wait(ahead)):
+            raise self._shed("deadline")
+
+        if len(self._queue) >= self.max_queue:
+            # An interactive request may displace the most recently queued lower-priority request
+            lower = [entry for entry in self._queue if entry[0] > priority]
+            if not lower:
+                raise self._shed("queue_full")
+            victim = max(lower, key=lambda entry: (entry[0], entry[1]))
+            self._queue.remove(victim)
+            heapq.heapify(self._queue)
+            error = self._shed("queue_full")
+            if victim[2].future.set_running_or_notify_cancel():
+                victim[2].future.set_exception(error)
+
+        waiter = _Waiter(priority, deadline)
+        heapq.heappush(self._queue, (priority, next(self._seq), waiter))
+        self.max_queue_depth = max(self.max_queue_depth, len(self._queue))
+        return waiter
+
+    def check(self, deadline: Deadline) -> None:
+        """Shed (raise Overloaded) a request whose deadline has already passed, before it queues or generates."""
+        if deadline.expired():
+            with self._lock:
+                raise self._shed("deadline")
+
+    async def acquire(self, priority: int = INTERACTIVE, deadline: Optional[Deadline] = None) -> None:
+        """Wait for a generation slot. Raises Overloaded when shed; the caller must release() after use."""
+        deadline = deadline or Deadline(None)
+        self.check(deadline)
+        with self._lock:
+            waiter = self._enqueue(priority, deadline)
+        if waiter is None:
+            return
+
+        try:
+            await asyncio.wait_for(asyncio.wrap_future(waiter.future), deadline.remaining())
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                entries = [entry for entry in self._queue if entry[2] is waiter]
+                granted = waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None
+                if entries:
+                    self._queue.remove(entries[0])
+                    heapq.heapify(self._queue)
+                if isinstance(e, asyncio.TimeoutError):
+                    self.shed["deadline"] += 1
+            if granted:
+                self.release()  # the slot arrived together with the timeout
+            if isinstance(e, asyncio.TimeoutError):
+                raise Overloaded("deadline")
+            raise
+
+        with self._lock:
+            self.admitted += 1
+            self._queue_wait_s += time.monotonic() - waiter.enqueued
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, deadline: Optional[Deadline] = None):
+        """async with scheduler.slot(...): hold a generation slot for the body."""
+        await self.acquire(priority, deadline)
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - start)
+
+    def release(self, service_seconds: Optional[float] = None) -> None:
+        """Return a slot, handing it straight to the best queued request still within its deadline."""
+        with self._lock:
+            if service_seconds is not None:
+                self._service_samples += 1
+                if self._service_samples == 1:
+                    self._service_s = service_seconds
+                else:
+                    self._service_s = self.service_decay * self._service_s + (1 - self.service_decay) * service_seconds
+
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if waiter.deadline.expired():
+                    if waiter.future.set_running_or_notify_cancel():  # else the waiter already gave up
+                        waiter.future.set_exception(self._shed("deadline"))
+                    continue
+                if waiter.future.set_running_or_notify_cancel():
+                    waiter.future.set_result(True)
+                    return
+            self._free += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            by_priority = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._queue:
+                by_priority[PRIORITY_NAMES[priority]] += 1
+            return {
+                "slots": self.slots,
+                "busy": self.slots - self._free,
+                "queue_depth": len(self._queue),
+                "queued_by_priority": by_priority,
+                "max_queue_depth": self.max_queue_depth,
+                "admitted": self.admitted,
+                "shed": dict(self.shed),
+                "avg_queue_wait_s": round(self._queue_wait_s / self.admitted, 4) if self.admitted else 0.0,
+                "service_time_s": round(self._service_s, 3),
+            }
@@ -0,0 +1,370 @@
+# rag/segments.py
+# Segmented vector store: each ingest run writes its new chunks as one immutable segment instead of
+# rewriting the whole index and chunk store, so an incremental run costs I/O proportional to what changed.
+# Layout of the vector store directory:
+# - segments/<name>/chunks/        chunk store of the segment (rag/chunk_store.py)
+# - segments/<name>/index.faiss    index over the segment's vectors, keyed by stable chunk ids
+# - segments/<name>/vectors.npy    float32 vectors, row-aligned with the segment's chunk store
+# - segments/<name>/bm25/          BM25 postings of the segment's chunks (rag/lexical.py)
+# - tombstones-<generation>.npy    sorted chunk ids of changed / deleted files still inside segments
+# - manifest-<generation>.json     ingest manifest (rag/manifest.py) matching the segments and tombstones
+# - specs-<generation>.sqlite      spec store (rag/spec_store.py) of the live chunks, never modified once published
+# - segments.json                  live segments in chunk id order, tombstone, manifest and spec store files,
+#                                  store version
+# segments.json is replaced last, so a reader sees the old or the new set of segments, never a mix:
+# it is the atomic pointer to the current version, and segment directories are never modified once written.
+# Retrievers poll store_version() and reload in the background when it changes (rag/retriever.py).
+# merge_segments() rewrites a run of adjacent segments as one without their tombstoned chunks;
+# plan_merge() picks that run so the segment count stays bounded.
+# Stores written before segments (index.faiss + chunks/ or data.pkl at the top level) open as one segment.
+
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Union
+
+import faiss
+import numpy as np
+
+from rag.chunk_store import ChunkStore, MultiChunkStore, chunk_store_exists, write_chunk_store
+from rag.index_factory import MultiIndex, build_index, configure_search, index_mode, is_id_mapped
+from rag.lexical import BM25Index, MultiBM25Index, bm25_index_exists, write_bm25_index
+from rag.manifest import Manifest
+
+logger = logging.getLogger(__name__)
+
+SEGMENTS_FILE = "segments.json"
+SEGMENTS_DIR = "segments"
+INDEX_FILE = "index.faiss"
+VECTORS_FILE = "vectors.npy"
+CHUNKS_DIR = "chunks"
+BM25_DIR = "bm25"
+INDEX_META_FILE = "index_meta.json"  # pre-segment stores only
+DATA_FILE = "data.pkl"  # pre-chunk-store stores only
+LEGACY_SPECS_FILE = "specs.sqlite"  # spec store updated in place, before it was published per generation
+
+# Merge policy: keep at most MAX_SEGMENTS segments, and rewrite a segment once this share of it is tombstoned
+MAX_SEGMENTS = int(os.environ.get("MAX_SEGMENTS", "8"))
+COMPACT_TOMBSTONE_RATIO = float(os.environ.get("COMPACT_TOMBSTONE_RATIO", "0.2"))
+
+
+def segment_path(root: str, name: str) -> str:
+    return os.path.join(root, SEGMENTS_DIR, name)
+
+
+class SegmentSet:
+    """Contents of segments.json: the live segments (oldest chunk ids first) and the tombstoned chunk ids."""
+
+    def __init__(self, dimension: int, segments: Optional[List[Dict]] = None,
+                 tombstones: Optional[np.ndarray] = None, generation: int = 0, version: Optional[str] = None):
+        self.dimension = dimension
+        self.segments = segments or []  # {"name", "count", "first_id", "last_id", "index": build info}
+        self.tombstones = np.empty(0, dtype=np.int64) if tombstones is None else tombstones
+        self.generation = generation
+        self.version = version
+        self._tombstones_file = None
+        self.manifest_file: Optional[str] = None  # published with the generation that last passed a manifest
+        self.spec_store_file: Optional[str] = None  # likewise for the spec store
+
+    @classmethod
+    def load(cls, root: str) -> Optional["SegmentSet"]:
+        path = os.path.join(root, SEGMENTS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            data = json.load(f)
+        tombstones = None
+        if data["tombstones"]:
+            tombstones = np.load(os.path.join(root, data["tombstones"]))
+        segset = cls(data["dimension"], data["segments"], tombstones, data["generation"], data["version"])
+        segset._tombstones_file = data["tombstones"]
+        segset.manifest_file = data.get("manifest")
+        segset.spec_store_file = data.get("specs")
+        return segset
+
+    def load_manifest(self, root: str) -> Optional[Manifest]:
+        return Manifest.load(os.path.join(root, self.manifest_file)) if self.manifest_file else None
+
+    def spec_store_path(self, root: str) -> Optional[str]:
+        return os.path.join(root, self.spec_store_file) if self.spec_store_file else None
+
+    @property
+    def count(self) -> int:
+        return sum(entry["count"] for entry in self.segments)
+
+    def next_name(self) -> str:
+        """Name for a segment published by the next save()."""
+        return f"seg-{self.generation + 1:06d}"
+
+    def tombstoned(self, entry: Dict) -> int:
+        """Tombstoned chunks inside a segment."""
+        start = np.searchsorted(self.tombstones, entry["first_id"], side="left")
+        end = np.searchsorted(self.tombstones, entry["last_id"], side="right")
+        return int(end - start)
+
+    def add_tombstones(self, chunk_ids: np.ndarray) -> None:
+        self.tombstones = np.union1d(self.tombstones, np.asarray(chunk_ids, dtype=np.int64))
+
+    def save(self, root: str, manifest: Optional[Manifest] = None, spec_store: Optional[str] = None) -> None:
+        """
+        Publish the next generation: the tombstone file, the manifest and the spec store (a finished SQLite
+        file, moved into place) first, segments.json last, so segments and the manifest and specs describing
+        them change together. Without a manifest / spec store the previous one stays referenced.
+        Afterwards, files referenced neither by this nor by the previous generation are deleted, so readers
+        that opened the previous generation can still load it.
+        """
+        previous = SegmentSet.load(root)
+        self.generation += 1
+        # Identifies this store; caches keyed on it (answers) invalidate when it changes
+        self.version = f"{time.strftime('%Y%m%dT%H%M%S')}-{self.generation}-{self.count}"
+
+        self._tombstones_file = None
+        if len(self.tombstones):
+            self._tombstones_file = f"tombstones-{self.generation:06d}.npy"
+            _replace(os.path.join(root, self._tombstones_file), lambda f: np.save(f, self.tombstones))
+        if manifest is not None:
+            self.manifest_file = f"manifest-{self.generation:06d}.json"
+            manifest.save(os.path.join(root, self.manifest_file))
+        if spec_store is not None:
+            self.spec_store_file = f"specs-{self.generation:06d}.sqlite"
+            os.replace(spec_store, os.path.join(root, self.spec_store_file))
+        _replace(os.path.join(root, SEGMENTS_FILE), lambda f: f.write(json.dumps({
+            "generation": self.generation,
+            "version": self.version,
+            "dimension": self.dimension,
+            "tombstones": self._tombstones_file,
+            "manifest": self.manifest_file,
+            "specs": self.spec_store_file,
+            "segments": self.segments,
+        }, indent=2).encode("utf-8")))
+
+        referenced = {entry["name"] for segset in (self, previous) if segset for entry in segset.segments}
+        for segset in (self, previous):
+            if segset:
+                referenced |= {segset._tombstones_file, segset.manifest_file, segset.spec_store_file} - {None}
+        segments_dir = os.path.join(root, SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        for name in os.listdir(segments_dir):
+            if name not in referenced:
+                shutil.rmtree(os.path.join(segments_dir, name), ignore_errors=True)
+        for name in os.listdir(root):
+            if name.startswith(("tombstones-", "manifest-", "specs-")) and name not in referenced:
+                os.remove(os.path.join(root, name))
+
+
+def store_version(root: str) -> Optional[str]:
+    """Version of the published store, read from segments.json only (cheap enough to poll); None without one."""
+    try:
+        with open(os.path.join(root, SEGMENTS_FILE)) as f:
+            return json.load(f)["version"]
+    except FileNotFoundError:
+        return None
+
+
+def _replace(path: str, writer) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        writer(f)
+    os.replace(tmp, path)
+
+
+def write_segment(root: str, name: str, chunks: List[str], metadata: List[Dict],
+                  vectors: np.ndarray, chunk_ids: np.ndarray, mode: str = "auto") -> Dict:
+    """Write one segment (chunks must be non-empty, chunk_ids ascending) and return its segments.json entry."""
+    path = segment_path(root, name)
+    if os.path.exists(path):
+        shutil.rmtree(path)  # left behind by a run that failed before publishing it
+    os.makedirs(path)
+
+    index, index_info = build_index(vectors, mode=mode, ids=chunk_ids)
+    faiss.write_index(index, os.path.join(path, INDEX_FILE))
+    np.save(os.path.join(path, VECTORS_FILE), np.ascontiguousarray(vectors, dtype=np.float32))
+    write_chunk_store(os.path.join(path, CHUNKS_DIR), chunks, metadata, chunk_ids)
+    write_bm25_index(os.path.join(path, BM25_DIR), chunks)
+    return {
+        "name": name,
+        "count": len(chunks),
+        "first_id": int(chunk_ids[0]),
+        "last_id": int(chunk_ids[-1]),
+        "index": index_info,
+    }
+
+
+class ConcatRows:
+    """Row-wise concatenation of (memory-mapped) 2-D arrays without copying them; indexed by row arrays."""
+
+    def __init__(self, arrays: List[np.ndarray]):
+        self.arrays = arrays
+        self.starts = np.cumsum([0] + [len(a) for a in arrays])
+        self.shape = (int(self.starts[-1]), arrays[0].shape[1])
+
+    def __len__(self) -> int:
+        return self.shape[0]
+
+    def __getitem__(self, rows) -> np.ndarray:
+        rows = np.asarray(rows, dtype=np.int64)
+        parts = np.searchsorted(self.starts, rows, side="right") - 1
+        out = np.empty((len(rows), self.shape[1]), dtype=self.arrays[0].dtype)
+        for part in np.unique(parts):
+            mask = parts == part
+            out[mask] = self.arrays[part][rows[mask] - self.starts[part]]
+        return out
+
+
+class Segment(NamedTuple):
+    entry: Dict
+    store: ChunkStore
+    index: faiss.Index
+    vectors: Optional[np.ndarray]
+    lexical: Optional[BM25Index]
+
+
+def open_segment(root: str, entry: Dict, mmap: bool = True) -> Segment:
+    path = segment_path(root, entry["name"])
+    index = faiss.read_index(os.path.join(path, INDEX_FILE), faiss.IO_FLAG_MMAP if mmap else 0)
+    configure_search(index, nprobe=entry["index"].get("nprobe"), ef_search=entry["index"].get("ef_search"))
+    store = ChunkStore.open(os.path.join(path, CHUNKS_DIR), mmap=mmap)
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r" if mmap else None)
+    lexical = BM25Index(os.path.join(path, BM25_DIR), mmap=mmap)
+    # A segment is searched row-aligned across its files; refuse one that was not written completely
+    sizes = {"index": index.ntotal, "chunks": len(store), "vectors": len(vectors), "bm25": len(lexical)}
+    if set(sizes.values()) != {entry["count"]}:
+        raise ValueError(f"Segment {entry['name']} is inconsistent: {sizes}, expected {entry['count']} rows")
+    return Segment(entry, store, index, vectors, lexical)
+
+
+class VectorStore(NamedTuple):
+    """Everything the Retriever searches, with rows numbered across the segments in order."""
+    store: ChunkStore
+    index: MultiIndex
+    vectors: Optional[Union[np.ndarray, ConcatRows]]  # row-aligned with store, or None
+    lexical: Optional[Union[BM25Index, MultiBM25Index]]  # row-aligned with store, or None
+    modes: List[str]  # index mode of each segment
+    id_mapped: bool  # index results are stable chunk ids rather than rows
+    version: str
+    num_segments: int
+    spec_store: Optional[str]  # path of the spec store published with this version, or None
+
+
+def open_vector_store(root: str, mmap: bool = True) -> VectorStore:
+    segset = SegmentSet.load(root)
+    if segset is None:
+        return _open_unsegmented(root, mmap)
+
+    segments = [open_segment(root, entry, mmap) for entry in segset.segments]
+    vectors = [segment.vectors for segment in segments]
+    return VectorStore(
+        store=MultiChunkStore([segment.store for segment in segments], segset.tombstones),
+        index=MultiIndex([segment.index for segment in segments], segset.dimension),
+        vectors=(vectors[0] if len(vectors) == 1 else ConcatRows(vectors)) if vectors else None,
+        lexical=MultiBM25Index([segment.lexical for segment in segments]),
+        modes=[entry["index"]["mode"] for entry in segset.segments],
+        id_mapped=True,
+        version=segset.version,
+        num_segments=len(segments),
+        spec_store=segset.spec_store_path(root) or _legacy_spec_store(root),
+    )
+
+
+def _legacy_spec_store(root: str) -> Optional[str]:
+    path = os.path.join(root, LEGACY_SPECS_FILE)
+    return path if os.path.exists(path) else None
+
+
+def _open_unsegmented(root: str, mmap: bool) -> VectorStore:
+    """A store written before segments: one top-level index, chunk store (or data.pkl) and vectors.npy."""
+    index_path = os.path.join(root, INDEX_FILE)
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(f"No {SEGMENTS_FILE} or {INDEX_FILE} in {root}, run ingest.py")
+    index = faiss.read_index(index_path, faiss.IO_FLAG_MMAP if mmap else 0)
+
+    # Build info written by ingest.py; older stores only have a flat index
+    info = {"mode": index_mode(index)}
+    if os.path.exists(os.path.join(root, INDEX_META_FILE)):
+        with open(os.path.join(root, INDEX_META_FILE)) as f:
+            info.update(json.load(f))
+    configure_search(index, nprobe=info.get("nprobe"), ef_search=info.get("ef_search"))
+    # Stores ingested before versioning fall back to the index file's mtime and size
+    version = str(info.get("version", f"{int(os.path.getmtime(index_path))}-{index.ntotal}"))
+
+    if chunk_store_exists(os.path.join(root, CHUNKS_DIR)):
+        store = ChunkStore.open(os.path.join(root, CHUNKS_DIR), mmap=mmap)
+    elif os.path.exists(os.path.join(root, DATA_FILE)):
+        with open(os.path.join(root, DATA_FILE), "rb") as f:
+            store = ChunkStore.from_lists(*pickle.load(f))
+    else:
+        raise FileNotFoundError(f"Chunk store not found at {os.path.join(root, CHUNKS_DIR)}")
+
+    vectors = None
+    if os.path.exists(os.path.join(root, VECTORS_FILE)):
+        vectors = np.load(os.path.join(root, VECTORS_FILE), mmap_mode="r" if mmap else None)
+        if len(vectors) != len(store):
+            vectors = None
+    lexical = None
+    if bm25_index_exists(os.path.join(root, BM25_DIR)):
+        lexical = BM25Index(os.path.join(root, BM25_DIR), mmap=mmap)
+        if len(lexical) != len(store):
+            lexical = None
+
+    return VectorStore(store, MultiIndex([index], index.d), vectors, lexical, [info["mode"]],
+                       is_id_mapped(index), version, num_segments=1, spec_store=_legacy_spec_store(root))
+
+
+def plan_merge(segset: SegmentSet, max_segments: int = MAX_SEGMENTS,
+               tombstone_ratio: float = COMPACT_TOMBSTONE_RATIO) -> Optional[List[str]]:
+    """
+    Names of the next run of adjacent segments worth merging, or None:
+    - past max_segments, the adjacent run with the fewest chunks whose merge brings the count back to it;
+    - otherwise a segment whose tombstoned share reached tombstone_ratio, rewritten on its own.
+    Only adjacent segments are merged, so chunk ids keep ascending across segments.
+    """
+    segments = segset.segments
+    excess = len(segments) - max(max_segments, 1)
+    if excess > 0:
+        width = excess + 1
+        sizes = [sum(entry["count"] for entry in segments[i:i + width]) for i in range(len(segments) - width + 1)]
+        start = int(np.argmin(sizes))
+        return [entry["name"] for entry in segments[start:start + width]]
+    for entry in segments:
+        tombstoned = segset.tombstoned(entry)
+        if tombstoned and tombstoned >= tombstone_ratio * entry["count"]:
+            return [entry["name"]]
+    return None
+
+
+def merge_segments(root: str, segset: SegmentSet, names: Sequence[str], mode: str = "auto") -> None:
+    """
+    Rewrite the adjacent segments `names` as one segment without their tombstoned chunks (the index is
+    rebuilt, so IVF / PQ retrain on the merged data) and publish the result.
+    """
+    positions = [i for i, entry in enumerate(segset.segments) if entry["name"] in names]
+    if not positions or positions != list(range(positions[0], positions[-1] + 1)):
+        raise ValueError(f"Can only merge adjacent segments, got {list(names)}")
+    entries = segset.segments[positions[0]:positions[-1] + 1]
+
+    chunks, metadata, vectors, chunk_ids = [], [], [], []
+    for entry in entries:
+        segment = open_segment(root, entry)
+        ids = np.asarray(segment.store.columns["chunk_id"])
+        rows = np.flatnonzero(~np.isin(ids, segset.tombstones))
+        chunks.extend(segment.store.texts(rows))
+        metadata.extend(segment.store.metadata(row) for row in rows)
+        vectors.append(np.asarray(segment.vectors[rows], dtype=np.float32))
+        chunk_ids.append(ids[rows])
+    chunk_ids = np.concatenate(chunk_ids)
+
+    merged = []
+    if len(chunk_ids):
+        merged = [write_segment(root, segset.next_name(), chunks, metadata, np.concatenate(vectors), chunk_ids, mode)]
+    dropped = sum(entry["count"] for entry in entries) - len(chunk_ids)
+    logger.info(f"Merged {len(entries)} segments ({dropped} tombstoned chunks dropped) into "
+                f"{merged[0]['name'] if merged else 'nothing'} with {len(chunk_ids)} chunks.")
+
+    # The merged range no longer holds any tombstoned id
+    first, last = entries[0]["first_id"], entries[-1]["last_id"]
+    segset.tombstones = segset.tombstones[(segset.tombstones < first) | (segset.tombstones > last)]
+    segset.segments[positions[0]:positions[-1] + 1] = merged
+    segset.save(root)
@@ -0,0 +1,59 @@
+# rag/single_flight.py
+# Single-flight coalescing: concurrent calls with the same key share one in-flight computation.
+# Futures are concurrent.futures ones so callers on different event loops / threads can share them.
+
+import asyncio
+import concurrent.futures
+import threading
+from typing import Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight: Dict[Hashable, concurrent.futures.Future] = {}
+        self._lock = threading.Lock()
+        self.stats = {"leaders": 0, "followers": 0, "recomputed": 0}
+
+    async def run(self, key: Hashable, compute: Callable[[], Awaitable[Dict]],
+                  reuse: Callable[[Dict], bool] = lambda result: True) -> Dict:
+        """
+        Run compute() once per key at a time; callers arriving meanwhile await the same result
+        (each gets its own copy). A cancelled leader does not cancel its followers: they retry.
+        A follower for which reuse(result) is False runs its own compute() instead of taking the result.
+        """
+        while True:
+            with self._lock:
+                shared = self._inflight.get(key)
+                leader = shared is None
+                if leader:
+                    shared = self._inflight[key] = concurrent.futures.Future()
+                self.stats["leaders" if leader else "followers"] += 1
+
+            if leader:
+                try:
+                    result = await compute()
+                except BaseException as e:
+                    if isinstance(e, asyncio.CancelledError):
+                        shared.cancel()  # followers recompute instead of inheriting our cancellation
+                    else:
+                        shared.set_exception(e)
+                    raise
+                else:
+                    shared.set_result(result)
+                finally:
+                    with self._lock:
+                        self._inflight.pop(key, None)
+                return dict(result)
+
+            try:
+                # shield: a cancelled follower must not cancel the shared future for everyone else
+                result = await asyncio.shield(asyncio.wrap_future(shared))
+            except asyncio.CancelledError:
+                if not shared.cancelled():
+                    raise  # this caller itself was cancelled
+                continue  # the leader was cancelled; retry, possibly as the new leader
+            if reuse(result):
+                return dict(result)
+            with self._lock:
+                self.stats["recomputed"] += 1
+            return dict(await compute())
@@ -0,0 +1,296 @@
+# rag/spec_store.py
+# Structured spec store: (variant, metric, value, unit, source, page) tuples extracted by ingest.py
+# from Table and NarrativeText chunks into an indexed SQLite table. Each ingest run writes a new file,
+# published with the store version it belongs to (rag/segments.py); a published file is never modified.
+# qa.ask_async answers plain spec lookups ("Turbo S torque?") straight from it, without the LLM,
+# when exactly one variant and one metric are asked for and the stored values agree.
+
+import os
+import re
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+SPEC_ELEMENT_TYPES = ("Table", "NarrativeText")
+
+SCHEMA = """
+CREATE TABLE specs (
+    variant TEXT,
+    metric TEXT NOT NULL,
+    value REAL NOT NULL,
+    unit TEXT NOT NULL,
+    source TEXT,
+    page INTEGER,
+    element_type TEXT,
+    element_index INTEGER,
+    chunk_id INTEGER NOT NULL,
+    sentence TEXT
+);
+CREATE INDEX idx_specs_variant_metric ON specs (variant, metric);
+CREATE INDEX idx_specs_chunk_id ON specs (chunk_id);
+"""
+
+# metric -> value pattern over lowercased text; group 1 = number, group 2 = unit
+METRIC_PATTERNS = {
+    "power": re.compile(r"(\d{2,4}(?:[.,]\d+)?)\s*(hp|bhp|ps|kw)\b"),
+    "torque": re.compile(r"(\d{2,4})\s*(nm|lb[- ]?ft)\b"),
+    "acceleration_0_100": re.compile(r"0\s*[-–]\s*100\s*km/h\D{0,25}?(\d{1,2}(?:[.,]\d)?)\s*(s|sec|seconds)\b"),
+    "acceleration_0_60": re.compile(r"0\s*[-–]\s*60\s*mph\D{0,25}?(\d{1,2}(?:[.,]\d)?)\s*(s|sec|seconds)\b"),
+    "top_speed": re.compile(r"top speed\D{0,25}?(\d{3})\s*(km/h|mph)\b"),
+    "displacement": re.compile(r"(\d\.\d)\s*-?\s*(l|litre|liter)\b"),
+}
+
+METRIC_LABELS = {
+    "power": "power",
+    "torque": "torque",
+    "acceleration_0_100": "0-100 km/h",
+    "acceleration_0_60": "0-60 mph",
+    "top_speed": "top speed",
+    "displacement": "displacement",
+}
+
+# question keywords -> metric
+QUESTION_METRICS = {
+    "power": ("horsepower", "hp", "bhp", "power", "output", "ps", "kw"),
+    "torque": ("torque", "nm", "lb-ft"),
+    "acceleration_0_100": ("0-100", "0 to 100"),
+    "acceleration_0_60": ("0-60", "0 to 60"),
+    "top_speed": ("top speed", "maximum speed", "max speed", "vmax"),
+    "displacement": ("displacement", "engine size"),
+}
+
+UNIT_LABELS = {
+    "hp": "hp", "bhp": "bhp", "ps": "PS", "kw": "kW", "nm": "Nm", "lb-ft": "lb-ft",
+    "s": "s", "km/h": "km/h", "mph": "mph", "l": "L",
+}
+
+# Questions scoped to a generation or year cannot be answered from variant-level tuples
+SCOPED_QUESTION = re.compile(r"\b(?:964|993|996|997|991|992|(?:19|20)\d{2})\b")
+COMPARISON_WORDS = re.compile(r"\b(?:vs|versus|compare|compared|comparison|difference|between)\b")
+
+# Lines are table rows (or paragraphs) and never share a variant; sentences within one may ("Its ...")
+LINE_SPLIT = re.compile(r"\n+")
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+")
+ANAPHORA = re.compile(r"(?:it|its|it's|the car|this car|this model)\b")
+
+# Units of one quantity, as factors to a common unit: values in different units must agree to be confident
+UNIT_FACTORS = {
+    "kw": 1.0, "ps": 0.7355, "hp": 0.7457, "bhp": 0.7457,
+    "nm": 1.0, "lb-ft": 1.3558,
+    "km/h": 1.0, "mph": 1.6093,
+}
+UNIT_TOLERANCE = 0.02  # rounding in spec sheets (650 PS = 478 kW = 641 hp)
+
+# Exact variant names. Unlike the retriever's boost-only VARIANT_KEYWORDS, suffixes are never folded into
+# the base model: a GT3 RS figure is not a GT3 answer, nor a Carrera T figure a Carrera 4S one.
+SPEC_VARIANTS = {
+    "carrera": "Carrera", "carrera s": "Carrera S", "carrera t": "Carrera T", "carrera 4": "Carrera 4",
+    "carrera 4s": "Carrera 4S", "carrera gts": "Carrera GTS", "carrera 4 gts": "Carrera 4 GTS",
+    "targa 4": "Targa 4", "targa 4s": "Targa 4S", "targa 4 gts": "Targa 4 GTS",
+    "turbo": "Turbo", "turbo s": "Turbo S",
+    "gt3": "GT3", "gt3 rs": "GT3 RS", "gt3 touring": "GT3 Touring", "gt2 rs": "GT2 RS",
+    "gts": "GTS",
+}
+# Longest names first so "turbo s" wins over "turbo"
+_VARIANT_PATTERN = re.compile(
+    r"(?<![a-z0-9])(" + "|".join(re.escape(name) for name in sorted(SPEC_VARIANTS, key=len, reverse=True))
+    + r")(?![a-z0-9])"
+)
+# A suffix-shaped word after a variant name the grammar does not know ("GT3 R", "Carrera 2", "Turbo GT"):
+# the model is unknown, so its figures belong to no variant. Not "0 - 100 km/h" or "3.2 s".
+UNKNOWN_SUFFIX = re.compile(
+    r"\s+(?:[a-z]|\d[a-z]?|rs|gt|gts|touring|clubsport|sport|e-hybrid)(?=[\s,;:)|]|$)(?!\s*[-–])"
+)
+
+
+def _has_keyword(text: str, keyword: str) -> bool:
+    return re.search(rf"(?<![a-z0-9]){re.escape(keyword)}(?![a-z0-9])", text) is not None
+
+
+def _normalize_unit(unit: str) -> str:
+    unit = unit.replace(" ", "-")
+    if unit.startswith("lb"):
+        return "lb-ft"
+    if unit in ("sec", "seconds"):
+        return "s"
+    if unit in ("litre", "liter"):
+        return "l"
+    return unit
+
+
+def _variant_mentions(text: str) -> List[Tuple[int, Optional[str]]]:
+    """(position, variant) of every variant mention in lowercased text; variant is None for an unknown suffix."""
+    return [
+        (m.start(), None if UNKNOWN_SUFFIX.match(text, m.end()) else SPEC_VARIANTS[m.group(1)])
+        for m in _VARIANT_PATTERN.finditer(text)
+    ]
+
+
+def extract_specs(text: str, default_variant: Optional[str] = None) -> List[Tuple[Optional[str], str, float, str, str]]:
+    """
+    (variant, metric, value, unit, sentence) tuples in a chunk. The variant is the nearest one named before
+    the value in its sentence, or in an earlier sentence of the same line that the sentence refers back to
+    ("Its top speed is ..."). Otherwise it is default_variant, but only in chunks naming no other variant:
+    rows of other models in a mixed table get None rather than the last variant mentioned. Values after
+    a variant with an unknown suffix get None as well.
+    """
+    named = {variant for _, variant in _variant_mentions(text.lower())}
+    fallback = default_variant if named <= {default_variant} else None
+    specs = []
+    for line in LINE_SPLIT.split(text):
+        previous = None
+        for segment in SENTENCE_SPLIT.split(line.strip()):
+            lowered = segment.lower()
+            mentions = _variant_mentions(lowered)
+            current = previous if ANAPHORA.match(lowered) else None
+            for metric, pattern in METRIC_PATTERNS.items():
+                for m in pattern.finditer(lowered):
+                    before = [variant for pos, variant in mentions if pos < m.start()]
+                    variant = before[-1] if before else current or fallback
+                    value = float(m.group(1).replace(",", "."))
+                    specs.append((variant, metric, value, _normalize_unit(m.group(2)), segment.strip()))
+            previous = mentions[-1][1] if mentions else current
+    return specs
+
+
+def _spec_rows(chunks: List[str], metadata: List[Dict], chunk_ids: Sequence[int]) -> List[Tuple]:
+    rows = []
+    for chunk_id, chunk, meta in zip(chunk_ids, chunks, metadata):
+        if meta.get("element_type") not in SPEC_ELEMENT_TYPES:
+            continue
+        for variant, metric, value, unit, sentence in extract_specs(chunk, meta.get("variant")):
+            rows.append((
+                variant, metric, value, unit, meta.get("source"), meta.get("page"),
+                meta.get("element_type"), meta.get("element_index"), int(chunk_id), sentence,
+            ))
+    return rows
+
+
+def write_spec_store(path: str, chunks: List[str], metadata: List[Dict], chunk_ids: Optional[Sequence[int]] = None) -> int:
+    """
+    Extract specs from all Table / NarrativeText chunks and (re)write the store. Returns the tuple count.
+    chunk_ids (the stable ids of the chunks) default to the row numbers.
+    """
+    rows = _spec_rows(chunks, metadata, range(len(chunks)) if chunk_ids is None else chunk_ids)
+
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    conn = sqlite3.connect(tmp)
+    try:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO specs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def update_spec_store(path: str, published: Optional[str], chunks: List[str], metadata: List[Dict],
+                      chunk_ids: Sequence[int], deleted_ids: Sequence[int]) -> int:
+    """
+    Write to path a copy of the published store (None: an empty one) without the specs of deleted chunk ids
+    and with those of new chunks. The published file is left untouched for the readers that have it open.
+    Returns the number of tuples added.
+    """
+    if published is None:
+        return write_spec_store(path, chunks, metadata, chunk_ids)
+    rows = _spec_rows(chunks, metadata, chunk_ids)
+
+    if os.path.exists(path):
+        os.remove(path)
+    source = sqlite3.connect(f"file:{published}?mode=ro", uri=True)
+    conn = sqlite3.connect(path)
+    try:
+        source.backup(conn)
+        with conn:
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_specs_chunk_id ON specs (chunk_id)")
+            conn.executemany("DELETE FROM specs WHERE chunk_id = ?", [(int(i),) for i in deleted_ids])
+            conn.executemany("INSERT INTO specs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    finally:
+        source.close()
+        conn.close()
+    return len(rows)
+
+
+def parse_spec_question(question: str) -> Optional[Tuple[str, str]]:
+    """(variant, metric) if the question is a plain lookup of one metric for one variant."""
+    q = question.lower()
+    if SCOPED_QUESTION.search(q) or COMPARISON_WORDS.search(q):
+        return None
+    metrics = [metric for metric, keywords in QUESTION_METRICS.items() if any(_has_keyword(q, k) for k in keywords)]
+    variants = {variant for _, variant in _variant_mentions(q)}
+    if len(metrics) != 1 or len(variants) != 1 or None in variants:
+        return None
+    return variants.pop(), metrics[0]
+
+
+class SpecStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()  # one read-only connection shared by request threads
+
+    def lookup(self, variant: str, metric: str) -> List[Dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT * FROM specs WHERE variant = ? AND metric = ? ORDER BY chunk_id", (variant, metric)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def answer(self, question: str) -> Optional[Dict]:
+        """
+        Response dict (same shape as qa.ask_async) for a confident spec lookup, else None.
+        Confident = one variant, one metric, a single distinct value per unit across all sources, and values
+        in different units of the quantity (PS / kW / hp, Nm / lb-ft) that convert to the same figure.
+        """
+        parsed = parse_spec_question(question)
+        if parsed is None:
+            return None
+        variant, metric = parsed
+        rows = self.lookup(variant, metric)
+        if not rows:
+            return None
+
+        values: Dict[str, set] = {}
+        for row in rows:
+            values.setdefault(row["unit"], set()).add(row["value"])
+        if any(len(v) > 1 for v in values.values()):
+            return None  # sources disagree (other generation / market) -> let the LLM read the context
+        converted = [next(iter(v)) * UNIT_FACTORS[unit] for unit, v in values.items() if unit in UNIT_FACTORS]
+        if converted and max(converted) > min(converted) * (1 + UNIT_TOLERANCE):
+            return None  # e.g. 480 PS next to another model's 830 hp
+
+        parts = [f"{_format_value(next(iter(v)))} {UNIT_LABELS.get(unit, unit)}" for unit, v in values.items()]
+        answer = f"Porsche 911 {variant} — {METRIC_LABELS[metric]}: {parts[0]}"
+        if len(parts) > 1:
+            answer += f" ({', '.join(parts[1:])})"
+
+        citations, seen = [], set()
+        for row in rows:
+            key = (row["source"], row["page"], row["element_index"])
+            if key in seen:
+                continue
+            seen.add(key)
+            citations.append({
+                "source": os.path.basename(row["source"] or "unknown"),
+                "element_type": row["element_type"],
+                "variant": variant,
+                "page": row["page"],
+                "element_index": row["element_index"],
+                "score": 1.0,
+                "boosted_score": None,
+            })
+
+        return {
+            "answer": answer + ".",
+            "citations": citations,
+            "num_sources": len(citations),
+            "answered_by": "spec_store",
+        }
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if value == int(value) else f"{value:g}"
@@ -0,0 +1,145 @@
+# server.py
+# Async HTTP API over rag.qa / rag.retriever for tools other than the Streamlit app.
+#   POST /ask           {"question": ..., "filters": {...}, "priority": "interactive"|"batch", "deadline_s": 30}
+#   POST /ask/stream    same body; NDJSON events (retrieval, token..., done) as ask_stream() yields them
+#   POST /retrieve      {"query": ..., "filters": {...}, "mode": "dense"|"hybrid"|"lexical"}
+#   GET  /stats         scheduler, LLM client, per-class latency, coalescing and encode batcher counters
+#   GET  /health
+# One process, one event loop: retrieval runs on the default executor, where concurrent query
+# encodings are micro-batched (rag/batcher.py); generation goes through the shared LLM client.
+# Usage: python server.py [--host 127.0.0.1] [--port 8080] [--no-warm-up]
+
+import argparse
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from aiohttp import web
+
+from rag.qa import ask_async, ask_stream, pipeline_stats, retriever, warm_up
+from rag.retriever import FILTER_FIELDS, RETRIEVAL_MODES
+from rag.scheduler import BATCH, INTERACTIVE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"interactive": INTERACTIVE, "batch": BATCH}
+RETRIEVAL_THREADS = 32  # enough blocked retrievals to fill an encoder batch under load
+
+
+# --------------------------------------------------
+# Request parsing
+# --------------------------------------------------
+async def _body(request: web.Request) -> dict:
+    try:
+        body = await request.json()
+    except json.JSONDecodeError:
+        raise web.HTTPBadRequest(reason="Body must be JSON")
+    if not isinstance(body, dict):
+        raise web.HTTPBadRequest(reason="Body must be a JSON object")
+    return body
+
+def _text(body: dict, field: str) -> str:
+    value = body.get(field)
+    if not isinstance(value, str) or not value.strip():
+        raise web.HTTPBadRequest(reason=f"'{field}' must be a non-empty string")
+    return value
+
+def _filters(body: dict) -> Optional[dict]:
+    """The request's metadata filters, checked here so malformed ones are a 400 rather than a 500."""
+    filters = body.get("filters")
+    if filters is None:
+        return None
+    valid = isinstance(filters, dict) and all(
+        field in FILTER_FIELDS and (isinstance(wanted, str) or (
+            isinstance(wanted, list) and all(isinstance(value, str) for value in wanted)))
+        for field, wanted in filters.items()
+    )
+    if not valid:
+        raise web.HTTPBadRequest(reason=f"'filters' must map fields of {sorted(FILTER_FIELDS)} to a string or a list of strings")
+    return filters
+
+def _ask_params(body: dict) -> dict:
+    priority = body.get("priority", "interactive")
+    if priority not in PRIORITIES:
+        raise web.HTTPBadRequest(reason=f"'priority' must be one of {sorted(PRIORITIES)}")
+    deadline_s = body.get("deadline_s")
+    if deadline_s is not None and (not isinstance(deadline_s, (int, float)) or deadline_s <= 0):
+        raise web.HTTPBadRequest(reason="'deadline_s' must be a positive number")
+    return {
+        "question": _text(body, "question"),
+        "filters": _filters(body),
+        "priority": PRIORITIES[priority],
+        "deadline_s": deadline_s,
+    }
+
+# --------------------------------------------------
+# Handlers
+# --------------------------------------------------
+async def handle_ask(request: web.Request) -> web.Response:
+    params = _ask_params(await _body(request))
+    return web.json_response(await ask_async(**params))
+
+async def handle_ask_stream(request: web.Request) -> web.StreamResponse:
+    params = _ask_params(await _body(request))
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    events = ask_stream(**params)
+    try:
+        async for event in events:
+            await response.write((json.dumps(event) + "\n").encode("utf-8"))
+        await response.write_eof()
+    except ConnectionResetError:
+        logger.info("Client disconnected from /ask/stream")
+    finally:
+        # aiohttp does not cancel handlers on disconnect by default; the write raises instead. Close the
+        # generator here so it stops the generation and frees its scheduler slot now, not at garbage collection.
+        await events.aclose()
+    return response
+
+async def handle_retrieve(request: web.Request) -> web.Response:
+    body = await _body(request)
+    query = _text(body, "query")
+    filters = _filters(body)
+    mode = body.get("mode")
+    if mode is not None and mode not in RETRIEVAL_MODES:
+        raise web.HTTPBadRequest(reason=f"'mode' must be one of {RETRIEVAL_MODES}")
+    loop = asyncio.get_running_loop()
+    chunks = await loop.run_in_executor(None, lambda: retriever.retrieve(query, filters=filters, mode=mode))
+    return web.json_response({"chunks": chunks, "citations": retriever.get_citations(chunks)})
+
+async def handle_stats(request: web.Request) -> web.Response:
+    return web.json_response({**pipeline_stats(), "overfetch": retriever.overfetch.summary()})
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.json_response({"status": "ok", "index_version": retriever.index_version})
+
+# --------------------------------------------------
+# App
+# --------------------------------------------------
+async def _on_startup(app: web.Application) -> None:
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(RETRIEVAL_THREADS, thread_name_prefix="retrieve"))
+    if app["warm_up"]:
+        await asyncio.get_running_loop().run_in_executor(None, warm_up)
+
+def create_app(warm: bool = True) -> web.Application:
+    app = web.Application()
+    app["warm_up"] = warm
+    app.on_startup.append(_on_startup)
+    app.router.add_post("/ask", handle_ask)
+    app.router.add_post("/ask/stream", handle_ask_stream)
+    app.router.add_post("/retrieve", handle_retrieve)
+    app.router.add_get("/stats", handle_stats)
+    app.router.add_get("/health", handle_health)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Der Kurator HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--no-warm-up", action="store_true", help="skip loading the LLM at startup")
+    args = parser.parse_args()
+
+    web.run_app(create_app(warm=not args.no_warm_up), host=args.host, port=args.port)
@@ -2,20 +2,19 @@
 # Production-aligned retrieval tests (realistic, stable, RAG-correct)
 
 import os
-import faiss
 import numpy as np
 import pytest
-import pickle
 import time
 from collections import Counter
 from sentence_transformers import SentenceTransformer
 from sklearn.metrics.pairwise import cosine_similarity
+from rag.chunk_store import ChunkStore
+from rag.index_factory import INDEX_MODES
 from rag.retriever import Retriever
+from rag.segments import open_vector_store
 
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 VECTOR_STORE_PATH = os.path.join(PROJECT_ROOT, "embeddings", "vector_store")
-INDEX_FILE = os.path.join(VECTOR_STORE_PATH, "index.faiss")
-DATA_FILE = os.path.join(VECTOR_STORE_PATH, "data.pkl")
 EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
 
 
@@ -23,17 +22,19 @@ EMBEDDING_MODEL_NAME = "all-mpnet-base-v2"
 # Fixtures
 # ---------------------------------------------------------
 @pytest.fixture(scope="session")
-def vector_index():
-    index = faiss.read_index(INDEX_FILE)
-    assert index.ntotal > 0
-    return index
+def vector_store():
+    return open_vector_store(VECTOR_STORE_PATH)
 
 
 @pytest.fixture(scope="session")
-def vector_data():
-    with open(DATA_FILE, "rb") as f:
-        chunks, metadata = pickle.load(f)
-    return chunks, metadata
+def vector_index(vector_store):
+    assert vector_store.index.ntotal > 0
+    return vector_store.index
+
+
+@pytest.fixture(scope="session")
+def chunk_store(vector_store):
+    return vector_store.store
 
 
 @pytest.fixture(scope="session")
@@ -61,21 +62,163 @@ def is_structural_chunk(text: str) -> bool:
 # ---------------------------------------------------------
 # Structural integrity
 # ---------------------------------------------------------
-def test_index_and_data_consistency(vector_index, vector_data):
-    chunks, _ = vector_data
-    assert vector_index.ntotal == len(chunks)
+def test_index_and_data_consistency(vector_index, chunk_store):
+    # Segments are immutable: tombstoned chunks stay in their segment's index until it is merged
+    assert vector_index.ntotal == len(chunk_store)
 
 
-def test_metadata_minimum_fields(vector_data):
-    _, metadata = vector_data
+def test_metadata_minimum_fields(chunk_store):
     required = {"source", "chunk_char_count"}
-    for meta in metadata:
-        assert required.issubset(meta.keys())
+    for row in range(len(chunk_store)):
+        assert required.issubset(chunk_store.metadata(row).keys())
 
 
-def test_no_empty_chunks(vector_data):
-    chunks, _ = vector_data
-    assert all(len(c.strip()) > 0 for c in chunks)
+def test_no_empty_chunks(chunk_store):
+    assert all(len(c.strip()) > 0 for c in chunk_store.texts())
+
+
+def test_chunk_store_roundtrip(tmp_path):
+    from rag.chunk_store import write_chunk_store
+
+    chunks = ["911 Turbo S: 650 PS", "Carrera S engine"]
+    metadata = [
+        {"source": "a.pdf", "element_type": "Table", "element_index": 0,
+         "chunk_char_count": 19, "variant": "Turbo S", "page": 3},
+        {"source": "b.docx", "element_type": "Title", "element_index": 7,
+         "chunk_char_count": 16},
+    ]
+    write_chunk_store(str(tmp_path), chunks, metadata)
+    store = ChunkStore.open(str(tmp_path))
+
+    assert store.to_lists() == (chunks, metadata)
+
+
+def test_segments_search_as_one_store_and_merge(tmp_path):
+    from rag.lexical import BM25Index, write_bm25_index
+    from rag.segments import SegmentSet, merge_segments, write_segment
+
+    root = str(tmp_path)
+    meta = lambda source, variant: {"source": source, "element_type": "NarrativeText", "element_index": 0,
+                                    "chunk_char_count": 10, "variant": variant}
+    texts = ["911 GT3 track", "Carrera S cabin", "GT3 RS wing", "Turbo S torque"]
+    metadata = [meta("a.pdf", "GT3"), meta("a.pdf", "Carrera S"), meta("b.pdf", "GT3"), meta("c.pdf", "Turbo S")]
+    vectors = np.eye(4, 8, dtype=np.float32)
+
+    segset = SegmentSet(dimension=8)
+    for rows, ids in (([0, 1], [0, 1]), ([2, 3], [5, 6])):
+        segset.segments.append(write_segment(root, segset.next_name(), [texts[r] for r in rows],
+                                             [metadata[r] for r in rows], vectors[rows], np.array(ids)))
+        segset.save(root)
+    segset.add_tombstones(np.array([1]))
+    segset.save(root)
+
+    store = open_vector_store(root)
+    assert store.store.texts() == texts
+    assert [store.store.metadata(row) for row in range(4)] == metadata  # vocab codes remapped across segments
+    assert list(store.store.columns["deleted"]) == [False, True, False, False]
+    gt3 = store.store.code("variants", "GT3")
+    assert list(store.store.columns["variant_id"][np.array([0, 2, 3])] == gt3) == [True, True, False]
+    assert list(store.store.rows_for_ids(np.array([6, 1, 3]))) == [3, 1, -1]
+    _, ids = store.index.search(vectors[[2]], 2)
+    assert ids[0, 0] == 5
+
+    write_bm25_index(root + "/bm25_all", texts)
+    single, multi = BM25Index(root + "/bm25_all").search("gt3 wing", 4), store.lexical.search("gt3 wing", 4)
+    assert list(single[0]) == list(multi[0]) and np.allclose(single[1], multi[1])
+
+    merge_segments(root, segset, [entry["name"] for entry in segset.segments])
+    merged = open_vector_store(root)
+    assert merged.num_segments == 1 and len(segset.tombstones) == 0
+    assert list(merged.store.columns["chunk_id"]) == [0, 5, 6]
+
+
+def test_store_version_publishes_and_inconsistent_segment_is_refused(tmp_path):
+    from rag.segments import SegmentSet, segment_path, store_version, write_segment
+
+    root = str(tmp_path)
+    assert store_version(root) is None
+    meta = {"source": "a.pdf", "element_type": "NarrativeText", "element_index": 0, "chunk_char_count": 10}
+    segset = SegmentSet(dimension=8)
+    entry = write_segment(root, segset.next_name(), ["911 GT3", "Turbo S"], [meta, meta],
+                          np.eye(2, 8, dtype=np.float32), np.array([0, 1]))
+    segset.segments.append(entry)
+    segset.save(root)
+    first = store_version(root)
+    assert first == open_vector_store(root).version
+
+    segset.add_tombstones(np.array([1]))
+    segset.save(root)
+    assert store_version(root) not in (None, first)
+
+    # Vectors truncated behind the store's back: refused at load instead of searched misaligned
+    np.save(os.path.join(segment_path(root, entry["name"]), "vectors.npy"), np.eye(1, 8, dtype=np.float32))
+    with pytest.raises(ValueError, match="inconsistent"):
+        open_vector_store(root)
+
+
+def test_manifest_is_published_with_its_segments(tmp_path):
+    from rag.manifest import Manifest
+    from rag.segments import SegmentSet, write_segment
+
+    root, doc = str(tmp_path), tmp_path / "a.txt"
+    doc.write_text("911 GT3")
+    meta = {"source": "a.txt", "element_type": "NarrativeText", "element_index": 0, "chunk_char_count": 7}
+    manifest = Manifest()
+    segset = SegmentSet(dimension=8)
+    ids = manifest.allocate(1)
+    manifest.record("a.txt", str(doc), "hash-1", ids)
+    segset.segments.append(write_segment(root, segset.next_name(), ["911 GT3"], [meta],
+                                         np.eye(1, 8, dtype=np.float32), ids))
+    segset.save(root, manifest)
+    segset.save(root)  # e.g. a merge: the published manifest stays referenced
+    published = SegmentSet.load(root)
+    assert published.load_manifest(root).files == manifest.files
+
+    # A run that wrote its segment but crashed before publishing: neither the store nor the manifest moved,
+    # so the next run re-ingests a.txt instead of serving its new chunks next to the old ones
+    ids = manifest.allocate(1)
+    manifest.record("a.txt", str(doc), "hash-2", ids)
+    write_segment(root, segset.next_name(), ["911 GT3 RS"], [meta], np.eye(1, 8, dtype=np.float32), ids)
+    reloaded = SegmentSet.load(root)
+    assert len(reloaded.segments) == 1 and open_vector_store(root).store.texts() == ["911 GT3"]
+    assert reloaded.load_manifest(root).files["a.txt"]["hash"] == "hash-1"
+    assert reloaded.load_manifest(root).next_chunk_id == 1
+
+    first = reloaded.manifest_file
+    reloaded.save(root, manifest)
+    reloaded.save(root, manifest)  # two generations on, the first manifest file is no longer referenced
+    assert first not in os.listdir(root) and reloaded.manifest_file in os.listdir(root)
+
+
+def test_spec_store_is_published_with_its_segments(tmp_path):
+    from rag.segments import SegmentSet, write_segment
+    from rag.spec_store import SpecStore, update_spec_store, write_spec_store
+
+    root, staging = str(tmp_path), str(tmp_path / "specs-staging.sqlite")
+    meta = {"source": "a.pdf", "element_type": "NarrativeText", "element_index": 0, "chunk_char_count": 30}
+    segset = SegmentSet(dimension=8)
+    chunks = ["The 911 Turbo S produces 650 PS."]
+    segset.segments.append(write_segment(root, segset.next_name(), chunks, [meta],
+                                         np.eye(1, 8, dtype=np.float32), np.array([0])))
+    write_spec_store(staging, chunks, [meta], [0])
+    segset.save(root, spec_store=staging)
+    first = open_vector_store(root).spec_store
+    assert os.path.basename(first) == "specs-000001.sqlite" and not os.path.exists(staging)
+
+    # The next run stages a changed copy; until segments.json is replaced, readers see the old specs only
+    chunks = ["The 911 Turbo S now produces 650 PS (478 kW)."]
+    update_spec_store(staging, first, chunks, [meta], [1], deleted_ids=[0])
+    segset.add_tombstones(np.array([0]))
+    segset.segments.append(write_segment(root, segset.next_name(), chunks, [meta],
+                                         np.eye(1, 8, dtype=np.float32), np.array([1])))
+    assert open_vector_store(root).spec_store == first
+    assert [row["chunk_id"] for row in SpecStore(first).lookup("Turbo S", "power")] == [0]
+
+    segset.save(root, spec_store=staging)
+    second = open_vector_store(root).spec_store
+    assert second != first and {row["chunk_id"] for row in SpecStore(second).lookup("Turbo S", "power")} == {1}
+    segset.save(root)  # a merge keeps the published spec store; the first one leaves the grace period
+    assert open_vector_store(root).spec_store == second and not os.path.exists(first)
 
 
 def test_retrieved_chunks_not_redundant(retriever):
@@ -94,7 +237,6 @@ def test_retrieved_chunks_not_redundant(retriever):
     assert duplicate_ratio < 0.3
 
 
-
 # ---------------------------------------------------------
 # Relevance tests (robust)
 # ---------------------------------------------------------
@@ -177,6 +319,385 @@ def test_retrieval_supports_answer_dimensions(retriever):
     assert covered >= 2
 
 
+# ---------------------------------------------------------
+# Batched retrieval
+# ---------------------------------------------------------
+def test_retrieve_batch_matches_single(retriever):
+    queries = [
+        "Porsche 911 Turbo S horsepower",
+        "Porsche 911 GT3 RS aerodynamics",
+        "Recipe for Italian pizza",
+    ]
+    batched = retriever.retrieve_batch(queries)
+
+    assert len(batched) == len(queries)
+    for query, results in zip(queries, batched):
+        single = retriever.retrieve(query)
+        assert [r["content"] for r in results] == [r["content"] for r in single]
+        assert [r["score"] for r in results] == pytest.approx([r["score"] for r in single], abs=1e-5)
+
+
+def test_filtered_retrieval_only_returns_matching_chunks(retriever):
+    results = retriever.retrieve("Porsche 911 engine power", filters={"variant": "GT3"})
+    assert all(r["metadata"].get("variant") == "GT3" for r in results)
+
+    assert retriever.retrieve("Porsche 911 engine power", filters={"source": "missing.pdf"}) == []
+
+
+@pytest.mark.parametrize("mode", INDEX_MODES)
+def test_id_restricted_search_works_for_every_index_mode(mode):
+    from rag.index_factory import MultiIndex, build_index
+
+    rng = np.random.default_rng(0)
+    centers = rng.standard_normal((20, 32))  # clustered, like real chunk embeddings, so PQ codes stay usable
+    vectors = (centers[rng.integers(0, 20, 400)] + 0.3 * rng.standard_normal((400, 32))).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    chunk_ids = np.arange(400, dtype=np.int64) * 3
+    index, info = build_index(vectors, mode=mode, ids=chunk_ids)
+    assert info["mode"] == mode
+
+    allowed = chunk_ids[::4]  # the broad-filter path, i.e. above SUBSET_SCAN_MAX
+    queries = vectors[1:40:4]  # none of them allowed, so no hit is the query itself
+    distances, ids = MultiIndex([index], 32).search(queries, 10, allowed)
+    assert ids.shape == (10, 10) and np.isin(ids, allowed).all()
+    assert np.all(np.diff(distances, axis=1) <= 1e-6)
+    # Compressed / approximate modes may rank the exact best hit lower, but should still find it
+    exact = chunk_ids[np.argmax(queries @ vectors[::4].T, axis=1) * 4]
+    assert np.mean([best in row for best, row in zip(exact, ids)]) >= 0.8
+
+
+# ---------------------------------------------------------
+# Hybrid / lexical retrieval
+# ---------------------------------------------------------
+def test_lexical_tokenizer_keeps_model_codes_and_units():
+    from rag.lexical import tokenize
+
+    tokens = tokenize("992.2 GT3 RS: 0-100 km/h, 465 lb-ft")
+    for expected in ["992.2", "gt3", "rs", "0-100", "km/h", "lb-ft", "100"]:
+        assert expected in tokens
+
+
+def test_hybrid_retrieval_covers_spec_terms(retriever):
+    if retriever.lexical is None:
+        pytest.skip("BM25 index not built")
+    results = retriever.retrieve("911 Turbo S torque Nm lb-ft", mode="hybrid")
+    assert results
+    assert all("fusion_score" in r for r in results)
+    assert any("nm" in r["content"].lower() or "lb-ft" in r["content"].lower() for r in results)
+
+
+# ---------------------------------------------------------
+# Reranking
+# ---------------------------------------------------------
+def test_reranker_cache_skips_repeated_pairs(retriever):
+    from rag.reranker import Reranker
+
+    reranker = Reranker()
+    results = retriever.retrieve("Porsche 911 Turbo S horsepower")
+    ids = [r["chunk_id"] for r in results]
+    texts = [r["content"] for r in results]
+
+    first = reranker.score("Porsche 911 Turbo S horsepower", ids, texts)
+    second = reranker.score("porsche 911  turbo s horsepower", ids, texts)
+
+    assert np.allclose(first, second)
+    assert reranker.hits == len(ids)
+
+
+# ---------------------------------------------------------
+# Query embedding cache
+# ---------------------------------------------------------
+def test_embedding_cache_ignores_case_and_whitespace(retriever, tmp_path):
+    from rag.embedding_cache import QueryEmbeddingCache
+
+    retriever.embedding_cache = QueryEmbeddingCache(str(tmp_path / "queries.sqlite"))
+    try:
+        first = retriever.retrieve("Porsche 911 GT3 top speed")
+        second = retriever.retrieve("  porsche 911   gt3 TOP SPEED ")
+        assert [r["chunk_id"] for r in first] == [r["chunk_id"] for r in second]
+        assert retriever.embedding_cache.hits == 1
+        assert retriever.embedding_cache.misses == 1
+    finally:
+        retriever.embedding_cache = None
+
+
+# ---------------------------------------------------------
+# Context packing
+# ---------------------------------------------------------
+def test_pack_context_drops_duplicates_and_respects_budget():
+    from rag.context import pack_context
+
+    chunks = [
+        {"content": "The 911 Turbo S produces 650 PS. It reaches 330 km/h."},
+        {"content": "The 911 Turbo S produces 650 PS! Launch control is standard."},
+        {"content": "The Carrera T offers a manual gearbox. " * 50},
+    ]
+    count = lambda text: len(text.split())
+    packed = pack_context(chunks, token_budget=40, count_tokens=count)
+
+    assert packed.text.count("650 PS") == 1
+    assert count(packed.text) <= 40
+    assert [c["content"] for c in packed.chunks] == [c["content"] for c in chunks]
+
+
+# ---------------------------------------------------------
+# Spec store
+# ---------------------------------------------------------
+def test_spec_store_answers_plain_lookups_only(tmp_path):
+    from rag.spec_store import SpecStore, write_spec_store
+
+    chunks = [
+        "Model Power Torque 911 Carrera 385 PS 450 Nm 911 Turbo S 650 PS 800 Nm",
+        "The 911 Turbo S produces 650 PS (478 kW). Its top speed is 330 km/h.",
+    ]
+    metadata = [{"source": "specs.pdf", "element_type": "Table", "element_index": 0, "page": 4},
+                {"source": "brochure.pdf", "element_type": "NarrativeText", "element_index": 9, "page": 2}]
+    write_spec_store(str(tmp_path / "specs.sqlite"), chunks, metadata)
+    store = SpecStore(str(tmp_path / "specs.sqlite"))
+
+    result = store.answer("What is the Turbo S horsepower?")
+    assert "650 PS" in result["answer"] and "478 kW" in result["answer"]
+    assert {c["source"] for c in result["citations"]} == {"specs.pdf", "brochure.pdf"}
+    assert "330 km/h" in store.answer("Turbo S top speed")["answer"]
+    assert store.answer("Compare Carrera vs Turbo S power") is None
+    assert store.answer("GT3 torque") is None
+
+
+def test_spec_store_scopes_variants_to_their_table_rows(tmp_path):
+    from rag.spec_store import SpecStore, extract_specs, write_spec_store
+
+    table = ("Model | Power | Torque\n911 Carrera S | 480 PS | 530 Nm\nFerrari 296 GTB | 830 hp | 740 Nm\n"
+             "911 Turbo S | 650 PS | 800 Nm\nMcLaren Artura | 680 PS | 720 Nm")
+    specs = extract_specs(table, default_variant="Turbo S")
+    assert {(variant, value) for variant, metric, value, _, _ in specs if metric == "power"} == {
+        ("Carrera S", 480), (None, 830), ("Turbo S", 650), (None, 680)}
+
+    chunks = [table, "The Carrera S produces 640 hp on overboost."]
+    metadata = [{"source": "comparison.pdf", "element_type": "Table", "element_index": 0, "variant": "Turbo S"},
+                {"source": "forum.pdf", "element_type": "NarrativeText", "element_index": 3, "variant": "Carrera S"}]
+    write_spec_store(str(tmp_path / "specs.sqlite"), chunks, metadata)
+    store = SpecStore(str(tmp_path / "specs.sqlite"))
+
+    assert store.answer("Turbo S torque")["answer"] == "Porsche 911 Turbo S — torque: 800 Nm."
+    assert store.answer("Carrera S power") is None  # 480 PS and 640 hp are different figures
+
+
+def test_spec_store_keeps_variant_suffixes_apart(tmp_path):
+    from rag.spec_store import SpecStore, write_spec_store
+
+    chunks = ["The new 911 GT3 RS produces 525 PS.", "The Carrera T makes 385 PS.", "The GT3 R race car has 565 PS."]
+    metadata = [{"source": "brochure.pdf", "element_type": "NarrativeText", "element_index": i, "page": 1}
+                for i in range(3)]
+    write_spec_store(str(tmp_path / "specs.sqlite"), chunks, metadata)
+    store = SpecStore(str(tmp_path / "specs.sqlite"))
+
+    assert store.answer("GT3 horsepower?") is None  # only the GT3 RS figure is known
+    assert store.answer("GT3 RS horsepower?")["answer"] == "Porsche 911 GT3 RS — power: 525 PS."
+    assert store.answer("Carrera 4S power") is None
+    assert store.answer("Carrera T power")["answer"] == "Porsche 911 Carrera T — power: 385 PS."
+    assert store.answer("GT3 R power") is None  # suffix unknown to the grammar, in the question
+    assert all(row["value"] != 565 for row in store.lookup("GT3", "power"))  # ... and in the source
+
+
+# ---------------------------------------------------------
+# Generation: coalescing
+# ---------------------------------------------------------
+def test_single_flight_survives_a_cancelled_leader():
+    import asyncio
+    from rag.single_flight import SingleFlight
+
+    async def scenario():
+        flight, calls, release = SingleFlight(), [], asyncio.Event()
+
+        async def compute():
+            calls.append(len(calls))
+            await release.wait()
+            return {"answer": f"run {len(calls)}"}
+
+        leader = asyncio.create_task(flight.run("q", compute))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.run("q", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0.01)  # the follower retries as the new leader
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower, calls, flight.stats
+
+    result, calls, stats = asyncio.run(scenario())
+    assert result == {"answer": "run 2"} and len(calls) == 2
+    assert stats == {"leaders": 2, "followers": 1, "recomputed": 0}
+
+
+def test_single_flight_survives_a_cancelled_follower():
+    import asyncio
+    from rag.single_flight import SingleFlight
+
+    async def scenario():
+        flight, calls, release = SingleFlight(), [], asyncio.Event()
+
+        async def compute():
+            calls.append(1)
+            await release.wait()
+            return {"answer": "shared"}
+
+        leader = asyncio.create_task(flight.run("q", compute))
+        await asyncio.sleep(0)
+        cancelled, follower = (asyncio.create_task(flight.run("q", compute)) for _ in range(2))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+        results = await asyncio.gather(leader, follower)
+        results[0]["answer"] = "mutated"  # every caller gets its own copy
+        return results, calls
+
+    results, calls = asyncio.run(scenario())
+    assert results[1] == {"answer": "shared"} and len(calls) == 1
+
+
+def test_single_flight_followers_recompute_instead_of_reusing_a_shed_result():
+    import asyncio
+    from rag.single_flight import SingleFlight
+
+    async def scenario():
+        flight, release = SingleFlight(), asyncio.Event()
+
+        async def shed():  # e.g. a leader whose short deadline passed
+            await release.wait()
+            return {"answer": "passages", "degraded": "deadline"}
+
+        async def generate():
+            return {"answer": "generated"}
+
+        leader = asyncio.create_task(flight.run("q", shed))
+        await asyncio.sleep(0)
+        live = asyncio.create_task(flight.run("q", generate, reuse=lambda result: "degraded" not in result))
+        expired = asyncio.create_task(flight.run("q", generate))
+        await asyncio.sleep(0)
+        release.set()
+        return await asyncio.gather(leader, live, expired), flight.stats
+
+    (leader, live, expired), stats = asyncio.run(scenario())
+    assert leader["degraded"] == expired["degraded"] == "deadline"
+    assert live == {"answer": "generated"} and stats["recomputed"] == 1
+
+
+# ---------------------------------------------------------
+# Generation: admission control
+# ---------------------------------------------------------
+def test_scheduler_interactive_request_displaces_the_newest_queued_batch_request():
+    import asyncio
+    from rag.scheduler import BATCH, INTERACTIVE, GenerationScheduler, Overloaded
+
+    async def scenario():
+        scheduler, order = GenerationScheduler(slots=1, max_queue=2), []
+
+        async def request(name, priority):
+            await scheduler.acquire(priority)
+            order.append(name)
+            scheduler.release(0.01)
+
+        await scheduler.acquire(INTERACTIVE)
+        tasks = [asyncio.create_task(request(name, BATCH)) for name in ("batch-1", "batch-2")]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(request("interactive", INTERACTIVE)))
+        await asyncio.sleep(0)
+        scheduler.release(0.01)
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return scheduler, order, results
+
+    scheduler, order, results = asyncio.run(scenario())
+    assert order == ["interactive", "batch-1"]  # interactive first although it queued last
+    assert isinstance(results[1], Overloaded) and results[1].reason == "queue_full"
+    stats = scheduler.stats()
+    assert stats["shed"] == {"queue_full": 1, "deadline": 0} and stats["busy"] == 0 and stats["queue_depth"] == 0
+
+
+def test_scheduler_sheds_requests_that_cannot_start_before_their_deadline():
+    import asyncio
+    from rag.scheduler import MIN_SERVICE_SAMPLES, Deadline, GenerationScheduler, Overloaded
+
+    async def scenario():
+        scheduler = GenerationScheduler(slots=1, max_queue=4)
+        with pytest.raises(Overloaded, match="deadline"):
+            await scheduler.acquire(deadline=Deadline(-1))  # already expired
+
+        await scheduler.acquire()
+        with pytest.raises(Overloaded, match="deadline"):
+            await scheduler.acquire(deadline=Deadline(0.05))  # times out in the queue
+        assert scheduler.stats()["queue_depth"] == 0
+
+        for _ in range(MIN_SERVICE_SAMPLES):  # generations take about 1 s
+            scheduler.release(1.0)
+            await scheduler.acquire()
+        start = time.monotonic()
+        with pytest.raises(Overloaded, match="deadline"):
+            await scheduler.acquire(deadline=Deadline(0.5))  # expected wait 1 s: shed without queueing
+        assert time.monotonic() - start < 0.1
+        scheduler.release(1.0)
+        return scheduler.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["shed"]["deadline"] == 3 and stats["busy"] == 0
+
+
+def test_scheduler_returns_a_slot_granted_as_the_wait_times_out(monkeypatch):
+    import asyncio
+    from rag.scheduler import Deadline, GenerationScheduler, Overloaded
+
+    scheduler = GenerationScheduler(slots=1, max_queue=4)
+
+    async def granted_then_timeout(awaitable, timeout):
+        scheduler.release(0.01)  # the holder hands its slot to the queued request ...
+        raise asyncio.TimeoutError  # ... just as that request's wait times out
+
+    async def scenario():
+        await scheduler.acquire()
+        monkeypatch.setattr(asyncio, "wait_for", granted_then_timeout)
+        with pytest.raises(Overloaded, match="deadline"):
+            await scheduler.acquire(deadline=Deadline(5))
+
+    asyncio.run(scenario())
+    stats = scheduler.stats()
+    assert stats["busy"] == 0 and stats["queue_depth"] == 0  # the granted slot was returned, not leaked
+
+
+# ---------------------------------------------------------
+# Generation: refusal streaming
+# ---------------------------------------------------------
+def test_refusal_filter_catches_a_phrase_split_across_tokens():
+    from rag.refusal import RefusalFilter
+
+    refusal = RefusalFilter()
+    assert [refusal.feed(token) for token in ("I don", "'t know the GT3 ", "torque.")] == ["", "", ""]
+    assert refusal.refused and refusal.flush() == ""
+
+
+def test_refusal_filter_withholds_a_late_refusal_after_releasing_text():
+    from rag.refusal import RefusalFilter
+
+    refusal = RefusalFilter()
+    opening = "The 911 Turbo S uses a 3.7-litre twin-turbo flat six with variable turbine geometry. "
+    released = "".join(refusal.feed(word + " ") for word in opening.split())
+    assert released and opening.startswith(released)
+    released += refusal.feed("Its torque is not men") + refusal.feed("tioned here.")
+    assert refusal.refused and "not" not in released[len(opening) - 1:]
+    assert refusal.flush() == "" and refusal.feed("More text.") == ""
+
+
+def test_refusal_filter_releases_a_short_answer_on_flush():
+    from rag.refusal import RefusalFilter
+
+    refusal = RefusalFilter()
+    assert refusal.feed("The GT3 has ") + refusal.feed("510 PS.") == ""  # shorter than the hold-back
+    assert refusal.flush() == "The GT3 has 510 PS." and not refusal.refused
+    assert refusal.flush() == ""
+
+
 # ---------------------------------------------------------
 # Edge & performance
 # ---------------------------------------------------------